@@ -0,0 +1,68 @@
+"""
+Compare the tick cost of a small board and of a huge sparse board holding the same players.
+
+    python3 benchmarks/bench_board_size.py --players 8 --ticks 2000 --view-size 30 80
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import keys
+from server import GameBoard
+
+
+def measure(players, ticks, rows, cols, view_size):
+    random.seed(1)
+    game_board = GameBoard(None, rows, cols)
+    for i in range(players):
+        game_board.add_player(f"player{i}", chr(ord("A") + i), random.randint(0, rows - 1), random.randint(0, cols - 1))
+    actions = [keys.MOVE_UP, keys.MOVE_DOWN, keys.MOVE_LEFT, keys.MOVE_RIGHT,
+               keys.SHOOT_UP, keys.SHOOT_DOWN, keys.SHOOT_LEFT, keys.SHOOT_RIGHT]
+    view_rows, view_cols = min(view_size[0], rows), min(view_size[1], cols)
+    update_time = 0
+    snapshot_time = 0
+    message_time = 0
+    entities = 0
+    for tick in range(ticks):
+        for player_name, player in list(game_board.players.items()):
+            game_board.queue_action(player_name, random.choice(actions))
+            player.health = 100
+        start_time = time.perf_counter()
+        game_board.update()
+        update_time += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        snapshot = game_board.publish_snapshot()
+        snapshot_time += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for row, col in snapshot.player_positions.values():
+            view = (max(row - view_rows // 2, 0), max(col - view_cols // 2, 0), view_rows, view_cols)
+            entities += len(snapshot.to_message(view)["game_state"])
+        message_time += time.perf_counter() - start_time
+    return update_time, snapshot_time, message_time, entities, len(game_board.world.chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tick cost against the board size")
+    parser.add_argument("--players", default=8, type=int)
+    parser.add_argument("--ticks", default=2000, type=int)
+    parser.add_argument("--view-size", default=[30, 80], type=int, nargs=2)
+    args = parser.parse_args()
+
+    print(f"{args.ticks} ticks, {args.players} players, view {args.view_size[0]}x{args.view_size[1]}")
+    print(f"{'board':>13} {'update us':>10} {'snapshot us':>12} {'views us':>9} {'entities/view':>14} "
+          f"{'chunks':>7}")
+    for rows, cols in ((30, 80), (1000, 1000), (10000, 10000)):
+        update_time, snapshot_time, message_time, entities, chunks = measure(
+            args.players, args.ticks, rows, cols, args.view_size)
+        print(f"{f'{rows}x{cols}':>13} {update_time * 1e6 / args.ticks:10.1f} "
+              f"{snapshot_time * 1e6 / args.ticks:12.1f} {message_time * 1e6 / args.ticks:9.1f} "
+              f"{entities / args.ticks / args.players:14.1f} {chunks:7}")
+
+
+if __name__ == "__main__":
+    main()
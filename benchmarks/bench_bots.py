@@ -0,0 +1,76 @@
+"""
+Measure what bots cost per tick, next to the cost of a single distance field flood fill.
+
+    python3 benchmarks/bench_bots.py --bots 100 --ticks 500
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import keys
+from bots import DistanceField
+from server import GameBoard
+
+
+def measure(bots, ticks, rows, cols):
+    random.seed(1)
+    game_board = GameBoard(None, rows, cols)
+    game_board.add_player("human", "@", rows // 2, cols // 2)
+    for bot_number in range(bots):
+        game_board.bot_controller.add_bot(f"bot{bot_number}", chr(0x100 + bot_number), random.randint(0, rows - 1),
+                                          random.randint(0, cols - 1))
+    actions = [keys.MOVE_UP, keys.MOVE_DOWN, keys.MOVE_LEFT, keys.MOVE_RIGHT]
+    decide = game_board.bot_controller.decide
+    decide_time = 0
+    update_time = 0
+
+    def timed_decide():
+        nonlocal decide_time
+        start_time = time.perf_counter()
+        decide()
+        decide_time += time.perf_counter() - start_time
+
+    game_board.bot_controller.decide = timed_decide
+    for tick in range(ticks):
+        # the human wanders around, so the shared field is redone on most ticks
+        game_board.queue_action("human", random.choice(actions))
+        # nobody dies, so the bots keep chasing the human for the whole run
+        for player in game_board.players.values():
+            player.health = 10 ** 6
+        start_time = time.perf_counter()
+        game_board.update()
+        update_time += time.perf_counter() - start_time
+        game_board.publish_snapshot()
+    return decide_time / ticks, update_time / ticks
+
+
+def measure_field(rows, cols, repeats=200):
+    game_board = GameBoard(None, rows, cols)
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        DistanceField(game_board, rows // 2, cols // 2)
+    return (time.perf_counter() - start_time) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark server-side bots")
+    parser.add_argument("--bots", default=100, type=int)
+    parser.add_argument("--ticks", default=500, type=int)
+    parser.add_argument("--game-size", default=[120, 200], type=int, nargs=2)
+    args = parser.parse_args()
+
+    field_time = measure_field(*args.game_size)
+    print(f"one distance field: {field_time * 1e3:.2f} ms")
+    print(f"{'bots':>5} {'decide ms/tick':>15} {'update ms/tick':>15}")
+    for bots in sorted({1, 10, args.bots}):
+        decide_time, update_time = measure(bots, args.ticks, *args.game_size)
+        print(f"{bots:5} {decide_time * 1e3:15.2f} {update_time * 1e3:15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Compare wire bytes and CPU cost of the game_state frames with and without connection compression.
+
+    python3 benchmarks/bench_compression.py --players 8 --frames 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import keys
+from json_socket import COMPRESSION_DICTIONARY, COMPRESSION_LEVEL, COMPRESSION_THRESHOLD, INT_SIZE
+from server import GameBoard
+
+
+def generate_frames(players, frames, rows, cols):
+    random.seed(1)
+    game_board = GameBoard(None, rows, cols)
+    for i in range(players):
+        game_board.add_player(f"player{i}", chr(ord("A") + i), random.randint(0, rows - 1), random.randint(0, cols - 1))
+    actions = [keys.MOVE_UP, keys.MOVE_DOWN, keys.MOVE_LEFT, keys.MOVE_RIGHT,
+               keys.SHOOT_UP, keys.SHOOT_DOWN, keys.SHOOT_LEFT, keys.SHOOT_RIGHT]
+    encoded = []
+    for tid in range(frames):
+        for player_name, player in list(game_board.players.items()):
+            game_board.queue_action(player_name, random.choice(actions))
+            player.health = 100
+        game_board.update()
+        message = game_board.publish_snapshot().to_message()
+        message["tid"] = [tid, "self"]
+        encoded.append(json.dumps(message).encode())
+    return encoded
+
+
+def measure(name, frames, make_compressor, make_decompressor):
+    compressor = make_compressor() if make_compressor else None
+    decompressor = make_decompressor() if make_decompressor else None
+    wire_bytes = 0
+    compress_time = 0
+    decompress_time = 0
+    for frame in frames:
+        payload = frame
+        if compressor is not None and len(frame) >= COMPRESSION_THRESHOLD:
+            start_time = time.perf_counter()
+            payload = compressor(frame)
+            compress_time += time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            assert decompressor(payload) == frame
+            decompress_time += time.perf_counter() - start_time
+        wire_bytes += INT_SIZE + len(payload)
+    return name, wire_bytes, compress_time, decompress_time
+
+
+def stream(zdict):
+    def make_compressor():
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, **zdict)
+        return lambda frame: compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def make_decompressor():
+        return zlib.decompressobj(**zdict).decompress
+
+    return make_compressor, make_decompressor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark connection compression on game_state frames")
+    parser.add_argument("--players", default=8, type=int)
+    parser.add_argument("--frames", default=2000, type=int)
+    parser.add_argument("--game-size", default=[30, 80], type=int, nargs=2)
+    args = parser.parse_args()
+
+    frames = generate_frames(args.players, args.frames, *args.game_size)
+    results = [
+        measure("plain JSON", frames, None, None),
+        measure("zlib per frame", frames,
+                lambda: lambda frame: zlib.compress(frame, COMPRESSION_LEVEL), lambda: zlib.decompress),
+        measure("zlib stream", frames, *stream({})),
+        measure("zlib stream + dictionary", frames, *stream({"zdict": COMPRESSION_DICTIONARY})),
+    ]
+    plain_bytes = results[0][1]
+    print(f"{len(frames)} frames, {args.players} players, mean plain frame {plain_bytes / len(frames):.0f} bytes")
+    print(f"{'mode':28} {'bytes/frame':>12} {'ratio':>7} {'compress us/frame':>18} {'decompress us/frame':>20}")
+    for name, wire_bytes, compress_time, decompress_time in results:
+        print(f"{name:28} {wire_bytes / len(frames):12.1f} {plain_bytes / wire_bytes:7.2f} "
+              f"{compress_time * 1e6 / len(frames):18.1f} {decompress_time * 1e6 / len(frames):20.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+How late game states arrive over a simulated WAN link, over TCP and over UDP.
+
+Each run starts a server and two clients that join the same match: one connects straight to the server, the other
+through netsim.py. A game state's delay is how much later the proxied client got it than the direct one.
+
+    python3 benchmarks/bench_netsim.py --seconds 5
+"""
+
+import argparse
+import os
+import select
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from json_socket import JSONSocket
+from json_datagram_socket import JSONDatagramSocket
+from netsim import NetworkSimulator, LinkConditions
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server.py")
+
+SCENARIOS = [
+    ("no conditions", LinkConditions()),
+    ("50ms +-10ms", LinkConditions(latency=0.05, jitter=0.01)),
+    ("50ms, 5% drop", LinkConditions(latency=0.05, drop=0.05)),
+    ("2 KB/s", LinkConditions(bandwidth=2000)),
+]
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def play(port, player_name, udp, seconds, arrivals):
+    """
+    Join a match and note when each tick's game state arrived, in arrivals, until the time is up.
+    """
+    tcp_socket = JSONSocket.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+    tcp_socket.connect(("127.0.0.1", port))
+    tcp_socket.send_json({"type": "handshake", "player_name": player_name, "player_character": player_name[0],
+                          "compression": [], "udp": udp})
+    ack = tcp_socket.recv_json()
+    udp_socket = None
+    if udp:
+        udp_socket = JSONDatagramSocket.create_socket()
+        udp_socket.connect(("127.0.0.1", port))
+    last_hello = 0
+    end_time = None
+    while end_time is None or time.monotonic() < end_time:
+        if udp_socket is not None and time.monotonic() - last_hello > 1:
+            udp_socket.send_json({"type": "udp_hello", "token": ack["udp_token"]})
+            last_hello = time.monotonic()
+        sockets = [tcp_socket] + ([udp_socket.sock] if udp_socket is not None else [])
+        readable = select.select(sockets, [], [], 0.1)[0]
+        messages = []
+        if tcp_socket in readable:
+            message = tcp_socket.recv_json()
+            if message is None:
+                break
+            messages.append(message)
+        if udp_socket is not None and udp_socket.sock in readable:
+            messages.extend(data for data, address in udp_socket.recv_all() if data is not None)
+        for message in messages:
+            if message["type"] == "game_start":
+                end_time = time.monotonic() + seconds
+            elif message["type"] == "ping":
+                tcp_socket.send_json({"type": "pong", "tid": message["tid"], "sent_at": message.get("sent_at")})
+            elif message["type"] == "game_state":
+                arrivals.setdefault(message["tick"], time.monotonic())
+    tcp_socket.close()
+    if udp_socket is not None:
+        udp_socket.close()
+
+
+def measure(conditions, udp, seconds):
+    """
+    :return: the delays of the game states the proxied client got, and the fraction of ticks it got
+    """
+    server_port = free_port()
+    proxy_port = free_port()
+    server = subprocess.Popen([sys.executable, SERVER_PATH, "--port", str(server_port), "--max-players", "2",
+                               "--udp", "--matches", "1"],
+                              stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    simulator = None
+    try:
+        # wait for the server to listen
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", server_port)).close()
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+        simulator = NetworkSimulator(proxy_port, "127.0.0.1", server_port, conditions).start_in_thread()
+        direct_arrivals = {}
+        proxied_arrivals = {}
+        players = [threading.Thread(target=play, args=(server_port, "direct", udp, seconds, direct_arrivals)),
+                   threading.Thread(target=play, args=(proxy_port, "proxied", udp, seconds, proxied_arrivals))]
+        for player in players:
+            player.start()
+        for player in players:
+            player.join()
+    finally:
+        if simulator is not None:
+            simulator.stop()
+        server.kill()
+        server.wait()
+    delays = [arrival - direct_arrivals[tick] for tick, arrival in proxied_arrivals.items() if tick in direct_arrivals]
+    return delays, len(delays) / max(len(direct_arrivals), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark game state delays through the network simulator")
+    parser.add_argument("--seconds", default=5, type=float, help="How long each run measures")
+    args = parser.parse_args()
+
+    print(f"{'conditions':16} {'transport':>9} {'mean ms':>8} {'p95 ms':>8} {'max ms':>8} {'ticks got':>10}")
+    for name, conditions in SCENARIOS:
+        for udp in (False, True):
+            delays, received = measure(conditions, udp, args.seconds)
+            transport = "udp" if udp else "tcp"
+            if not delays:
+                print(f"{name:16} {transport:>9} {'no game states':>36}")
+                continue
+            print(f"{name:16} {transport:>9} {sum(delays) / len(delays) * 1000:8.1f} "
+                  f"{percentile(delays, 0.95) * 1000:8.1f} {max(delays) * 1000:8.1f} {received:10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Compare the client's renderers: time per frame and bytes written to the terminal, drawing the same frames of players
+and projectiles moving around the arena map. Each renderer draws in a pseudo terminal of its own.
+
+    python3 benchmarks/bench_renderers.py --frames 300 --players 20 --projectiles 100
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import pty
+import random
+import select
+import struct
+import sys
+import termios
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from renderers import RENDERERS, PLAYERS_HEALTH_WIDTH
+from terrain import Terrain, walls_in_view, WALL_GLYPH
+
+MAP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "maps", "arena.txt")
+PROJECTILE_GLYPHS = ("·", "*", "o")
+
+
+def frames(terrain, count, players, projectiles):
+    """
+    :return: count lists of (row, col, character, color) cells, the walls and what moved on them
+    """
+    random.seed(1)
+    wall_cells = [(row, col, WALL_GLYPH, 0) for row, col in walls_in_view(terrain.wall_columns(), 0, 0,
+                                                                          terrain.rows, terrain.cols)]
+    open_cells = [(row, col) for row in range(terrain.rows) for col in range(terrain.cols)
+                  if not terrain.is_wall(row, col)]
+    moving = [list(random.choice(open_cells)) for _ in range(players + projectiles)]
+    steps = ((-1, 0), (1, 0), (0, -1), (0, 1))
+    for _ in range(count):
+        cells = list(wall_cells)
+        for i, position in enumerate(moving):
+            row_step, col_step = random.choice(steps)
+            row = position[0] + row_step
+            col = position[1] + col_step
+            if 0 <= row < terrain.rows and 0 <= col < terrain.cols and not terrain.is_wall(row, col):
+                position[0] = row
+                position[1] = col
+            if i < players:
+                cells.append((position[0], position[1], chr(ord("A") + i % 26), 1 + i % 200))
+            else:
+                cells.append((position[0], position[1], PROJECTILE_GLYPHS[i % 3], 0))
+        yield cells
+
+
+def draw(renderer_name, terrain, args, report_fd):
+    renderer = RENDERERS[renderer_name](terrain.rows, terrain.cols)
+    frame_times = []
+    players_health = [f"player{i:<4}: 100" for i in range(args.players)]
+    for frame, cells in enumerate(frames(terrain, args.frames, args.players, args.projectiles)):
+        start_time = time.perf_counter()
+        renderer.draw_board(cells)
+        renderer.draw_players_health(players_health)
+        renderer.draw_status(f"frame {frame}")
+        renderer.present()
+        frame_times.append(time.perf_counter() - start_time)
+    renderer.close()
+    os.write(report_fd, json.dumps(frame_times).encode())
+    os.close(report_fd)
+
+
+def measure(renderer_name, terrain, args):
+    """
+    :return: the frame times and the bytes the renderer wrote to its terminal
+    """
+    report_reader, report_writer = os.pipe()
+    pid, terminal_fd = pty.fork()
+    if pid == 0:
+        os.close(report_reader)
+        os.environ["TERM"] = "xterm-256color"
+        try:
+            draw(renderer_name, terrain, args, report_writer)
+        finally:
+            os._exit(0)
+    os.close(report_writer)
+    fcntl.ioctl(terminal_fd, termios.TIOCSWINSZ,
+                struct.pack("HHHH", terrain.rows + 5, terrain.cols + 2 + PLAYERS_HEALTH_WIDTH, 0, 0))
+    written = 0
+    report = b""
+    open_fds = [terminal_fd, report_reader]
+    while open_fds:
+        for fd in select.select(open_fds, [], [])[0]:
+            try:
+                data = os.read(fd, 65536)
+            except OSError:
+                # the terminal is gone once the renderer exited
+                data = b""
+            if not data:
+                open_fds.remove(fd)
+            elif fd == terminal_fd:
+                written += len(data)
+            else:
+                report += data
+    os.waitpid(pid, 0)
+    os.close(terminal_fd)
+    os.close(report_reader)
+    return json.loads(report), written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the curses renderer against the ANSI one")
+    parser.add_argument("--frames", default=300, type=int)
+    parser.add_argument("--players", default=20, type=int)
+    parser.add_argument("--projectiles", default=100, type=int)
+    args = parser.parse_args()
+
+    terrain = Terrain.load(MAP_PATH)
+    print(f"{args.frames} frames on a {terrain.rows}x{terrain.cols} board, {args.players} players and "
+          f"{args.projectiles} projectiles moving")
+    print(f"{'renderer':>8} {'ms/frame':>9} {'p99 ms':>7} {'first frame bytes':>18} {'bytes/frame':>12}")
+    for renderer_name in RENDERERS:
+        frame_times, written = measure(renderer_name, terrain, args)
+        frame_times_sorted = sorted(frame_times[1:])
+        p99 = frame_times_sorted[int(len(frame_times_sorted) * 0.99)]
+        # the bytes of the first frame aren't reported apart, run it once with a single frame to see them
+        first_frame_times, first_frame_written = measure(renderer_name, terrain,
+                                                         argparse.Namespace(**{**vars(args), "frames": 1}))
+        print(f"{renderer_name:>8} {sum(frame_times) / len(frame_times) * 1e3:9.3f} {p99 * 1e3:7.3f} "
+              f"{first_frame_written:18} {(written - first_frame_written) / (len(frame_times) - 1):12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Age of the newest game state a client can draw, over loopback UDP with simulated loss.
+
+UDP frames are really sent through JSONDatagramSocket. Loopback TCP never loses segments, so the TCP row models
+head-of-line blocking instead: a lost frame is retransmitted after --rto seconds and holds back every frame behind it.
+
+    python3 benchmarks/bench_udp_loss.py --loss 0.05 --frames 300
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from json_datagram_socket import JSONDatagramSocket
+
+TICK = 1 / 15
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure_udp(frames, loss):
+    receiver = JSONDatagramSocket.create_socket()
+    receiver.bind(("127.0.0.1", 0))
+    sender = JSONDatagramSocket.create_socket(loss)
+    sender.connect(receiver.getsockname())
+    newest_sent_at = None
+    ages = []
+    start_time = time.monotonic()
+    for tick in range(frames):
+        sender.send_json({"type": "game_state", "sent_at": time.monotonic(), "tick": tick})
+        time.sleep(max(0.0, start_time + (tick + 1) * TICK - time.monotonic()))
+        for data, address in receiver.recv_all():
+            newest_sent_at = data["sent_at"]
+        if newest_sent_at is not None:
+            ages.append(time.monotonic() - newest_sent_at)
+    sender.close()
+    receiver.close()
+    return ages
+
+
+def model_tcp(frames, loss, rto, one_way_delay):
+    # frame i is sent at i * TICK, it can't be delivered before any earlier frame
+    delivered_at = []
+    blocked_until = 0.0
+    for tick in range(frames):
+        arrival = tick * TICK + one_way_delay
+        if random.random() < loss:
+            arrival += rto
+        blocked_until = max(blocked_until, arrival)
+        delivered_at.append(blocked_until)
+    ages = []
+    newest = -1
+    for tick in range(frames):
+        now = (tick + 1) * TICK
+        while newest + 1 < frames and delivered_at[newest + 1] < now:
+            newest += 1
+        if newest >= 0:
+            ages.append(now - newest * TICK)
+    return ages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark game state staleness under packet loss")
+    parser.add_argument("--loss", default=0.05, type=float)
+    parser.add_argument("--frames", default=300, type=int)
+    parser.add_argument("--rto", default=0.2, type=float, help="TCP retransmission timeout, 200ms minimum on Linux")
+    args = parser.parse_args()
+    random.seed(1)
+
+    results = [("udp (measured)", measure_udp(args.frames, args.loss)),
+               ("tcp (modelled)", model_tcp(args.frames, args.loss, args.rto, 0.0))]
+    print(f"{args.frames} frames at {1 / TICK:.0f} Hz, {args.loss:.0%} loss")
+    print(f"{'transport':16} {'mean ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, ages in results:
+        print(f"{name:16} {sum(ages) / len(ages) * 1000:8.1f} {percentile(ages, 0.95) * 1000:8.1f} "
+              f"{percentile(ages, 0.99) * 1000:8.1f} {max(ages) * 1000:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Measure what fog of war costs per tick: building every player's game state with and without their sight,
+on a board made of copies of the arena map.
+
+    python3 benchmarks/bench_visibility.py --ticks 200 --fog-radius 12 --tiles 4
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import keys
+from server import GameBoard
+from terrain import Terrain
+from visibility import VisibilityCache
+
+MAP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "maps", "arena.txt")
+
+
+def tiled_terrain(tiles):
+    arena = Terrain.load(MAP_PATH)
+    terrain = Terrain(arena.rows * tiles, arena.cols * tiles)
+    for row in range(terrain.rows):
+        for col in range(terrain.cols):
+            if arena.is_wall(row % arena.rows, col % arena.cols):
+                terrain.set_wall(row, col)
+    return terrain
+
+
+def measure(players, ticks, terrain, fog_radius):
+    random.seed(1)
+    game_board = GameBoard(None, terrain.rows, terrain.cols, terrain=terrain)
+    visibility = VisibilityCache(game_board)
+    for i in range(players):
+        game_board.add_player(f"player{i}", chr(0x100 + i), *game_board.random_open_cell())
+    actions = [keys.MOVE_UP, keys.MOVE_DOWN, keys.MOVE_LEFT, keys.MOVE_RIGHT,
+               keys.SHOOT_UP, keys.SHOOT_DOWN, keys.SHOOT_LEFT, keys.SHOOT_RIGHT]
+    open_time = 0
+    fog_time = 0
+    open_entities = 0
+    fog_entities = 0
+    for tick in range(ticks):
+        for player_name, player in list(game_board.players.items()):
+            game_board.queue_action(player_name, random.choice(actions))
+            player.health = 100
+        game_board.update()
+        snapshot = game_board.publish_snapshot()
+        start_time = time.perf_counter()
+        for position in snapshot.player_positions.values():
+            open_entities += len(snapshot.to_message()["game_state"])
+        open_time += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for position in snapshot.player_positions.values():
+            fog_entities += len(snapshot.to_message(None, visibility.sight(*position, fog_radius))["game_state"])
+        fog_time += time.perf_counter() - start_time
+    return open_time / ticks, fog_time / ticks, open_entities / ticks / players, fog_entities / ticks / players
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fog of war against the number of players")
+    parser.add_argument("--ticks", default=200, type=int)
+    parser.add_argument("--fog-radius", default=12, type=int)
+    parser.add_argument("--tiles", default=4, type=int, help="Copies of the arena map along each side of the board")
+    args = parser.parse_args()
+
+    terrain = tiled_terrain(args.tiles)
+    print(f"{args.ticks} ticks on a {terrain.rows}x{terrain.cols} board, fog radius {args.fog_radius}")
+    print(f"{'players':>8} {'no fog ms/tick':>15} {'fog ms/tick':>12} {'entities/player':>16} {'seen/player':>12}")
+    for players in (10, 50, 200):
+        open_time, fog_time, open_entities, fog_entities = measure(players, args.ticks, terrain, args.fog_radius)
+        print(f"{players:8} {open_time * 1e3:15.2f} {fog_time * 1e3:12.2f} {open_entities:16.1f} "
+              f"{fog_entities:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
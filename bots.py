@@ -0,0 +1,178 @@
+"""
+Server-side bot players.
+
+Bots are regular players on the GameBoard without a connection, their inputs are queued from inside the tick.
+They chase a few shared targets: every target gets one distance field, a breadth-first flood fill around its cell
+that is only redone when the target moves, and each bot just steps to the neighbouring cell closer to its target.
+The cost of a tick is one flood fill per moving target plus a few lookups per bot, whatever the number of bots.
+"""
+
+import string
+from collections import deque
+import keys
+
+# how far around a target its distance field reaches, bots further away head straight for it
+FIELD_RADIUS = 32
+# bots shoot at a target in line with them and at most this far
+SHOOT_RANGE = 12
+# a shot appears on the cell next to the shooter and moves before it can hit, so a closer target can't be hit
+MIN_SHOOT_RANGE = 2
+
+BOT_CHARACTERS = string.ascii_letters + string.digits + "".join(chr(code) for code in range(0x3b1, 0x3ca))
+
+NEIGHBOURS = ((-1, 0, keys.MOVE_UP), (1, 0, keys.MOVE_DOWN), (0, -1, keys.MOVE_LEFT), (0, 1, keys.MOVE_RIGHT))
+
+
+class DistanceField:
+
+    def __init__(self, game_board, row, col, radius=FIELD_RADIUS):
+        """
+        Flood fill the cells within radius of a target.
+        :param game_board: the board, its passable_area decides where the fill goes
+        :param row: the target row
+        :param col: the target col
+        :param radius: how far from the target the field reaches
+        """
+        self.origin = (row, col)
+        self.top = max(row - radius, 0)
+        self.left = max(col - radius, 0)
+        self.height = height = min(row + radius, game_board.rows - 1) - self.top + 1
+        self.width = width = min(col + radius, game_board.cols - 1) - self.left + 1
+        size = height * width
+        # row-major cells, -1 until the fill reaches them and -2 for the ones it never can
+        self.distances = distances = [-1 if passable else -2
+                                      for passable in game_board.passable_area(self.top, self.left, height, width)]
+        start = (row - self.top) * width + (col - self.left)
+        distances[start] = 0
+        frontier = deque([start])
+        # the hot loop of the bots, neighbours are unrolled on the flat list
+        while frontier:
+            index = frontier.popleft()
+            distance = distances[index] + 1
+            if index >= width and distances[index - width] == -1:
+                distances[index - width] = distance
+                frontier.append(index - width)
+            if index + width < size and distances[index + width] == -1:
+                distances[index + width] = distance
+                frontier.append(index + width)
+            col_in_field = index % width
+            if col_in_field > 0 and distances[index - 1] == -1:
+                distances[index - 1] = distance
+                frontier.append(index - 1)
+            if col_in_field < width - 1 and distances[index + 1] == -1:
+                distances[index + 1] = distance
+                frontier.append(index + 1)
+
+    def distance(self, row, col):
+        """
+        :return: the number of steps from a cell to the target, None if the field doesn't reach it
+        """
+        field_row = row - self.top
+        field_col = col - self.left
+        if not (0 <= field_row < self.height and 0 <= field_col < self.width):
+            return None
+        distance = self.distances[field_row * self.width + field_col]
+        return distance if distance >= 0 else None
+
+
+class BotController:
+
+    def __init__(self, game_board):
+        self.game_board = game_board
+        self.bots = []
+        # target name -> its distance field, shared by every bot chasing that target
+        self.fields = {}
+
+    def add_bot(self, bot_name, character, row, col):
+        self.game_board.add_player(bot_name, character, row, col)
+        self.bots.append(bot_name)
+
+    def choose_targets(self):
+        """
+        Human players are the targets when there are any, otherwise the healthiest bot,
+        so the number of distance fields stays small.
+        :return: the names of the players bots chase
+        """
+        players = self.game_board.players
+        bot_names = set(self.bots)
+        humans = [player_name for player_name in players if player_name not in bot_names]
+        if humans:
+            return humans
+        living_bots = [bot_name for bot_name in self.bots if bot_name in players]
+        if not living_bots:
+            return []
+        return [max(living_bots, key=lambda bot_name: (players[bot_name].health, bot_name))]
+
+    def update_fields(self, targets):
+        players = self.game_board.players
+        for target in list(self.fields):
+            if target not in targets:
+                del self.fields[target]
+        for target in targets:
+            player = players[target]
+            field = self.fields.get(target)
+            if field is None or field.origin != (player.row, player.col):
+                self.fields[target] = DistanceField(self.game_board, player.row, player.col)
+
+    def decide(self):
+        """
+        Queue this tick's inputs for every living bot, called by the board at the start of the tick.
+        """
+        players = self.game_board.players
+        self.bots = [bot_name for bot_name in self.bots if bot_name in players]
+        targets = self.choose_targets()
+        self.update_fields(targets)
+        for bot_name in self.bots:
+            bot = players[bot_name]
+            candidates = [target for target in targets if target != bot_name]
+            if not candidates:
+                # the chased bot runs after whoever is closest instead
+                candidates = [player_name for player_name in players if player_name != bot_name]
+                if not candidates:
+                    continue
+            target_name = min(candidates, key=lambda player_name: abs(players[player_name].row - bot.row) +
+                                                                  abs(players[player_name].col - bot.col))
+            target = players[target_name]
+            shot = self.aim(bot, target)
+            if shot is not None:
+                # hold the position while the target is in the line of fire
+                self.game_board.queue_action(bot_name, shot)
+                continue
+            move = self.step(bot, target, self.fields.get(target_name))
+            if move is not None:
+                self.game_board.queue_action(bot_name, move)
+
+    def aim(self, bot, target):
+        if self.game_board.path_blocked(bot.row, bot.col, target.row, target.col):
+            return None
+        if bot.row == target.row and MIN_SHOOT_RANGE <= abs(bot.col - target.col) <= SHOOT_RANGE:
+            return keys.SHOOT_RIGHT if target.col > bot.col else keys.SHOOT_LEFT
+        if bot.col == target.col and MIN_SHOOT_RANGE <= abs(bot.row - target.row) <= SHOOT_RANGE:
+            return keys.SHOOT_DOWN if target.row > bot.row else keys.SHOOT_UP
+        return None
+
+    def step(self, bot, target, field):
+        distance = field.distance(bot.row, bot.col) if field is not None else None
+        if distance is None:
+            # out of the field's reach, head straight for the target along the longer axis
+            if abs(target.row - bot.row) >= abs(target.col - bot.col) and target.row != bot.row:
+                return keys.MOVE_DOWN if target.row > bot.row else keys.MOVE_UP
+            if target.col != bot.col:
+                return keys.MOVE_RIGHT if target.col > bot.col else keys.MOVE_LEFT
+            return None
+        if distance < MIN_SHOOT_RANGE:
+            # too close to shoot, back off, in line with the target if possible
+            backing_off = None
+            for row_step, col_step, action in NEIGHBOURS:
+                next_distance = field.distance(bot.row + row_step, bot.col + col_step)
+                if next_distance is None or next_distance <= distance:
+                    continue
+                if bot.row + row_step == target.row or bot.col + col_step == target.col:
+                    return action
+                backing_off = backing_off or action
+            return backing_off
+        for row_step, col_step, action in NEIGHBOURS:
+            next_distance = field.distance(bot.row + row_step, bot.col + col_step)
+            if next_distance is not None and next_distance < distance:
+                return action
+        return None
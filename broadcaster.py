@@ -0,0 +1,85 @@
+"""
+Sends published game snapshots to clients from a worker pool, off the simulation thread.
+"""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import REGISTRY
+
+DEFAULT_BROADCAST_WORKERS = 4
+
+SKIPPED_FRAMES = REGISTRY.counter("shooter_broadcast_skipped_frames_total",
+                                  "Snapshots replaced by a newer one before a slow client got them", ("client",))
+
+
+class GameStateBroadcaster:
+
+    def __init__(self, send, workers=DEFAULT_BROADCAST_WORKERS):
+        """
+        :param send: called as send(client, snapshot) on a worker thread, it encodes and writes the frame
+        :param workers: how many clients can be encoded and written to at the same time
+        """
+        self.send = send
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="broadcast")
+        self.lock = threading.Lock()
+        # the newest snapshot each client is still waiting for
+        self.pending = {}
+        # clients that currently have a worker draining their pending snapshot
+        self.busy = set()
+        self.failed = queue.SimpleQueue()
+
+    def publish(self, snapshot, clients):
+        """
+        Queue a snapshot for each client and return immediately.
+        A client that hasn't finished receiving the previous snapshot only gets the newest one,
+        and frames to the same client are always written by one worker at a time, in order.
+        :param snapshot: the snapshot to send
+        :param clients: the clients to send it to
+        """
+        for client in clients:
+            with self.lock:
+                if client in self.pending:
+                    SKIPPED_FRAMES.inc(1, (client.client_name,))
+                self.pending[client] = snapshot
+                if client in self.busy:
+                    continue
+                self.busy.add(client)
+            self.executor.submit(self.drain, client)
+
+    def drain(self, client):
+        while True:
+            with self.lock:
+                snapshot = self.pending.pop(client, None)
+                if snapshot is None:
+                    self.busy.discard(client)
+                    return
+            try:
+                self.send(client, snapshot)
+            except Exception as e:
+                with self.lock:
+                    self.pending.pop(client, None)
+                    self.busy.discard(client)
+                self.failed.put((client, e))
+                return
+
+    def failed_clients(self):
+        """
+        :return: the (client, exception) pairs whose send failed since the last call
+        """
+        failed = []
+        while True:
+            try:
+                failed.append(self.failed.get_nowait())
+            except queue.Empty:
+                return failed
+
+    def forget(self, client):
+        with self.lock:
+            self.pending.pop(client, None)
+
+    def shutdown(self):
+        """
+        Wait for every queued snapshot to be written and stop the workers.
+        """
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,50 @@
+"""
+Checksums of game states, so a client can tell when what it draws has drifted from the server's board.
+
+A game state's checksum is the sum, modulo 2**32, of a hash of each of its entities and of each player's health.
+A sum doesn't depend on the order, so the server adds up entity hashes it only computes again for the entities that
+moved or changed since the last tick, and a client with a view or fog of war gets the sum of what it was sent.
+Entities are hashed at their position on the board, a client with a view adds the view origin back.
+"""
+
+import struct
+import zlib
+
+CHECKSUM_MASK = 0xFFFFFFFF
+# row, col, glyph id or hash of the player character, color or GLYPH_MARKER
+ENTITY = struct.Struct(">iiII")
+HEALTH = struct.Struct(">i")
+# stands for the color of projectiles and powerups, which is in their glyph, so they never hash like a player
+GLYPH_MARKER = CHECKSUM_MASK
+
+
+def entity_hash(entity, top=0, left=0):
+    """
+    :param entity: a (row, col, glyph id) or (row, col, char, color) entity, a list is fine too
+    :param top: the first row of the view the entity's position is relative to
+    :param left: the first col of that view
+    :return: a hash of the entity at its place on the board
+    """
+    if len(entity) == 3:
+        return zlib.crc32(ENTITY.pack(entity[0] + top, entity[1] + left, entity[2], GLYPH_MARKER))
+    return zlib.crc32(ENTITY.pack(entity[0] + top, entity[1] + left, zlib.crc32(entity[2].encode()), entity[3]))
+
+
+def health_hash(player_name, health):
+    return zlib.crc32(HEALTH.pack(health), zlib.crc32(player_name.encode()))
+
+
+def players_health_checksum(players_health):
+    return sum(health_hash(player_name, health) for player_name, health in players_health.items()) & CHECKSUM_MASK
+
+
+def game_state_checksum(game_state, players_health, view_origin=(0, 0)):
+    """
+    What the client checks the checksum of a game state message against.
+    :param game_state: the entities of the message
+    :param players_health: the players_health of the message
+    :param view_origin: the view of the message, (0, 0) when it has none
+    """
+    top, left = view_origin
+    return (sum(entity_hash(entity, top, left) for entity in game_state) +
+            players_health_checksum(players_health)) & CHECKSUM_MASK
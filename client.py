@@ -2,20 +2,40 @@
 client program for a shooter game
 """
 
+from time import perf_counter
+# startup timings are measured from here, before the rest of the imports
+LAUNCHED_AT = perf_counter()
+
 import socket
-from ast import parse
 from select import select
 
-from json_socket import JSONSocket
+from json_socket import JSONSocket, COMPRESSION_METHOD
+from json_datagram_socket import JSONDatagramSocket
 import argparse
 import curses
-from time import sleep
+from collections import deque
+from time import sleep, monotonic
 import selectors
 from transaction import Transaction
 from client_transactions import *
+from latency import LatencyTracker, PING_INTERVAL
+from terrain import Terrain, walls_in_view, WALL_GLYPH
+from renderers import RENDERERS
+from checksum import game_state_checksum
 import keys
 
 ENABLE_DEBUG_BAR = False
+# how many of the latest inputs each input datagram repeats
+INPUT_REDUNDANCY = 4
+# re-send the udp_hello when no datagram arrived for this long
+UDP_HELLO_INTERVAL = 1
+# after losing the connection, how many times to try resuming the session and how long to wait between tries
+RECONNECT_ATTEMPTS = 10
+RECONNECT_DELAY = 1
+# cap on redraws per second, game states arriving faster only keep the newest for the next frame
+MAX_FPS = 30
+# frames read in one go before going back to input and rendering, so a flood can't starve them
+MAX_FRAMES_PER_READ = 64
 
 keys_mapping = {
     119: keys.MOVE_UP,  # 'w'
@@ -40,89 +60,67 @@ inverted_keys_mapping = {
 }
 
 class GameBoard:
-    player_count_label = "Players: "
-    player_count_max_size = 3
-    health_label = "Your health: "
-    health_max_size = 5
 
-    def __init__(self, game_client, rows, cols):
+    def __init__(self, game_client, rows, cols, renderer="curses"):
         """
         Initialize the game board
-        :param width: the width of the game board
-        :param height: the height of the game board
+        :param game_client: the game client
+        :param rows: the height of the game board
+        :param cols: the width of the game board
+        :param renderer: the name of the renderer to draw with, see renderers.py
         """
         self.game_state = None
+        # top left corner of the board the game state is relative to, moves with the player on big boards
+        self.view_origin = (0, 0)
         print(f"Initializing game board with size {rows}x{cols}")
         self.game_client = game_client
         self.rows = rows
         self.cols = cols
-        self.stdscr = curses.initscr()
-        curses.curs_set(0)
-        curses.noecho()
-        curses.cbreak()
-        curses.start_color()
-        curses.use_default_colors()
-        for i in range(0, curses.COLORS):
-            curses.init_pair(i + 1, i, -1)
-        self.stdscr.keypad(True)
-        self.outer_board = curses.newwin(rows + 2, cols + 2, 0, 0)
-        self.main_board = curses.newwin(rows, cols, 1, 1)
-        self.outer_board.border()
-        mid_col = (cols + 2) // 2
-        self.player_count_label = curses.newwin(1, mid_col, rows + 2, 0)
-        self.player_count_label.addstr(0, 0, GameBoard.player_count_label)
-        self.player_count_label.refresh()
-        self.player_count_value = curses.newwin(1, GameBoard.player_count_max_size, rows + 2, len(GameBoard.player_count_label))
+        self.renderer = RENDERERS[renderer](rows, cols)
+        self.closed = False
         self.cur_player_count = 0
-        self.health_bar_label = curses.newwin(1, mid_col, rows + 2, mid_col)
-        self.health_bar_label.addstr(0, 0, GameBoard.health_label)
-        self.health_bar_label.refresh()
-        self.health_bar_value = curses.newwin(1, GameBoard.health_max_size, rows + 2, mid_col + len(GameBoard.health_label))
         self.cur_health = 0
-        self.status_bar = curses.newwin(1, cols + 2, rows + 3, 0)
         self.cur_status = "Welcome to the game!"
-        self.debug_bar  = curses.newwin(1, cols + 2, rows + 4, 0)
-        self.status_bar.keypad(True)
-        self.status_bar.addstr(0, 0, self.cur_status)
-        self.status_bar.refresh()
-        self.players_health_window = curses.newwin(rows, 20, 0, cols + 2)
+        self.cur_latency = ""
         self.players_health = {}
-
-        self.main_board.refresh()
-        self.outer_board.refresh()
+        self.draw_status_bar()
+        self.renderer.present()
 
     def print_game_state(self):
         """
         Print the game state
         :param game_state: the game state
         """
-        self.main_board.erase()
-        # each object is a quadruplet (row, col, char, color)
+        cells = []
+        wall_columns = self.game_client.wall_columns
+        if wall_columns is not None:
+            cells.extend((row, col, WALL_GLYPH, 0)
+                         for row, col in walls_in_view(wall_columns, *self.view_origin, self.rows, self.cols))
+        # players are quadruplets (row, col, char, color), everything else is (row, col, glyph id)
+        glyphs = self.game_client.glyphs
         for obj in self.game_state:
-            try:
-                self.main_board.addch(*obj[:3], curses.color_pair(obj[3]))
-            except curses.error:
-                if ENABLE_DEBUG_BAR:
-                    self.debug_bar.erase()
-                    self.debug_bar.addstr(0, 0, f"Error adding object {obj}")
-                    self.debug_bar.refresh()
-        self.main_board.refresh()
-
-    def update_game_state(self, game_state):
+            if len(obj) == 3:
+                character, color = glyphs[obj[2]]
+                cells.append((obj[0], obj[1], character, color))
+            else:
+                cells.append(obj)
+        self.renderer.draw_board(cells)
+
+    def update_game_state(self, game_state, view_origin=(0, 0)):
         """
         Update the game state
         :param game_state: the game state
+        :param view_origin: the board cell at the top left corner of the game state
         """
         self.game_state = game_state
+        self.view_origin = tuple(view_origin)
         self.print_game_state()
 
     def update_players_health(self, players_health):
         players_count = len(players_health)
         if players_count != self.cur_player_count:
             self.cur_player_count = players_count
-            self.player_count_value.erase()
-            self.player_count_value.addstr(0, 0, str(players_count))
-            self.player_count_value.refresh()
+            self.renderer.draw_player_count(str(players_count))
 
         player_health = max(players_health.get(self.game_client.player_name, 0), 0)
 
@@ -135,68 +133,122 @@ class GameBoard:
             else:
                 color = 47 # green
 
-            self.health_bar_value.erase()
-            self.health_bar_value.addstr(0, 0, str(player_health), curses.color_pair(color))
-            self.health_bar_value.refresh()
-
-        self.players_health_window.erase()
+            self.renderer.draw_health(str(player_health), color)
 
-        for i, (player, health) in enumerate(players_health.items()):
-            self.players_health_window.addstr(i, 0, f"{player:10.10}: {health}")
-
-        self.players_health_window.refresh()
+        self.renderer.draw_players_health([f"{player:10.10}: {health}" for player, health in players_health.items()])
 
     def update_status(self, status):
         if status != self.cur_status:
             self.cur_status = status
-            self.status_bar.erase()
-            self.status_bar.addstr(0, 0, status)
-            self.status_bar.refresh()
+            self.draw_status_bar()
+
+    def update_latency(self, latency):
+        if latency != self.cur_latency:
+            self.cur_latency = latency
+            self.draw_status_bar()
+
+    def draw_status_bar(self):
+        width = self.cols + 2
+        status_line = self.cur_status[:width - 1]
+        # the latency goes on the right, unless the status leaves no room for it
+        latency_col = width - 1 - len(self.cur_latency)
+        if latency_col > len(self.cur_status):
+            status_line = status_line.ljust(latency_col) + self.cur_latency
+        self.renderer.draw_status(status_line)
+
+    def show_debug(self, text):
+        self.renderer.draw_debug(text)
+        self.renderer.present()
+
+    def show_endgame(self, message):
+        """
+        Replace the board with a message in its middle, and clear the bars under it.
+        """
+        self.renderer.draw_message(message)
+        self.renderer.draw_status("")
+        self.renderer.draw_debug("")
+        self.renderer.present()
+
+    def present(self):
+        """
+        Put everything drawn since the last call on the screen.
+        """
+        self.renderer.present()
 
+    def read_key(self):
+        return self.renderer.read_key()
+
+    def wait_key(self):
+        self.renderer.wait_key()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.renderer.close()
 
     def __del__(self):
-        curses.endwin()
+        self.close()
 
 
 
 class GameClient:
 
-    def __init__(self, ip, port, player_name, player_character):
+    def __init__(self, ip, port, player_name, player_character, compression=True, udp=False, udp_loss=0.0,
+                 max_fps=MAX_FPS, renderer="curses"):
         """
         Initialize the game
         :param ip: the ip address of the server
         :param port: the port of the server
         :param player_name: the name of the player
         :param player_character: the character of the player, can be any character or emoji
+        :param compression: ask the server to compress large frames
+        :param udp: ask the server to send game states and take inputs over UDP
+        :param udp_loss: drop this fraction of outgoing datagrams, to test behaviour under packet loss
+        :param max_fps: the most times per second the board is redrawn
+        :param renderer: what to draw the board with, curses or ansi
         """
         self.server_ip = ip
         self.server_port = port
+        self.player_name = player_name
+        self.player_character = player_character
+        self.compression = compression
+        self.udp = udp
+        self.udp_loss = udp_loss
         self.is_game_over = False
+        self.socket = None
+        self.session_token = None
+        self.udp_socket = None
+        self.udp_token = None
+        self.last_datagram_time = 0
+        self.input_seq = 0
+        self.recent_inputs = deque(maxlen=INPUT_REDUNDANCY)
+        self.frame_interval = 1 / max_fps
+        # the newest game state that wasn't drawn yet
+        self.pending_game_state = None
+        # the tick of the game state on screen, sent with inputs so the server can resolve shots from there
+        self.drawn_tick = None
+        self.latency = LatencyTracker()
+        self.ping_tid = None
+        # the keyframe request waiting for its answer, one at a time however many game states don't add up
+        self.keyframe_tid = None
+        # game states whose checksum didn't match
+        self.desyncs = 0
+        self.selector = None
+        # (step, perf_counter when it was done) of the way from launch to the first frame
+        self.startup_steps = [("imports", perf_counter())]
         print("\n═══════════════════════════════════════════\n")
         print("Welcome to the shooter game!")
         print("Use WASD to move, and arrow keys to shoot.")
         print("\n═══════════════════════════════════════════\n")
         print(f"Connecting to server {ip}:{port}")
-        self.socket = JSONSocket.create_socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            self.socket.connect((ip, port))
+            response = self.connect()
         except ConnectionRefusedError:
             print("Server is not up!")
             exit(1)
-        print("Connected to server!")
-        handshake_payload = {
-            "type": "handshake",
-            "player_name": player_name,
-            "player_character": player_character
-
-        }
-        print(f"Sending handshake...")
-        self.socket.send_json(handshake_payload)
-        self.player_name = player_name
-        print("Waiting for handshake ack...")
-        response = self.socket.recv_json()
-        if response["type"] == "handshake_ack" and response["success"]:
-            print("Handshake successful!")
+        if response["success"]:
+            self.startup_steps.append(("handshake", perf_counter()))
+            print(f"Handshake successful! ({(perf_counter() - LAUNCHED_AT) * 1000:.0f} ms after launch)")
         else:
             print("Handshake failed!")
             print(f"Reason: {response.get('fail_reason', 'Unknown')}")
@@ -204,6 +256,11 @@ class GameClient:
             exit(1)
 
         game_size = response["game_size"]
+        self.glyphs = response["glyphs"]
+        # the walls of the map, sorted per row so drawing only looks at the ones in view
+        self.wall_columns = None
+        if "terrain" in response:
+            self.wall_columns = Terrain.from_message(response["terrain"]).wall_columns()
 
         loader_animation = "|/-\\"
         loader_index = 0
@@ -222,6 +279,7 @@ class GameClient:
                     print(f"\b ")
                     game_start_response = self.socket.recv_json()
                     if game_start_response["type"] == "game_start":
+                        self.startup_steps.append(("lobby", perf_counter()))
                         print("Game start!")
                         game_started = True
                         break
@@ -236,28 +294,184 @@ class GameClient:
 
         print()
 
-        self.game_board = GameBoard(self, *game_size)
+        self.game_board = GameBoard(self, *game_size, renderer=renderer)
+        self.startup_steps.append(("renderer", perf_counter()))
 
         self.transactions = {}
 
         self.run()
 
+    def connect(self, session_token=None):
+        """
+        Open a connection to the server and handshake.
+        :param session_token: the token of a dropped session to resume, None to join as a new player
+        :return: the handshake ack
+        """
+        self.socket = JSONSocket.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.metrics_label = "server"
+        self.socket.connect((self.server_ip, self.server_port))
+        handshake_payload = {
+            "type": "handshake",
+            "player_name": self.player_name,
+            "player_character": self.player_character,
+            "compression": [COMPRESSION_METHOD] if self.compression else [],
+            "udp": self.udp
+        }
+        if session_token is not None:
+            handshake_payload["session_token"] = session_token
+        self.socket.send_json(handshake_payload)
+        response = self.socket.recv_json()
+        if response is None or response["type"] != "handshake_ack":
+            raise ConnectionError("No handshake ack from the server")
+        if not response["success"]:
+            return response
+        self.session_token = response["session_token"]
+        if response.get("compression") == COMPRESSION_METHOD:
+            self.socket.enable_compression()
+        if "udp_token" in response:
+            if self.udp_socket is not None:
+                self.udp_socket.close()
+            self.udp_token = response["udp_token"]
+            self.udp_socket = JSONDatagramSocket.create_socket(self.udp_loss)
+            self.udp_socket.connect((self.server_ip, self.server_port))
+            self.udp_socket.metrics_labels[None] = "server"
+            self.send_udp_hello()
+        return response
+
+    def reconnect(self):
+        """
+        Try to resume the session after the connection dropped, the server holds the player for a grace period.
+        :return: True if the session was resumed
+        """
+        self.socket.close()
+        for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+            self.game_board.update_status(f"Connection lost, reconnecting ({attempt}/{RECONNECT_ATTEMPTS})...")
+            self.game_board.present()
+            sleep(RECONNECT_DELAY)
+            try:
+                response = self.connect(self.session_token)
+            except OSError:
+                continue
+            if not response["success"]:
+                self.game_board.update_status(f"Could not reconnect: {response.get('fail_reason', 'Unknown')}")
+                return False
+            self.transactions = {}
+            self.keyframe_tid = None
+            self.queue_game_state(response["keyframe"])
+            return True
+        self.game_board.update_status("Could not reconnect to the server")
+        return False
+
+    def send_udp_hello(self):
+        self.udp_socket.send_json({
+            "type": "udp_hello",
+            "token": self.udp_token
+        })
+        self.last_datagram_time = monotonic()
+
+    def create_selector(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ, data=GameClient.handle_server_messages)
+        selector.register(0, selectors.EVENT_READ, data=GameClient.handle_user_input)
+        if self.udp_socket is not None:
+            selector.register(self.udp_socket, selectors.EVENT_READ, data=GameClient.handle_datagrams)
+        return selector
+
+    def startup_report(self):
+        """
+        :return: a line with how long each startup step took, lobby being the wait for the other players
+        """
+        steps = []
+        previous_time = LAUNCHED_AT
+        for step, done_at in self.startup_steps:
+            steps.append(f"{step} {(done_at - previous_time) * 1000:.1f} ms")
+            previous_time = done_at
+        return "Startup: " + ", ".join(steps)
+
+    def send_ping(self):
+        # a ping that wasn't answered by now is lost
+        self.transactions.pop((self.ping_tid, self.player_name), None)
+        transaction = Transaction(self, self.player_name, self.socket, ping_handler)
+        self.ping_tid = transaction.transaction_id
+        self.transactions[(transaction.transaction_id, self.player_name)] = transaction
+        transaction.handle()
+
+    def record_rtt(self, rtt, tick_duration):
+        """
+        Called by ping transactions with the round trip they measured.
+        :param rtt: the round trip, in seconds
+        :param tick_duration: how long the server's last tick took, in seconds
+        """
+        self.latency.add_sample(rtt)
+        latency = self.latency.summary()
+        if tick_duration is not None:
+            latency += f" | tick {tick_duration * 1000:.1f}ms"
+        self.game_board.update_latency(latency)
+
+    def queue_game_state(self, message):
+        """
+        Keep a game state for the next frame, replacing one that wasn't drawn yet.
+        """
+        self.pending_game_state = message
+
+    def apply_game_state(self, message):
+        if self.startup_steps[-1][0] == "renderer":
+            self.startup_steps.append(("first_frame", perf_counter()))
+        self.drawn_tick = message.get("tick")
+        self.check_game_state(message)
+        self.game_board.update_game_state(message["game_state"], message.get("view", (0, 0)))
+        self.game_board.update_status(message["status"])
+        self.game_board.update_players_health(message["players_health"])
+
+    def check_game_state(self, message):
+        """
+        Ask the server for the whole current game state when one doesn't add up to its checksum,
+        what is drawn has drifted from the server's board.
+        """
+        checksum = message.get("checksum")
+        if checksum is None or checksum == game_state_checksum(message["game_state"], message["players_health"],
+                                                               message.get("view", (0, 0))):
+            return
+        self.desyncs += 1
+        if ENABLE_DEBUG_BAR:
+            self.game_board.show_debug(f"Checksum mismatch on tick {message.get('tick')}, {self.desyncs} so far")
+        if self.keyframe_tid is not None:
+            return
+        transaction = Transaction(self, self.player_name, self.socket, keyframe_request_handler)
+        self.keyframe_tid = transaction.transaction_id
+        self.transactions[(transaction.transaction_id, self.player_name)] = transaction
+        try:
+            transaction.handle()
+        except OSError:
+            # the read side notices the broken connection too, and reconnects with a keyframe
+            pass
+
+    def handle_datagrams(self):
+        # stale datagrams are already dropped by the socket, only the newest game state is worth drawing
+        for data, address in self.udp_socket.recv_all():
+            self.last_datagram_time = monotonic()
+            if data.get("type") == "game_state":
+                self.queue_game_state(data)
+
     def handle_unknown_message(self, data):
         if ENABLE_DEBUG_BAR:
-            self.game_board.debug_bar.erase()
-            self.game_board.debug_bar.addstr(0, 0, f"Unknown message: {data['type']}")
-            self.game_board.debug_bar.refresh()
+            self.game_board.show_debug(f"Unknown message: {data['type']}")
+
+    def handle_server_messages(self):
+        # drain every frame that already arrived instead of one per loop, so the client catches up when behind
+        for _ in range(MAX_FRAMES_PER_READ):
+            self.handle_server_message()
+            if self.is_game_over or not select([self.socket], [], [], 0)[0]:
+                return
 
     def handle_server_message(self):
         if ENABLE_DEBUG_BAR:
-            self.game_board.debug_bar.erase()
-            self.game_board.debug_bar.addstr(0, 0, f"Server sent something")
-            self.game_board.debug_bar.refresh()
+            self.game_board.show_debug(f"Server sent something")
         data = self.socket.recv_json()
+        if data is None:
+            raise ConnectionError("Server closed the connection")
         if ENABLE_DEBUG_BAR:
-            self.game_board.debug_bar.erase()
-            self.game_board.debug_bar.addstr(0, 0, f"Got: {str(data)[:20]}")
-            self.game_board.debug_bar.refresh()
+            self.game_board.show_debug(f"Got: {str(data)[:20]}")
         tid = tuple(data["tid"])
         if tid in self.transactions:
             transaction = self.transactions[tid]
@@ -265,53 +479,92 @@ class GameClient:
         else:
             handler = date_type_handlers.get(data["type"], self.handle_unknown_message)
             transaction = Transaction(self, data["tid"][1], self.socket, handler, tid[0])
-            self.transactions[tid] = transaction
+            # a request answered with a single reply is done once the reply is out, it never goes in the table
+            if data["type"] not in SINGLE_REPLY_TYPES:
+                self.transactions[tid] = transaction
             transaction.handle(data)
 
     def handle_user_input(self):
-        key = self.game_board.status_bar.getch()
-        key_name = curses.keyname(key)
-        transaction = Transaction(self, self.player_name, self.socket, keypress_handler)
-        self.transactions[(transaction.transaction_id, self.player_name)] = transaction
-        transaction.handle(keys_mapping.get(key, 0))
+        while True:
+            key = self.game_board.read_key()
+            if key == -1:
+                return
+            self.send_input(key)
+
+    def send_input(self, key):
+        if self.udp_socket is not None:
+            self.input_seq += 1
+            self.recent_inputs.append((self.input_seq, keys_mapping.get(key, 0)))
+            self.udp_socket.send_json({
+                "type": "input",
+                "inputs": list(self.recent_inputs),
+                "tick": self.drawn_tick
+            })
+        else:
+            transaction = Transaction(self, self.player_name, self.socket, keypress_handler)
+            self.transactions[(transaction.transaction_id, self.player_name)] = transaction
+            transaction.handle(keys_mapping.get(key, 0))
         if ENABLE_DEBUG_BAR:
-            self.game_board.debug_bar.erase()
-            self.game_board.debug_bar.addstr(0, 0, f"Key pressed: {key_name}")
-            self.game_board.debug_bar.refresh()
+            self.game_board.show_debug(f"Key pressed: {key}")
 
     def run(self):
+        self.selector = self.create_selector()
+        next_frame_time = 0
+        next_ping_time = 0
 
         while not self.is_game_over:
-            # wait for the server to send something,
-            # or wait for the user to press a key
-            if ENABLE_DEBUG_BAR:
-                self.game_board.debug_bar.erase()
-                self.game_board.debug_bar.addstr(0, 0, "Waiting for server or user input.")
-                self.game_board.debug_bar.refresh()
-            selector = selectors.DefaultSelector()
-            selector.register(self.socket, selectors.EVENT_READ, data=GameClient.handle_server_message)
-            selector.register(0, selectors.EVENT_READ, data=GameClient.handle_user_input)
+            if monotonic() >= next_ping_time:
+                try:
+                    self.send_ping()
+                except OSError:
+                    # the read side notices the broken connection too, and reconnects
+                    pass
+                next_ping_time = monotonic() + PING_INTERVAL
+            # wait for the server to send something, for the user to press a key,
+            # for the next frame when there is a game state to draw, or for the next ping
+            timeout = max(next_ping_time - monotonic(), 0)
+            if self.pending_game_state is not None:
+                timeout = min(timeout, max(next_frame_time - monotonic(), 0))
+            if self.udp_socket is not None:
+                if monotonic() - self.last_datagram_time > UDP_HELLO_INTERVAL:
+                    self.send_udp_hello()
+                timeout = min(timeout, UDP_HELLO_INTERVAL)
             if ENABLE_DEBUG_BAR:
-                self.game_board.debug_bar.addstr(" ready!")
-                self.game_board.debug_bar.refresh()
-            events = selector.select()
+                self.game_board.show_debug("Waiting for server or user input.")
+            events = self.selector.select(timeout=timeout)
             for key, mask in events:
                 if self.is_game_over:
                     break
                 if key.data:
-                    key.data(self)
+                    try:
+                        key.data(self)
+                    except OSError:
+                        # ConnectionError included, a reconnect replaces the sockets so drop the rest of the events
+                        self.selector.close()
+                        if not self.reconnect():
+                            self.is_game_over = True
+                            break
+                        self.selector = self.create_selector()
+                        break
                 else:
                     if ENABLE_DEBUG_BAR:
-                        self.game_board.debug_bar.erase()
-                        self.game_board.debug_bar.addstr(0, 0, f"Unknown event")
-                        self.game_board.debug_bar.refresh()
+                        self.game_board.show_debug(f"Unknown event")
+
+            # draw at most one frame per interval, whatever number of game states arrived since the last one
+            if self.pending_game_state is not None and not self.is_game_over and monotonic() >= next_frame_time:
+                self.apply_game_state(self.pending_game_state)
+                self.pending_game_state = None
+                next_frame_time = monotonic() + self.frame_interval
+            # everything drawn in this round goes on the screen at once
+            self.game_board.present()
+
+        self.selector.close()
 
         # wait a bit so users can see the endgame message
         sleep(3)
-        self.game_board.status_bar.addstr(0, 0, "Press any key to exit")
-        self.game_board.status_bar.refresh()
-        curses.flushinp()
-        self.game_board.status_bar.getch()
+        self.game_board.update_status("Press any key to exit")
+        self.game_board.present()
+        self.game_board.wait_key()
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Game client")
@@ -320,6 +573,15 @@ def parse_args():
     parser.add_argument("--player_name", type=str, help="The name of the player")
     parser.add_argument("--player_character", type=str, help="The character of the player")
     parser.add_argument("--inverted_keys", action="store_true", help="Use inverted keys")
+    parser.add_argument("--no_compression", action="store_true", help="Don't compress the connection")
+    parser.add_argument("--udp", action="store_true", help="Receive game states and send inputs over UDP")
+    parser.add_argument("--udp_loss", type=float, default=0.0,
+                        help="Drop this fraction of outgoing datagrams, to test behaviour under packet loss")
+    parser.add_argument("--max_fps", type=float, default=MAX_FPS, help="The most times per second to redraw")
+    parser.add_argument("--renderer", choices=sorted(RENDERERS), default="curses",
+                        help="Draw with curses, or write only the changed cells as ANSI escape sequences")
+    parser.add_argument("--startup_timings", action="store_true",
+                        help="Print how long each step from launch to the first frame took, once the game is over")
     args = parser.parse_args()
     return args
 
@@ -328,7 +590,12 @@ def main():
     if args.inverted_keys:
         global keys_mapping
         keys_mapping = inverted_keys_mapping
-    client = GameClient(args.ip, args.port, args.player_name, args.player_character)
+    client = GameClient(args.ip, args.port, args.player_name, args.player_character,
+                        compression=not args.no_compression, udp=args.udp, udp_loss=args.udp_loss,
+                        max_fps=args.max_fps, renderer=args.renderer)
+    if args.startup_timings:
+        client.game_board.close()
+        print(client.startup_report())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
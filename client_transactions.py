@@ -1,9 +1,19 @@
+from time import monotonic
+
+
+def ping_handler(game, transaction_id, originator, peer, messages):
+    ping = {
+        "type": "ping",
+        "sent_at": monotonic()
+    }
+    yield ping
+    pong = messages[-1]
+    game.record_rtt(monotonic() - pong["sent_at"], pong.get("tick_duration"))
+
 def pong_handler(game, transaction_id, originator, peer, messages):
-    game.game_board.status_bar.clear()
-    game.game_board.status_bar.addstr(0, 0, f"Ping!")
-    game.game_board.status_bar.refresh()
     response = {
-        "type": "pong"
+        "type": "pong",
+        "sent_at": messages[-1].get("sent_at")
     }
     yield response
 
@@ -11,35 +21,38 @@ def keypress_handler(game, transaction_id, originator, peer, messages):
     keypress = messages[-1]
     response = {
         "type": "keypress",
-        "key": keypress
+        "key": keypress,
+        "tick": game.drawn_tick
     }
     yield response
 
 def handle_game_state(game, transaction_id, originator, peer, messages):
-    game_state = messages[-1]["game_state"]
-    status = messages[-1]["status"]
-    players_health = messages[-1]["players_health"]
-    game.game_board.update_game_state(game_state)
-    game.game_board.update_status(status)
-    game.game_board.update_players_health(players_health)
+    # drawn on the next frame, unless a newer game state replaces it first
+    game.queue_game_state(messages[-1])
     yield None
 
+def keyframe_request_handler(game, transaction_id, originator, peer, messages):
+    yield {
+        "type": "keyframe_request",
+        "tick": game.drawn_tick
+    }
+    game.keyframe_tid = None
+    keyframe = messages[-1].get("keyframe")
+    # a game state that arrived meanwhile is newer
+    if keyframe is not None and (game.pending_game_state is None or
+                                 game.pending_game_state.get("tick", 0) <= keyframe.get("tick", 0)):
+        game.queue_game_state(keyframe)
+
 def endgame_handler(game, transaction_id, originator, peer, messages):
     winner = messages[-1]["winner"]
-    game.game_board.main_board.clear()
     # add endgame message in middle of screen
-    message = f"Game over! {winner} wins!"
-    game.game_board.main_board.addstr(game.game_board.main_board.getmaxyx()[0] // 2,
-                                      game.game_board.main_board.getmaxyx()[1] // 2 - len(message) // 2,
-                                      message)
-    game.game_board.main_board.refresh()
-    game.game_board.status_bar.clear()
-    game.game_board.debug_bar.clear()
-    game.game_board.debug_bar.refresh()
-    game.game_board.status_bar.refresh()
+    game.game_board.show_endgame(f"Game over! {winner} wins!" if winner is not None else "Game over! Nobody made it!")
     game.is_game_over = True
     yield None
 
+# requests answered with a single reply, their transactions are over once it is sent
+SINGLE_REPLY_TYPES = {"ping"}
+
 date_type_handlers = {
     "ping": pong_handler,
     "game_state": handle_game_state,
@@ -0,0 +1,125 @@
+"""
+Helper class for sending JSON data over UDP, for traffic where a fresh message makes older ones worthless.
+
+Every datagram starts with a sequence number, counted per destination. The receiver keeps the highest sequence
+number seen from each peer and drops anything older, so a late datagram never overwrites newer state.
+"""
+
+import json
+import random
+import socket
+from metrics import REGISTRY
+
+SEQ_SIZE = 4
+# largest UDP payload that fits an IPv4 datagram, bigger messages have to go over the TCP connection
+MAX_DATAGRAM_SIZE = 65507 - SEQ_SIZE
+
+DATAGRAMS_SENT = REGISTRY.counter("shooter_datagrams_sent_total", "Datagrams sent", ("client",))
+DATAGRAMS_RECEIVED = REGISTRY.counter("shooter_datagrams_received_total", "Datagrams received", ("client",))
+DATAGRAMS_DROPPED = REGISTRY.counter("shooter_datagrams_dropped_total", "Datagrams dropped", ("reason",))
+
+
+class DatagramTooLarge(ValueError):
+    pass
+
+
+class JSONDatagramSocket:
+
+    def __init__(self, sock: socket.socket, loss=0.0, known_peers_only=False):
+        """
+        :param sock: a bound or connected UDP socket, switched to non-blocking mode
+        :param loss: the probability of silently dropping an outgoing datagram, to test behaviour under loss
+        :param known_peers_only: keep sequence numbers only for peers added with add_peer, so a server socket doesn't
+                                 grow with every address that sends it something
+        """
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.loss = loss
+        self.known_peers_only = known_peers_only
+        self.next_seq = {}
+        self.last_seq = {}
+        self.metrics_labels = {}
+
+    @staticmethod
+    def create_socket(loss=0.0, known_peers_only=False):
+        return JSONDatagramSocket(socket.socket(socket.AF_INET, socket.SOCK_DGRAM), loss, known_peers_only)
+
+    def add_peer(self, address, metrics_label):
+        self.metrics_labels[address] = metrics_label
+
+    def tracked(self, address):
+        return not self.known_peers_only or address in self.metrics_labels
+
+    def send_json(self, data: dict, address=None):
+        """
+        Send a JSON object as a single datagram.
+        :param data: the data to send
+        :param address: where to send it, None on a connected socket
+        """
+        json_bytes = json.dumps(data).encode()
+        if len(json_bytes) > MAX_DATAGRAM_SIZE:
+            raise DatagramTooLarge(f"{len(json_bytes)} bytes don't fit in a datagram")
+        seq = self.next_seq.get(address, 1)
+        if self.tracked(address):
+            self.next_seq[address] = seq + 1
+        if self.loss and random.random() < self.loss:
+            DATAGRAMS_DROPPED.inc(1, ("simulated_loss",))
+            return
+        payload = seq.to_bytes(SEQ_SIZE, byteorder="big") + json_bytes
+        if address is None:
+            self.sock.send(payload)
+        else:
+            self.sock.sendto(payload, address)
+        DATAGRAMS_SENT.inc(1, (self.metrics_labels.get(address, "unknown"),))
+
+    def recv_json(self):
+        """
+        Receive one datagram.
+        :return: a (data, address) tuple, data is None when the datagram was stale or malformed
+                 and both are None when nothing is waiting
+        """
+        try:
+            payload, address = self.sock.recvfrom(MAX_DATAGRAM_SIZE + SEQ_SIZE)
+        except (BlockingIOError, InterruptedError, ConnectionRefusedError):
+            # a connected socket reports the ICMP error of an earlier send here, nothing is waiting either way
+            return None, None
+        if len(payload) <= SEQ_SIZE:
+            DATAGRAMS_DROPPED.inc(1, ("malformed",))
+            return None, address
+        seq = int.from_bytes(payload[:SEQ_SIZE], byteorder="big")
+        if seq <= self.last_seq.get(address, 0):
+            DATAGRAMS_DROPPED.inc(1, ("stale",))
+            return None, address
+        try:
+            data = json.loads(payload[SEQ_SIZE:])
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            DATAGRAMS_DROPPED.inc(1, ("malformed",))
+            return None, address
+        if self.tracked(address):
+            self.last_seq[address] = seq
+        DATAGRAMS_RECEIVED.inc(1, (self.metrics_labels.get(address, "unknown"),))
+        return data, address
+
+    def recv_all(self):
+        """
+        Drain every datagram waiting on the socket.
+        :return: a list of (data, address) tuples, stale and malformed datagrams are left out
+        """
+        received = []
+        while True:
+            data, address = self.recv_json()
+            if address is None:
+                return received
+            if data is not None:
+                received.append((data, address))
+
+    def forget(self, address):
+        """
+        Reset the sequence numbers of a peer, so a reconnecting peer starting from 1 isn't taken as stale.
+        """
+        self.next_seq.pop(address, None)
+        self.last_seq.pop(address, None)
+        self.metrics_labels.pop(address, None)
+
+    def __getattr__(self, item):
+        return getattr(self.sock, item)
@@ -4,14 +4,56 @@ Helper class for reading and writing JSON data over a socket.
 
 import json
 from socket import socket
+import select
 import signal
+import threading
+import time
+import zlib
+from metrics import REGISTRY
+from profiler import PROFILER
 
 INT_SIZE = 4
 
+# the top bit of the size header marks a frame whose payload went through the connection's zlib stream
+COMPRESSED_FLAG = 1 << (INT_SIZE * 8 - 1)
+# frames smaller than this (acks, pings, keypresses) are sent as plain JSON
+COMPRESSION_THRESHOLD = 256
+COMPRESSION_LEVEL = 6
+COMPRESSION_METHOD = "zlib-v1"
+# the largest frame a socket accepts, after decompression, the server lowers it on client connections
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# primes both zlib streams with the phrases every game frame repeats, bump COMPRESSION_METHOD when changing it
+COMPRESSION_DICTIONARY = (b'"unknown_message"{"type": "keypress_ack", "tid": [{"type": "keypress", "key": '
+                          b'{"type": "pong", "tid": [{"type": "ping", "tid": [, "self"]}'
+                          b'"players_health": {"status": " was hit by a projectile!" picked up a powerup!'
+                          b'[, "\\u25b5", 0], [, "\\u25bf", 0], [, "\\u25c3", 0], [, "\\u25b9", 0], [, "\\u2722", 0], '
+                          b'[, "\\u2502", 204], [, "\\u2500", 204], [, "\\u263c", 136], [, "\\u25cc", 0], '
+                          b'[, "\\u2665", 197], [, "\\u21d1", 229], [, "\\u233e", 136], [, "/", 204], '
+                          b'{"type": "game_state", "game_state": [[, 0], [, "\\u00b7", 0], [, "\\u25cf", 0], ')
+
+BYTES_SENT = REGISTRY.counter("shooter_socket_bytes_sent_total", "Bytes written to JSON sockets", ("client",))
+BYTES_RECEIVED = REGISTRY.counter("shooter_socket_bytes_received_total", "Bytes read from JSON sockets", ("client",))
+MESSAGES_SENT = REGISTRY.counter("shooter_socket_messages_sent_total", "JSON messages sent", ("client",))
+MESSAGES_RECEIVED = REGISTRY.counter("shooter_socket_messages_received_total", "JSON messages received", ("client",))
+SEND_LATENCY = REGISTRY.histogram("shooter_send_json_seconds", "Time spent in JSONSocket.send_json")
+RECV_LATENCY = REGISTRY.histogram("shooter_recv_json_seconds", "Time spent in JSONSocket.recv_json")
+
+
+class FrameTooLarge(ValueError):
+    pass
+
+
 class JSONSocket:
 
-    def __init__(self, sock: socket):
+    def __init__(self, sock: socket, metrics_label="pending", max_frame_size=MAX_FRAME_SIZE):
         self.sock = sock
+        self.max_frame_size = max_frame_size
+        # the server relabels the socket with the player name once the handshake is done
+        self.metrics_label = metrics_label
+        self.compressor = None
+        self.decompressor = None
+        # game states are sent from worker threads while the game loop sends acks, frames must not interleave
+        self.send_lock = threading.Lock()
 
     @staticmethod
     def create_socket(*args, **kwargs):
@@ -23,34 +65,100 @@ class JSONSocket:
         """
         return JSONSocket(socket(*args, **kwargs))
 
+    def enable_compression(self, level=COMPRESSION_LEVEL):
+        """
+        Start a persistent zlib stream in each direction, both peers must call this once the handshake agreed on it.
+        Frames are still only compressed when they are larger than COMPRESSION_THRESHOLD.
+        :param level: the zlib compression level
+        """
+        self.compressor = zlib.compressobj(level, zdict=COMPRESSION_DICTIONARY)
+        self.decompressor = zlib.decompressobj(zdict=COMPRESSION_DICTIONARY)
+
+    def recv_exactly(self, size, deadline=None):
+        """
+        Read exactly size bytes from the socket.
+        :param deadline: the time.monotonic() by which every byte must have arrived, TimeoutError after it
+        :return: the bytes, or None if the peer closed the connection mid-frame
+        """
+        data = bytearray()
+        while len(data) < size:
+            # a socket timeout only bounds each recv, a peer sending a byte at a time would never hit it
+            if deadline is not None and not select.select([self.sock], [], [], max(deadline - time.monotonic(), 0))[0]:
+                raise TimeoutError(f"{len(data)} of {size} bytes arrived in time")
+            packet = self.recv(size - len(data))
+            if not packet:
+                return None
+            data += packet
+        return bytes(data)
+
     def send_json(self, data: dict):
         """
         Send a JSON object over a socket.
         :param self: the socket to send the data over
         :param data: the data to send
         """
-        json_data = json.dumps(data)
-        json_bytes = json_data.encode()
+        start_time = time.perf_counter()
+        with PROFILER.phase("serialization"):
+            json_data = json.dumps(data)
+            json_bytes = json_data.encode()
         data_size = len(json_bytes)
-        size_bytes = data_size.to_bytes(INT_SIZE, byteorder="big")
-        self.sendall(size_bytes)
-        self.sendall(json_bytes)
+        header = data_size
+        with self.send_lock:
+            # the zlib stream must see frames in the order they go out on the wire
+            if self.compressor is not None and data_size >= COMPRESSION_THRESHOLD:
+                with PROFILER.phase("compression"):
+                    json_bytes = self.compressor.compress(json_bytes) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+                data_size = len(json_bytes)
+                header = data_size | COMPRESSED_FLAG
+            size_bytes = header.to_bytes(INT_SIZE, byteorder="big")
+            with PROFILER.phase("send"):
+                self.sendall(size_bytes + json_bytes)
+        labels = (self.metrics_label,)
+        BYTES_SENT.inc(INT_SIZE + data_size, labels)
+        MESSAGES_SENT.inc(1, labels)
+        SEND_LATENCY.observe(time.perf_counter() - start_time)
+
+    def read_frame(self, deadline=None):
+        """
+        Read a frame and undo its compression, without parsing it.
+        A frame over max_frame_size is refused from its header, before its payload is read or inflated.
+        :param deadline: the time.monotonic() by which the whole frame must have arrived, None to wait for it
+        :return: the JSON bytes, or None if the peer closed the connection mid-frame, and when the header arrived
+        """
+        size_bytes = self.recv_exactly(INT_SIZE, deadline)
+        if size_bytes is None:
+            raise ConnectionError("Connection closed by peer")
+        start_time = time.perf_counter()
+        header = int.from_bytes(size_bytes, byteorder="big")
+        data_size = header & ~COMPRESSED_FLAG
+        if data_size > self.max_frame_size:
+            raise FrameTooLarge(f"{data_size} bytes frame, the limit is {self.max_frame_size}")
+        json_bytes = self.recv_exactly(data_size, deadline)
+        if json_bytes is None:
+            return None, start_time
+
+        if header & COMPRESSED_FLAG:
+            if self.decompressor is None:
+                raise RuntimeError("Received a compressed frame but compression was not negotiated")
+            json_bytes = self.decompressor.decompress(json_bytes, self.max_frame_size)
+            if self.decompressor.unconsumed_tail:
+                raise FrameTooLarge(f"Frame inflates past the limit of {self.max_frame_size} bytes")
+
+        labels = (self.metrics_label,)
+        BYTES_RECEIVED.inc(INT_SIZE + data_size, labels)
+        MESSAGES_RECEIVED.inc(1, labels)
+        return json_bytes, start_time
 
-    def recv_json(self):
+    def recv_json(self, deadline=None):
         """
         Receive a JSON object over a socket.
         :param self: the socket to receive the data from
+        :param deadline: the time.monotonic() by which the whole frame must have arrived, None to wait for it
         :return: the received data
         """
-        size_bytes = self.recv(INT_SIZE)
-        data_size = int.from_bytes(size_bytes, byteorder="big")
-        json_bytes = b""
-        while len(json_bytes) < data_size:
-            packet = self.recv(data_size - len(json_bytes))
-            if not packet:
-                return None
-            json_bytes += packet
-
+        json_bytes, start_time = self.read_frame(deadline)
+        if json_bytes is None:
+            return None
 
         json_data = json_bytes.decode()
 
@@ -58,7 +166,16 @@ class JSONSocket:
             data = json.loads(json_data)
         except json.JSONDecodeError as e:
             raise RuntimeError(f"Error decoding JSON: '{json_data}', Error: {e}")
+        RECV_LATENCY.observe(time.perf_counter() - start_time)
         return data
 
+    def skip_json(self, deadline=None):
+        """
+        Read a frame and throw it away unparsed, the cheap way to drop messages from a client over its rate limit.
+        :param deadline: the time.monotonic() by which the whole frame must have arrived, None to wait for it
+        :return: False if the peer closed the connection mid-frame
+        """
+        return self.read_frame(deadline)[0] is not None
+
     def __getattr__(self, item):
         return getattr(self.sock, item)
@@ -0,0 +1,54 @@
+"""
+Round trip time estimation from the timestamped pings both sides send every PING_INTERVAL seconds.
+
+A ping carries the sender's monotonic clock in "sent_at" and the pong echoes it back, so the round trip is measured
+on a single clock. The smoothed RTT and its jitter (mean deviation) follow the estimators of RFC 6298,
+percentiles come from a window of the latest samples.
+"""
+
+from collections import deque
+
+PING_INTERVAL = 1
+RTT_ALPHA = 1 / 8
+JITTER_BETA = 1 / 4
+SAMPLE_WINDOW = 120
+
+
+class LatencyTracker:
+
+    def __init__(self, window=SAMPLE_WINDOW):
+        """
+        :param window: how many of the latest samples percentiles are computed from
+        """
+        self.srtt = None
+        self.jitter = 0.0
+        self.samples = deque(maxlen=window)
+
+    def add_sample(self, rtt):
+        """
+        :param rtt: a measured round trip, in seconds
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.jitter = rtt / 2
+        else:
+            self.jitter = (1 - JITTER_BETA) * self.jitter + JITTER_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.samples.append(rtt)
+
+    def percentile(self, percent):
+        """
+        :return: the given percentile of the samples in the window, None before the first sample
+        """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+    def summary(self):
+        """
+        :return: a short line for a status bar
+        """
+        if self.srtt is None:
+            return "RTT -"
+        return f"RTT {self.srtt * 1000:.0f}ms ±{self.jitter * 1000:.0f} p95 {self.percentile(95) * 1000:.0f}ms"
@@ -0,0 +1,110 @@
+"""
+Matchmaking lobby: clients that finished their handshake wait here for the next match.
+
+A match starts as soon as match_size clients are waiting, or once the first of them has waited timeout seconds and
+there are enough players for a game. Clients that join while a match is running wait for the next one.
+Between matches the game loop sleeps on the lobby's wakeup socket, which handshake threads write to when a client
+joins, so an idle server doesn't wake up at all.
+"""
+
+import socket
+from metrics import REGISTRY
+
+# seconds the first waiting client waits for the lobby to fill up before the match starts anyway
+LOBBY_TIMEOUT = 30
+# a match with a single player would be over right away
+MIN_MATCH_PLAYERS = 2
+
+LOBBY_CLIENTS = REGISTRY.gauge("shooter_lobby_clients", "Clients waiting in the lobby for the next match")
+
+
+class Lobby:
+    """
+    Not thread safe on its own, the server calls it with its clients_lock held.
+    """
+
+    def __init__(self, match_size, timeout=LOBBY_TIMEOUT, min_players=MIN_MATCH_PLAYERS):
+        """
+        :param match_size: how many clients play a match, it starts as soon as that many are waiting
+        :param timeout: how long the first waiting client waits for the lobby to fill up, in seconds
+        :param min_players: the fewest players, bots included, a match starts with
+        """
+        self.match_size = match_size
+        self.timeout = timeout
+        self.min_players = min_players
+        # (client handler, time they joined), in order of arrival
+        self.waiting = []
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def clients(self):
+        return [client for client, joined_at in self.waiting]
+
+    def join(self, client, current_time):
+        self.waiting.append((client, current_time))
+        LOBBY_CLIENTS.set(len(self.waiting))
+        try:
+            self.wakeup_writer.send(b"\0")
+        except BlockingIOError:
+            # the game loop has plenty of wakeups it didn't read yet
+            pass
+
+    def leave(self, client):
+        """
+        :return: True if the client was waiting and is now removed
+        """
+        for index, (waiting_client, joined_at) in enumerate(self.waiting):
+            if waiting_client is client:
+                del self.waiting[index]
+                LOBBY_CLIENTS.set(len(self.waiting))
+                return True
+        return False
+
+    def deadline(self):
+        """
+        :return: when the match starts even if the lobby isn't full, None while nobody is waiting
+        """
+        if not self.waiting:
+            return None
+        return self.waiting[0][1] + self.timeout
+
+    def next_match(self, current_time, extra_players=0):
+        """
+        Take the clients of the next match out of the lobby, if it can start.
+        :param extra_players: players that don't come from the lobby, bots
+        :return: the clients, in order of arrival, or None if the match can't start yet
+        """
+        deadline = self.deadline()
+        if deadline is None:
+            return None
+        if len(self.waiting) < self.match_size and (
+                current_time < deadline or len(self.waiting) + extra_players < self.min_players):
+            return None
+        starting = self.clients()[:self.match_size]
+        del self.waiting[:self.match_size]
+        LOBBY_CLIENTS.set(len(self.waiting))
+        return starting
+
+    def wait_timeout(self, current_time):
+        """
+        :return: how long the game loop can sleep before the lobby deadline, None to sleep until someone joins
+        """
+        deadline = self.deadline()
+        if deadline is None or deadline <= current_time:
+            return None
+        return deadline - current_time
+
+    def drain_wakeups(self):
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
@@ -0,0 +1,356 @@
+"""
+Network simulator: a proxy between clients and the server that makes loopback behave like a WAN link.
+
+It listens for TCP connections and UDP datagrams on one port, like the server, and relays them to the server.
+Each direction of each connection is a link with a latency, a jitter and a bandwidth: data waits for the link to be
+free, then for the latency. TCP data stays in order, and a connection whose link is backed up stops being read, so the
+sender feels the backpressure. Datagrams can also be dropped, or held back so later ones overtake them, and
+are dropped when they would wait too long for a busy link, like in an overflowing router queue.
+
+    python3 netsim.py --port 23456 --server-port 12345 --latency 50 --jitter 10 --drop 0.05
+    python3 client.py --port 23456 --udp
+
+A test harness changes the conditions while the game runs, from any thread:
+
+    simulator = NetworkSimulator(23456, "127.0.0.1", 12345, LinkConditions(latency=0.05)).start_in_thread()
+    simulator.set_conditions(bandwidth=4000)
+    simulator.stop()
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import threading
+from collections import namedtuple
+
+# bytes read from a TCP connection at once
+TCP_CHUNK_SIZE = 65536
+# reads a direction of a TCP connection holds on its link before it stops reading from the sender
+MAX_TCP_CHUNKS_IN_FLIGHT = 64
+# seconds a datagram can wait for a busy link before it is dropped
+MAX_UDP_QUEUE_DELAY = 0.5
+MAX_DATAGRAM_SIZE = 65535
+
+
+class LinkConditions(namedtuple("LinkConditions", ["latency", "jitter", "bandwidth", "drop", "reorder",
+                                                   "reorder_delay"],
+                                defaults=(0.0, 0.0, None, 0.0, 0.0, 0.05))):
+    """
+    What each direction of a connection goes through, the same both ways.
+    latency and jitter are in seconds, the delay is latency plus up to jitter more, picked for each piece of data.
+    bandwidth is in bytes per second, None for no cap. drop is the fraction of datagrams lost, reorder the fraction
+    held back reorder_delay seconds more than the rest. TCP is never dropped or reordered.
+    """
+    __slots__ = ()
+
+
+class Link:
+    """
+    One direction of a connection.
+    """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        # when the link is done sending what it was given so far
+        self.free_at = 0.0
+        # when the last piece of ordered data arrives, nothing sent after it can arrive before
+        self.last_arrival = 0.0
+
+    def arrival(self, size, current_time, ordered, max_queue_delay=None):
+        """
+        :param size: bytes sent
+        :param ordered: keep the data behind everything sent before it, for TCP
+        :param max_queue_delay: give up on the data if it would wait longer than this for the link
+        :return: when the data arrives, in event loop time, None if it is dropped
+        """
+        conditions = self.simulator.conditions
+        send_at = max(current_time, self.free_at)
+        if max_queue_delay is not None and send_at - current_time > max_queue_delay:
+            return None
+        self.free_at = send_at + size / conditions.bandwidth if conditions.bandwidth else send_at
+        arrival = self.free_at + conditions.latency + random.uniform(0, conditions.jitter)
+        if ordered:
+            arrival = max(arrival, self.last_arrival)
+            self.last_arrival = arrival
+        return arrival
+
+
+class UdpFlow:
+    """
+    The datagrams of one client address: they go to the server from a socket of their own,
+    so the server tells clients apart by the proxy's address as it would by theirs.
+    """
+
+    def __init__(self, simulator, client_address):
+        self.simulator = simulator
+        self.client_address = client_address
+        self.up = Link(simulator)
+        self.down = Link(simulator)
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server_socket.setblocking(False)
+        self.server_socket.connect((simulator.server_host, simulator.server_port))
+        simulator.loop.add_reader(self.server_socket.fileno(), self.from_server)
+
+    def from_client(self, data):
+        self.simulator.relay_datagram(self.up, self.server_socket.send, data)
+
+    def from_server(self):
+        while True:
+            try:
+                data = self.server_socket.recv(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError, ConnectionRefusedError):
+                return
+            self.simulator.relay_datagram(self.down, self.send_to_client, data)
+
+    def send_to_client(self, data):
+        self.simulator.udp_listener.sendto(data, self.client_address)
+
+    def close(self):
+        self.simulator.loop.remove_reader(self.server_socket.fileno())
+        self.server_socket.close()
+
+
+class UdpListener(asyncio.DatagramProtocol):
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    def datagram_received(self, data, address):
+        flow = self.simulator.udp_flows.get(address)
+        if flow is None:
+            flow = self.simulator.udp_flows[address] = UdpFlow(self.simulator, address)
+        flow.from_client(data)
+
+
+class NetworkSimulator:
+
+    def __init__(self, port, server_host, server_port, conditions=LinkConditions(), host="127.0.0.1"):
+        """
+        :param port: the port clients connect to, TCP and UDP
+        :param server_host: where the server is
+        :param server_port: the port of the server, TCP and UDP
+        :param conditions: the LinkConditions to start with
+        :param host: the address to listen on
+        """
+        self.host = host
+        self.port = port
+        self.server_host = server_host
+        self.server_port = server_port
+        # replaced as a whole, so a harness thread can change it while the loop reads it
+        self.conditions = conditions
+        self.loop = None
+        self.thread = None
+        self.tcp_server = None
+        self.udp_listener = None
+        self.udp_flows = {}
+        self.tcp_tasks = set()
+        self.stats = {"tcp_connections": 0, "tcp_bytes": 0, "datagrams": 0, "datagrams_dropped": 0,
+                      "datagrams_reordered": 0}
+
+    def set_conditions(self, **changes):
+        """
+        Change some of the conditions, for the data sent from now on.
+        :param changes: LinkConditions fields
+        """
+        self.conditions = self.conditions._replace(**changes)
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.tcp_server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.udp_listener, _ = await self.loop.create_datagram_endpoint(lambda: UdpListener(self),
+                                                                        local_addr=(self.host, self.port))
+
+    async def close(self):
+        self.tcp_server.close()
+        for task in list(self.tcp_tasks):
+            task.cancel()
+        await asyncio.gather(*self.tcp_tasks, return_exceptions=True)
+        await self.tcp_server.wait_closed()
+        for flow in self.udp_flows.values():
+            flow.close()
+        self.udp_flows.clear()
+        self.udp_listener.close()
+
+    async def run_script(self, steps):
+        """
+        Change the conditions over time.
+        :param steps: dictionaries with the seconds from now the step happens at in "at", in order,
+                      and the LinkConditions fields it changes
+        """
+        start_time = self.loop.time()
+        for step in steps:
+            changes = dict(step)
+            await asyncio.sleep(max(0.0, start_time + changes.pop("at") - self.loop.time()))
+            self.set_conditions(**changes)
+            print(f"netsim: {self.conditions}")
+
+    def start_in_thread(self):
+        """
+        Run the proxy on an event loop of its own, for a harness that isn't written with asyncio.
+        :return: the simulator, once it listens
+        """
+        started = threading.Event()
+        errors = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self.start())
+            except OSError as e:
+                errors.append(e)
+                started.set()
+                loop.close()
+                return
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.close())
+            loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self
+
+    def stop(self):
+        """
+        Stop a proxy started with start_in_thread, and close every connection.
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def handle_connection(self, client_reader, client_writer):
+        task = asyncio.current_task()
+        self.tcp_tasks.add(task)
+        try:
+            server_reader, server_writer = await asyncio.open_connection(self.server_host, self.server_port)
+        except OSError as e:
+            print(f"netsim: can't reach the server: {e}")
+            client_writer.close()
+            self.tcp_tasks.discard(task)
+            return
+        self.stats["tcp_connections"] += 1
+        try:
+            # when either side closes or fails, the other one notices through the connection it relays to
+            await asyncio.gather(self.pump(client_reader, server_writer, Link(self)),
+                                 self.pump(server_reader, client_writer, Link(self)), return_exceptions=True)
+        except asyncio.CancelledError:
+            # the proxy is closing, asyncio reports a connection handler that ends cancelled as an error
+            pass
+        finally:
+            client_writer.close()
+            server_writer.close()
+            self.tcp_tasks.discard(task)
+
+    async def pump(self, reader, writer, link):
+        """
+        Read one direction of a TCP connection and write each chunk out when the link delivers it.
+        """
+        in_flight = asyncio.Queue(MAX_TCP_CHUNKS_IN_FLIGHT)
+        delivery = asyncio.ensure_future(self.deliver(in_flight, writer))
+        try:
+            while data := await reader.read(TCP_CHUNK_SIZE):
+                self.stats["tcp_bytes"] += len(data)
+                # waits while the link is backed up, the sender's socket buffer fills and it blocks
+                await in_flight.put((link.arrival(len(data), self.loop.time(), ordered=True), data))
+            await in_flight.put((None, None))
+            await delivery
+        except OSError:
+            delivery.cancel()
+            writer.close()
+        except asyncio.CancelledError:
+            delivery.cancel()
+            raise
+
+    async def deliver(self, in_flight, writer):
+        try:
+            while True:
+                arrival, data = await in_flight.get()
+                if data is None:
+                    if writer.can_write_eof():
+                        writer.write_eof()
+                    return
+                await asyncio.sleep(max(0.0, arrival - self.loop.time()))
+                writer.write(data)
+                await writer.drain()
+        except OSError:
+            writer.close()
+            # keep taking chunks so the pump isn't stuck on a full queue
+            while (await in_flight.get())[1] is not None:
+                pass
+
+    def relay_datagram(self, link, send, data):
+        """
+        Put a datagram on a link, it may be lost, held back or dropped for waiting too long on a busy link.
+        :param send: sends the datagram on, when it arrives
+        """
+        self.stats["datagrams"] += 1
+        conditions = self.conditions
+        if random.random() < conditions.drop:
+            self.stats["datagrams_dropped"] += 1
+            return
+        arrival = link.arrival(len(data), self.loop.time(), ordered=False, max_queue_delay=MAX_UDP_QUEUE_DELAY)
+        if arrival is None:
+            self.stats["datagrams_dropped"] += 1
+            return
+        if random.random() < conditions.reorder:
+            self.stats["datagrams_reordered"] += 1
+            arrival += conditions.reorder_delay
+        self.loop.call_at(arrival, self.deliver_datagram, send, data)
+
+    def deliver_datagram(self, send, data):
+        try:
+            send(data)
+        except OSError:
+            # the other end is gone, like a datagram lost on the way
+            pass
+
+
+async def run_proxy(args):
+    simulator = NetworkSimulator(args.port, args.server_ip, args.server_port,
+                                 LinkConditions(args.latency / 1000, args.jitter / 1000, args.bandwidth, args.drop,
+                                                args.reorder, args.reorder_delay / 1000), args.ip)
+    await simulator.start()
+    print(f"netsim: relaying {args.ip}:{args.port} to {args.server_ip}:{args.server_port}, {simulator.conditions}")
+    try:
+        if args.script is not None:
+            with open(args.script) as script_file:
+                steps = json.load(script_file)
+            await simulator.run_script(steps)
+        await asyncio.Event().wait()
+    finally:
+        await simulator.close()
+        print(f"netsim: {simulator.stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay clients to the server through a simulated WAN link")
+    parser.add_argument("--ip", default="127.0.0.1", type=str, help="The address clients connect to")
+    parser.add_argument("--port", default=23456, type=int, help="The port clients connect to, TCP and UDP")
+    parser.add_argument("--server-ip", default="127.0.0.1", type=str, help="The address of the server")
+    parser.add_argument("--server-port", default=12345, type=int, help="The port of the server")
+    parser.add_argument("--latency", default=0.0, type=float, help="One way delay, in milliseconds")
+    parser.add_argument("--jitter", default=0.0, type=float, help="Up to this many more milliseconds of delay")
+    parser.add_argument("--bandwidth", default=None, type=float, help="Bytes per second each way, no cap by default")
+    parser.add_argument("--drop", default=0.0, type=float, help="The fraction of datagrams lost")
+    parser.add_argument("--reorder", default=0.0, type=float,
+                        help="The fraction of datagrams held back so later ones overtake them")
+    parser.add_argument("--reorder-delay", default=50.0, type=float,
+                        help="How long reordered datagrams are held back, in milliseconds")
+    parser.add_argument("--script", default=None, type=str,
+                        help="A JSON list of condition changes over time, like "
+                             "[{\"at\": 10, \"latency\": 0.2}, {\"at\": 20, \"bandwidth\": 4000}], in seconds and "
+                             "bytes per second")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run_proxy(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
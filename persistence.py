@@ -0,0 +1,152 @@
+"""
+Crash-recovery snapshots of a running match.
+
+The game loop hands GameBoard.capture_state() to a MatchSnapshotWriter, whose thread serializes it and writes it to a
+memory-mapped file. The file holds two slots that are written alternately, each with a sequence number and a CRC,
+so a crash in the middle of a write still leaves the previous snapshot intact. load_snapshot picks the newest valid one.
+Snapshots are pickled, only load files this server wrote.
+"""
+
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from metrics import REGISTRY
+
+SNAPSHOT_MAGIC = b"SHTRSNAP"
+SNAPSHOT_VERSION = 1
+DEFAULT_SLOT_SIZE = 64 * 1024
+# magic, version, slot size
+FILE_HEADER = struct.Struct(">8sIQ")
+# sequence number, payload length, payload crc32
+SLOT_HEADER = struct.Struct(">QII")
+
+SNAPSHOT_WRITE_DURATION = REGISTRY.histogram("shooter_snapshot_write_seconds",
+                                             "Time spent serializing and writing a match snapshot")
+SNAPSHOT_BYTES = REGISTRY.gauge("shooter_snapshot_bytes", "Size of the last match snapshot written")
+
+
+def slot_offset(slot, slot_size):
+    return FILE_HEADER.size + slot * (SLOT_HEADER.size + slot_size)
+
+
+class MatchSnapshotWriter:
+
+    def __init__(self, path, slot_size=DEFAULT_SLOT_SIZE):
+        """
+        :param path: the snapshot file, it is truncated
+        :param slot_size: the initial room for one snapshot, the file grows when a snapshot doesn't fit
+        """
+        self.path = path
+        self.slot_size = slot_size
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.latest_state = None
+        self.wake_event = threading.Event()
+        self.running = True
+        self.snapshot_file, self.snapshot_map = self.create_file(path, slot_size)
+        self.writer_thread = threading.Thread(target=self.run, daemon=True)
+        self.writer_thread.start()
+
+    def create_file(self, path, slot_size):
+        snapshot_file = open(path, "w+b")
+        snapshot_file.truncate(slot_offset(2, slot_size))
+        snapshot_map = mmap.mmap(snapshot_file.fileno(), 0)
+        FILE_HEADER.pack_into(snapshot_map, 0, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, slot_size)
+        return snapshot_file, snapshot_map
+
+    def submit(self, state):
+        """
+        Hand a captured state to the writer thread, never blocks on I/O.
+        If the writer is still busy with an older state, that one is replaced.
+        :param state: the value returned by GameBoard.capture_state
+        """
+        with self.lock:
+            self.latest_state = state
+        self.wake_event.set()
+
+    def run(self):
+        while self.running:
+            self.wake_event.wait()
+            self.wake_event.clear()
+            with self.lock:
+                state, self.latest_state = self.latest_state, None
+            if state is not None:
+                try:
+                    self.write(state)
+                except Exception as e:
+                    print(f"Failed writing match snapshot to {self.path}: {type(e).__name__}: {e}")
+
+    def write(self, state):
+        start_time = time.perf_counter()
+        payload = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL), 1)
+        self.seq += 1
+        if len(payload) > self.slot_size:
+            self.grow(payload)
+        else:
+            self.write_slot(self.snapshot_map, self.slot_size, payload)
+        SNAPSHOT_BYTES.set(len(payload))
+        SNAPSHOT_WRITE_DURATION.observe(time.perf_counter() - start_time)
+
+    def write_slot(self, snapshot_map, slot_size, payload):
+        offset = slot_offset(self.seq % 2, slot_size)
+        snapshot_map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(payload)] = payload
+        # the header goes last, a torn write leaves a slot whose CRC doesn't match
+        SLOT_HEADER.pack_into(snapshot_map, offset, self.seq, len(payload), zlib.crc32(payload))
+        snapshot_map.flush()
+
+    def grow(self, payload):
+        """
+        Move to a file with slots big enough for payload, the new file holds it before it replaces the old one.
+        """
+        slot_size = self.slot_size
+        while slot_size < len(payload):
+            slot_size *= 2
+        # build the bigger file next to the old one and swap it in, so there is always a valid snapshot on disk
+        temp_path = self.path + ".tmp"
+        snapshot_file, snapshot_map = self.create_file(temp_path, slot_size)
+        self.write_slot(snapshot_map, slot_size, payload)
+        self.close_file()
+        os.replace(temp_path, self.path)
+        self.snapshot_file, self.snapshot_map = snapshot_file, snapshot_map
+        self.slot_size = slot_size
+
+    def close_file(self):
+        self.snapshot_map.close()
+        self.snapshot_file.close()
+
+    def close(self):
+        self.running = False
+        self.wake_event.set()
+        self.writer_thread.join()
+        self.close_file()
+
+
+def load_snapshot(path):
+    """
+    Read the newest intact snapshot from a snapshot file.
+    :param path: the snapshot file
+    :return: the state to pass to GameBoard.restore_state, or None if the file holds no valid snapshot
+    """
+    with open(path, "rb") as snapshot_file:
+        data = snapshot_file.read()
+    if len(data) < FILE_HEADER.size:
+        return None
+    magic, version, slot_size = FILE_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        return None
+    newest_seq, newest_payload = 0, None
+    for slot in range(2):
+        offset = slot_offset(slot, slot_size)
+        if offset + SLOT_HEADER.size > len(data):
+            continue
+        seq, length, crc = SLOT_HEADER.unpack_from(data, offset)
+        payload = data[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length]
+        if seq > newest_seq and length <= slot_size and len(payload) == length and zlib.crc32(payload) == crc:
+            newest_seq, newest_payload = seq, payload
+    if newest_payload is None:
+        return None
+    return pickle.loads(zlib.decompress(newest_payload))
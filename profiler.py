@@ -0,0 +1,190 @@
+"""
+Runtime-togglable tick profiler.
+
+While active, a background thread samples the stacks of the game loop thread and of the broadcast workers, and they
+report named phases. When the profiling window ends, the samples are written as a collapsed-stack file (one
+"frame;frame;frame count" line per stack, the input format of flamegraph.pl and speedscope) next to a per-phase timing
+summary. Stacks and phases of a worker are filed under its pool, like "broadcast_workers;serialization".
+"""
+
+import os
+import signal
+import sys
+import threading
+import time
+
+DEFAULT_SAMPLE_INTERVAL = 0.001
+DEFAULT_PROFILE_SECONDS = 10
+# the game loop hands serialization, compression and sends to threads with these name prefixes, see broadcaster.py
+DEFAULT_PROFILED_THREADS = ("broadcast",)
+
+
+class NullPhase:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class Phase:
+
+    def __init__(self, profiler, name, thread_label, phase_stack):
+        self.profiler = profiler
+        self.name = name
+        self.thread_label = thread_label
+        self.phase_stack = phase_stack
+        self.start_time = None
+
+    def __enter__(self):
+        self.phase_stack.append(self.name)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter() - self.start_time
+        profiler = self.profiler
+        path = ";".join(self.phase_stack)
+        if self.thread_label:
+            path = f"{self.thread_label};{path}"
+        if self.phase_stack:
+            self.phase_stack.pop()
+        with profiler.lock:
+            stats = profiler.phase_stats.get(path)
+            if stats is None:
+                stats = profiler.phase_stats[path] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+        return False
+
+
+class TickProfiler:
+
+    def __init__(self, output_dir=".", sample_interval=DEFAULT_SAMPLE_INTERVAL,
+                 profiled_threads=DEFAULT_PROFILED_THREADS):
+        """
+        :param profiled_threads: name prefixes of the worker threads profiled along with the game loop
+        """
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.profiled_threads = profiled_threads
+        self.active = False
+        self.target_thread_id = None
+        self.sampler_thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.samples = {}
+        # thread id -> what its stacks and phases are filed under, "" for the game loop, None for unprofiled threads
+        self.thread_labels = {}
+        # thread id -> the phases the thread is in, outermost first
+        self.phase_stacks = {}
+        self.phase_stats = {}
+
+    def thread_label(self, thread):
+        if thread.ident == self.target_thread_id:
+            return ""
+        for prefix in self.profiled_threads:
+            if thread.name.startswith(prefix):
+                return f"{prefix}_workers"
+        return None
+
+    def phase(self, name):
+        """
+        Time a phase, a no-op unless a profiling window is open and this is a profiled thread.
+        :param name: the phase name, nested phases are reported as "outer;inner"
+        :return: a context manager
+        """
+        if not self.active:
+            return NULL_PHASE
+        thread_id = threading.get_ident()
+        try:
+            label = self.thread_labels[thread_id]
+        except KeyError:
+            # workers come and go with each match, they are found the first time they report a phase
+            label = self.thread_labels[thread_id] = self.thread_label(threading.current_thread())
+            self.phase_stacks[thread_id] = []
+        if label is None:
+            return NULL_PHASE
+        return Phase(self, name, label, self.phase_stacks[thread_id])
+
+    def start(self, duration=DEFAULT_PROFILE_SECONDS, thread_id=None):
+        """
+        Open a profiling window.
+        :param duration: how many seconds to sample for
+        :param thread_id: the thread to sample, the main thread by default
+        """
+        if self.active:
+            print("Profiler already running")
+            return
+        self.target_thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+        self.samples = {}
+        self.phase_stats = {}
+        self.thread_labels = {self.target_thread_id: ""}
+        self.phase_stacks = {self.target_thread_id: []}
+        self.stop_event.clear()
+        self.active = True
+        print(f"Profiling for {duration} seconds")
+        self.sampler_thread = threading.Thread(target=self.sample, args=(time.monotonic() + duration,), daemon=True)
+        self.sampler_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def sample(self, deadline):
+        while not self.stop_event.is_set() and time.monotonic() < deadline:
+            frames = sys._current_frames()
+            for thread_id, label in list(self.thread_labels.items()):
+                frame = frames.get(thread_id)
+                if label is None or frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.extend(f"[{phase}]" for phase in reversed(list(self.phase_stacks[thread_id])))
+                if label:
+                    stack.append(label)
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self.stop_event.wait(self.sample_interval)
+        self.active = False
+        self.dump()
+
+    def dump(self):
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        stacks_path = os.path.join(self.output_dir, f"profile-{timestamp}.folded")
+        phases_path = os.path.join(self.output_dir, f"profile-{timestamp}.phases.txt")
+        with open(stacks_path, "w") as stacks_file:
+            for stack, count in sorted(self.samples.items()):
+                stacks_file.write(f"{stack} {count}\n")
+        with open(phases_path, "w") as phases_file:
+            phases_file.write(f"{'phase':40} {'calls':>8} {'total ms':>10} {'mean ms':>9} {'max ms':>9}\n")
+            with self.lock:
+                phase_stats = dict(self.phase_stats)
+            for path, (calls, total, longest) in sorted(phase_stats.items()):
+                phases_file.write(f"{path:40} {calls:8} {total * 1000:10.2f} {total * 1000 / calls:9.3f} "
+                                  f"{longest * 1000:9.3f}\n")
+        print(f"Profile written to {stacks_path} and {phases_path}")
+
+
+PROFILER = TickProfiler()
+
+
+def install_signal_handlers(profiler=PROFILER, duration=DEFAULT_PROFILE_SECONDS):
+    """
+    SIGUSR1 opens a profiling window of the given duration, SIGUSR2 closes it early.
+    Must be called from the main thread.
+    """
+    if not hasattr(signal, "SIGUSR1"):
+        print("Profiling signals are not supported on this platform")
+        return
+    signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.start(duration))
+    signal.signal(signal.SIGUSR2, lambda signum, frame: profiler.stop())
+    print(f"Send SIGUSR1 to pid {os.getpid()} to profile for {duration} seconds")
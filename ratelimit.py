@@ -0,0 +1,39 @@
+"""
+Token bucket rate limiting of what clients send.
+
+Each message takes a token, tokens come back at a fixed rate up to the size of the bucket, so a client can send short
+bursts but never more than the rate on average. A message that finds the bucket empty is dropped.
+"""
+
+# messages per second a client can send over TCP, a few times what a player holding keys down sends
+INPUT_RATE = 60
+# how many messages a client can send at once after being quiet
+INPUT_BURST = 30
+# a client that sends this many messages in a row over its limit is flooding and gets disconnected
+FLOOD_LIMIT = 200
+
+
+class TokenBucket:
+
+    def __init__(self, rate=INPUT_RATE, burst=INPUT_BURST):
+        """
+        :param rate: tokens added per second
+        :param burst: the most tokens the bucket holds
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_refill = None
+
+    def take(self, current_time, tokens=1):
+        """
+        :param current_time: the current time, in seconds
+        :return: True if there were enough tokens, and they are taken
+        """
+        if self.last_refill is not None:
+            self.tokens = min(self.burst, self.tokens + (current_time - self.last_refill) * self.rate)
+        self.last_refill = current_time
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
@@ -0,0 +1,325 @@
+"""
+What the client draws the game with.
+
+Both renderers lay the screen out the same way: the board in a border, the player count and health under it, then the
+status bar and the debug bar, and every player's health on the right of the board. The client's GameBoard tells them
+what goes where, nothing shows up until present is called, once per frame.
+
+CursesRenderer draws with curses windows. AnsiRenderer keeps what the terminal shows and what the next frame shows in
+two cell buffers and writes only the cells that changed, as one buffer of escape sequences and a single write.
+"""
+
+import curses
+import os
+import select
+import termios
+import tty
+from unicodedata import east_asian_width
+
+PLAYER_COUNT_LABEL = "Players: "
+PLAYER_COUNT_MAX_SIZE = 3
+HEALTH_LABEL = "Your health: "
+HEALTH_MAX_SIZE = 5
+PLAYERS_HEALTH_WIDTH = 20
+
+
+class CursesRenderer:
+
+    def __init__(self, rows, cols):
+        """
+        :param rows: the rows of the board, without its border
+        :param cols: the cols of the board, without its border
+        """
+        self.rows = rows
+        self.cols = cols
+        self.stdscr = curses.initscr()
+        curses.curs_set(0)
+        curses.noecho()
+        curses.cbreak()
+        curses.start_color()
+        curses.use_default_colors()
+        # color -> curses attribute, pairs are set up the first time a color is drawn, see color_attribute
+        self.color_attributes = {0: 0}
+        self.closed = False
+        self.stdscr.keypad(True)
+        self.outer_board = curses.newwin(rows + 2, cols + 2, 0, 0)
+        self.main_board = curses.newwin(rows, cols, 1, 1)
+        self.outer_board.border()
+        mid_col = (cols + 2) // 2
+        self.player_count_label = curses.newwin(1, mid_col, rows + 2, 0)
+        self.player_count_label.addstr(0, 0, PLAYER_COUNT_LABEL)
+        self.player_count_value = curses.newwin(1, PLAYER_COUNT_MAX_SIZE, rows + 2, len(PLAYER_COUNT_LABEL))
+        self.health_bar_label = curses.newwin(1, mid_col, rows + 2, mid_col)
+        self.health_bar_label.addstr(0, 0, HEALTH_LABEL)
+        self.health_bar_value = curses.newwin(1, HEALTH_MAX_SIZE, rows + 2, mid_col + len(HEALTH_LABEL))
+        self.status_bar = curses.newwin(1, cols + 2, rows + 3, 0)
+        self.debug_bar = curses.newwin(1, cols + 2, rows + 4, 0)
+        self.status_bar.keypad(True)
+        # keys are read until none is left, without waiting for the next one
+        self.status_bar.nodelay(True)
+        self.players_health_window = curses.newwin(rows, PLAYERS_HEALTH_WIDTH, 0, cols + 2)
+        for window in (self.outer_board, self.main_board, self.player_count_label, self.health_bar_label):
+            window.noutrefresh()
+
+    def color_attribute(self, color):
+        """
+        :param color: a color as sent by the server, pair color draws terminal color color - 1 on the default background
+        :return: the curses attribute to draw with it, the default colors if the terminal doesn't have it
+        """
+        attribute = self.color_attributes.get(color)
+        if attribute is None:
+            attribute = 0
+            # the game draws a handful of colors, setting up every pair of a 256 color terminal delays the first frame
+            if 0 < color <= curses.COLORS and color < curses.COLOR_PAIRS:
+                curses.init_pair(color, color - 1, -1)
+                attribute = curses.color_pair(color)
+            self.color_attributes[color] = attribute
+        return attribute
+
+    def draw_board(self, cells):
+        """
+        :param cells: (row, col, character, color) of everything on the board, relative to its top left corner
+        """
+        self.main_board.erase()
+        for row, col, character, color in cells:
+            try:
+                self.main_board.addstr(row, col, character, self.color_attribute(color))
+            except curses.error:
+                # writing the bottom right cell moves the cursor off the window, the character is still drawn
+                pass
+        self.main_board.noutrefresh()
+
+    def draw_message(self, text):
+        """
+        Clear the board and write text in its middle.
+        """
+        self.main_board.erase()
+        self.main_board.addstr(self.rows // 2, max(self.cols // 2 - len(text) // 2, 0), text[:self.cols - 1])
+        self.main_board.noutrefresh()
+
+    def draw_player_count(self, text):
+        self.draw_line(self.player_count_value, text)
+
+    def draw_health(self, text, color):
+        self.draw_line(self.health_bar_value, text, self.color_attribute(color))
+
+    def draw_status(self, text):
+        self.draw_line(self.status_bar, text)
+
+    def draw_debug(self, text):
+        self.draw_line(self.debug_bar, text)
+
+    def draw_players_health(self, lines):
+        self.players_health_window.erase()
+        for i, line in enumerate(lines[:self.rows]):
+            self.players_health_window.addstr(i, 0, line[:PLAYERS_HEALTH_WIDTH - 1])
+        self.players_health_window.noutrefresh()
+
+    def draw_line(self, window, text, attribute=0):
+        window.erase()
+        window.addstr(0, 0, text[:window.getmaxyx()[1] - 1], attribute)
+        window.noutrefresh()
+
+    def present(self):
+        curses.doupdate()
+
+    def read_key(self):
+        """
+        :return: the next key pressed, -1 if there is none
+        """
+        return self.status_bar.getch()
+
+    def wait_key(self):
+        """
+        Wait for a key press, ignoring the ones pressed before.
+        """
+        curses.flushinp()
+        self.status_bar.nodelay(False)
+        self.status_bar.getch()
+        self.status_bar.nodelay(True)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            curses.endwin()
+
+
+# the cell of a blank screen
+BLANK = (" ", 0)
+# rewriting up to this many unchanged cells is shorter than the escape sequence that moves the cursor past them
+MAX_REWRITTEN_GAP = 4
+# east asian widths of the characters that take two columns, most emojis among them
+WIDE_CHARACTERS = {"W", "F"}
+# arrow key escape sequences -> the curses key codes the key mappings use
+ARROW_KEYS = {b"A": curses.KEY_UP, b"B": curses.KEY_DOWN, b"C": curses.KEY_RIGHT, b"D": curses.KEY_LEFT}
+
+
+class AnsiRenderer:
+
+    def __init__(self, rows, cols, input_fd=0, output_fd=1):
+        """
+        :param rows: the rows of the board, without its border
+        :param cols: the cols of the board, without its border
+        :param input_fd: the terminal keys are read from
+        :param output_fd: the terminal frames are written to
+        """
+        self.rows = rows
+        self.cols = cols
+        self.input_fd = input_fd
+        self.output_fd = output_fd
+        self.height = rows + 5
+        self.width = cols + 2 + PLAYERS_HEALTH_WIDTH
+        # the next frame and what the terminal shows, (character, color) per cell, the screen is cleared below
+        self.back = [[BLANK] * self.width for _ in range(self.height)]
+        self.front = [[BLANK] * self.width for _ in range(self.height)]
+        # bytes read from the terminal that aren't a whole key yet
+        self.pending_input = b""
+        self.closed = False
+        self.terminal_attributes = termios.tcgetattr(input_fd)
+        tty.setcbreak(input_fd)
+        # alternate screen, hidden cursor, cleared screen
+        os.write(output_fd, b"\x1b[?1049h\x1b[?25l\x1b[0m\x1b[2J")
+        self.put(0, 0, "┌" + "─" * cols + "┐")
+        for row in range(1, rows + 1):
+            self.put(row, 0, "│")
+            self.put(row, cols + 1, "│")
+        self.put(rows + 1, 0, "└" + "─" * cols + "┘")
+        mid_col = (cols + 2) // 2
+        self.player_count_col = len(PLAYER_COUNT_LABEL)
+        self.health_col = mid_col + len(HEALTH_LABEL)
+        self.put(rows + 2, 0, PLAYER_COUNT_LABEL)
+        self.put(rows + 2, mid_col, HEALTH_LABEL)
+
+    def put(self, row, col, text, color=0, width=None):
+        """
+        Write text in the next frame, cut at width cells and at the edge of the screen.
+        """
+        line = self.back[row]
+        end = self.width if width is None else min(col + width, self.width)
+        for character in text[:max(end - col, 0)]:
+            line[col] = (character, color)
+            col += 1
+
+    def clear(self, row, col, width):
+        self.back[row][col:col + width] = [BLANK] * width
+
+    def draw_board(self, cells):
+        """
+        :param cells: (row, col, character, color) of everything on the board, relative to its top left corner
+        """
+        back = self.back
+        for row in range(1, self.rows + 1):
+            self.clear(row, 1, self.cols)
+        rows = self.rows
+        cols = self.cols
+        for row, col, character, color in cells:
+            if 0 <= row < rows and 0 <= col < cols:
+                back[row + 1][col + 1] = (character, color)
+
+    def draw_message(self, text):
+        """
+        Clear the board and write text in its middle.
+        """
+        self.draw_board(())
+        self.put(self.rows // 2 + 1, max(self.cols // 2 - len(text) // 2, 0) + 1, text, width=self.cols - 1)
+
+    def draw_player_count(self, text):
+        self.draw_line(self.rows + 2, self.player_count_col, text, PLAYER_COUNT_MAX_SIZE)
+
+    def draw_health(self, text, color):
+        self.draw_line(self.rows + 2, self.health_col, text, HEALTH_MAX_SIZE, color)
+
+    def draw_status(self, text):
+        self.draw_line(self.rows + 3, 0, text, self.cols + 1)
+
+    def draw_debug(self, text):
+        self.draw_line(self.rows + 4, 0, text, self.cols + 1)
+
+    def draw_players_health(self, lines):
+        for row in range(self.rows):
+            self.draw_line(row, self.cols + 2, lines[row] if row < len(lines) else "", PLAYERS_HEALTH_WIDTH - 1)
+
+    def draw_line(self, row, col, text, width, color=0):
+        self.clear(row, col, width)
+        self.put(row, col, text, color, width)
+
+    def present(self):
+        """
+        Write the cells that changed since the last frame to the terminal.
+        """
+        output = []
+        # where the terminal's cursor is, None when it isn't known
+        cursor_row = None
+        cursor_col = None
+        current_color = None
+        for row, (back_line, front_line) in enumerate(zip(self.back, self.front)):
+            if back_line == front_line:
+                continue
+            for col, cell in enumerate(back_line):
+                if cell == front_line[col]:
+                    continue
+                if row != cursor_row or cursor_col is None or col < cursor_col:
+                    output.append(f"\x1b[{row + 1};{col + 1}H")
+                elif col > cursor_col:
+                    gap = front_line[cursor_col:col]
+                    if col - cursor_col <= MAX_REWRITTEN_GAP and all(
+                            character.isascii() and (character == " " or color == current_color)
+                            for character, color in gap):
+                        output.extend(character for character, color in gap)
+                    else:
+                        output.append(f"\x1b[{col + 1}G")
+                character, color = cell
+                # a blank looks the same in every color
+                if color != current_color and character != " ":
+                    output.append(f"\x1b[38;5;{color - 1}m" if color > 0 else "\x1b[39m")
+                    current_color = color
+                output.append(character)
+                front_line[col] = cell
+                cursor_row = row
+                # emojis can take two columns, move the cursor explicitly after anything that might be wide
+                cursor_col = col + 1 if character.isascii() or (
+                        len(character) == 1 and east_asian_width(character) not in WIDE_CHARACTERS) else None
+        if output:
+            self.write("".join(output).encode())
+
+    def write(self, data):
+        # one write for the whole frame, a terminal takes it in one go unless it is very large
+        while data:
+            data = data[os.write(self.output_fd, data):]
+
+    def read_key(self):
+        """
+        :return: the next key pressed, -1 if there is none
+        """
+        if not self.pending_input and select.select([self.input_fd], [], [], 0)[0]:
+            self.pending_input = os.read(self.input_fd, 1024)
+        if not self.pending_input:
+            return -1
+        if self.pending_input[:2] == b"\x1b[" and self.pending_input[2:3] in ARROW_KEYS:
+            key = ARROW_KEYS[self.pending_input[2:3]]
+            self.pending_input = self.pending_input[3:]
+            return key
+        key = self.pending_input[0]
+        self.pending_input = self.pending_input[1:]
+        return key
+
+    def wait_key(self):
+        """
+        Wait for a key press, ignoring the ones pressed before.
+        """
+        termios.tcflush(self.input_fd, termios.TCIFLUSH)
+        self.pending_input = b""
+        select.select([self.input_fd], [], [])
+        self.read_key()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            os.write(self.output_fd, b"\x1b[0m\x1b[?25h\x1b[?1049l")
+            termios.tcsetattr(self.input_fd, termios.TCSADRAIN, self.terminal_attributes)
+
+
+RENDERERS = {
+    "curses": CursesRenderer,
+    "ansi": AnsiRenderer
+}
@@ -1,4 +1,21 @@
-from json_socket import JSONSocket
+from json_socket import (JSONSocket, COMPRESSION_METHOD, FrameTooLarge, BYTES_SENT, BYTES_RECEIVED, MESSAGES_SENT,
+                         MESSAGES_RECEIVED)
+from json_datagram_socket import (JSONDatagramSocket, DatagramTooLarge, DATAGRAMS_DROPPED, DATAGRAMS_SENT,
+                                  DATAGRAMS_RECEIVED)
+from metrics import REGISTRY, start_metrics_server
+from profiler import PROFILER, install_signal_handlers
+from broadcaster import GameStateBroadcaster, DEFAULT_BROADCAST_WORKERS, SKIPPED_FRAMES
+from persistence import MatchSnapshotWriter, load_snapshot
+from world import ChunkedWorld, chunk_keys_in_view
+from latency import LatencyTracker, PING_INTERVAL
+from bots import BotController, BOT_CHARACTERS
+from terrain import Terrain
+from visibility import VisibilityCache
+from lobby import Lobby, LOBBY_TIMEOUT
+from ratelimit import TokenBucket, FLOOD_LIMIT
+from stats import StatsRecorder
+from checksum import entity_hash, players_health_checksum, CHECKSUM_MASK
+import os
 import socket
 import threading
 import argparse
@@ -7,15 +24,70 @@ from transaction import Transaction
 from server_transactions import *
 import time
 import random
+import secrets
+from collections import namedtuple, deque
+from types import MappingProxyType
 import keys
 
 POWERUP_SPAWN_CHANCE = 0.01
 END_GAME_ON_SINGLE_PLAYER = True
+# log every move and homing missile decision, far too much output for a real match
+ENABLE_DEBUG_LOG = False
 GAME_REFRESH_INTERVAL = 1 / 15  # 30 FPS
-MOVE_INTERVAL = GAME_REFRESH_INTERVAL
+MOVE_INTERVAL = 1  # ticks between moves
+# inputs a player can have waiting for the next tick, older ones are dropped first
+MAX_QUEUED_INPUTS = 16
+
+# seconds a new connection has to send its whole handshake
+HANDSHAKE_TIMEOUT = 5
+# connections that can be handshaking at once, each holds a thread, the ones over it are turned away
+MAX_PENDING_HANDSHAKES = 64
+# seconds a player whose connection dropped stays in the game, waiting for their client to reconnect
+RECONNECT_GRACE_PERIOD = 10
+SNAPSHOT_INTERVAL = 30  # ticks between crash-recovery snapshots
+# how far back shots from lagging clients are resolved, in ticks
+LAG_COMPENSATION_TICKS = 8
+
+# seconds a write to a client can block, a client that stops reading is dropped instead of pinning a broadcast worker
+CLIENT_SEND_TIMEOUT = 2
+# seconds the rest of a client frame has to arrive once select saw its first bytes, the game loop waits for it
+CLIENT_FRAME_TIMEOUT = 0.1
+# clients only send handshakes, keypresses, pings and pongs, a bigger frame is refused before it is read
+MAX_CLIENT_FRAME_SIZE = 4096
 
 BANNED_CHARACTERS = {"\n", "\r", "\t", "\b", "\f", "\v", " ", ":", ";", ",", "."}
 
+TICK_DURATION = REGISTRY.histogram("shooter_tick_duration_seconds", "Time spent simulating and broadcasting a tick",
+                                   buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.04, GAME_REFRESH_INTERVAL, 0.1, 0.25))
+TICK_OVERRUNS = REGISTRY.counter("shooter_tick_overruns_total", "Ticks that took longer than the refresh interval")
+ENTITIES = REGISTRY.gauge("shooter_entities", "Entities on the board by type", ("type",))
+TRANSACTIONS = REGISTRY.gauge("shooter_transactions", "Size of the server transaction table")
+CONNECTED_CLIENTS = REGISTRY.gauge("shooter_connected_clients", "Clients currently connected")
+ACTIVE_CHUNKS = REGISTRY.gauge("shooter_active_chunks", "World chunks holding at least one entity")
+DROPPED_CLIENTS = REGISTRY.counter("shooter_dropped_clients_total", "Clients dropped after a socket error")
+KICKED_CLIENTS = REGISTRY.counter("shooter_kicked_clients_total", "Clients disconnected for flooding or bad messages",
+                                  ("reason",))
+RATE_LIMITED_MESSAGES = REGISTRY.counter("shooter_rate_limited_messages_total",
+                                         "Messages dropped unread because their client went over its rate limit",
+                                         ("client",))
+RESUMED_CLIENTS = REGISTRY.counter("shooter_resumed_clients_total", "Dropped clients that reconnected in time")
+KEYFRAME_REQUESTS = REGISTRY.counter("shooter_keyframe_requests_total",
+                                    "Game states sent again in full because a client's didn't match its checksum",
+                                    ("client",))
+MATCHES_PLAYED = REGISTRY.counter("shooter_matches_total", "Matches played to the end")
+LAG_COMPENSATED_HITS = REGISTRY.counter("shooter_lag_compensated_hits_total",
+                                        "Hits on where a player was on an earlier tick, seen by a lagging shooter")
+CLIENT_RTT = REGISTRY.histogram("shooter_client_rtt_seconds", "Round trip of server pings", ("client",),
+                                buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.2, 0.4, 0.8, 1.6))
+CLIENT_SMOOTHED_RTT = REGISTRY.gauge("shooter_client_smoothed_rtt_seconds", "Smoothed round trip of server pings",
+                                     ("client",))
+CLIENT_JITTER = REGISTRY.gauge("shooter_client_jitter_seconds", "Mean deviation of the round trip of server pings",
+                               ("client",))
+# series labelled with a client's name, removed when the client leaves for good
+CLIENT_METRICS = (BYTES_SENT, BYTES_RECEIVED, MESSAGES_SENT, MESSAGES_RECEIVED, DATAGRAMS_SENT, DATAGRAMS_RECEIVED,
+                  SKIPPED_FRAMES, RATE_LIMITED_MESSAGES, KEYFRAME_REQUESTS, CLIENT_RTT, CLIENT_SMOOTHED_RTT,
+                  CLIENT_JITTER)
+
 
 class ClientHandler:
 
@@ -26,15 +98,30 @@ class ClientHandler:
         self.client_socket = client_socket
         self.client_address = client_address
         self.game_server = game_server
+        self.udp_token = None
+        self.udp_address = None
+        self.last_input_seq = 0
+        self.session_token = None
+        # top left corner of the part of the board this client sees, when the board is bigger than the view
+        self.view_origin = (0, 0)
+        self.latency = LatencyTracker()
+        # the transaction id of the last ping sent to this client
+        self.ping_tid = None
+        # TCP messages and input datagrams share one rate limit
+        self.input_bucket = TokenBucket()
+        # messages dropped in a row for going over the rate limit
+        self.flood_count = 0
 
     def handshake(self):
         print("Waiting for handshake")
-        client_payload = self.client_socket.recv_json()
+        # a client that connects and never talks, or talks a byte at a time, must not hold a handshake thread forever
+        self.client_socket.settimeout(HANDSHAKE_TIMEOUT)
+        client_payload = self.client_socket.recv_json(deadline=time.monotonic() + HANDSHAKE_TIMEOUT)
         print(f"Received handshake: {client_payload}")
-        if client_payload["type"] != "handshake":
+        if client_payload is None or client_payload.get("type") != "handshake":
             print("Invalid handshake")
             self.client_socket.close()
-            return
+            return False
         self.client_name = client_payload["player_name"]
         self.client_character = client_payload["player_character"]
         print(f"Received handshake from {self.client_name} with character {self.client_character}")
@@ -42,41 +129,91 @@ class ClientHandler:
             "type": "handshake_ack",
             "success": True
         }
-        if not self.client_name.isalnum():
-            print(f"Rejected connection from {self.client_address}, invalid player name")
-            handshake_ack_payload["success"] = False
-            handshake_ack_payload["fail_reason"] = "Invalid player name, must be alphanumeric"
-        elif self.client_name.lower() in [client.client_name.lower() for client in self.game_server.clients.values()]:
-            print(f"Rejected connection from {self.client_address}, duplicate player name")
-            handshake_ack_payload["success"] = False
-            handshake_ack_payload["fail_reason"] = "Duplicate player name"
-        elif self.game_server.game_started:
-            print(f"Rejected connection from {self.client_address}, game already started")
-            handshake_ack_payload["success"] = False
-            handshake_ack_payload["fail_reason"] = "Game already started"
+        resuming = "session_token" in client_payload
+        if resuming:
+            # a dropped client coming back, name and character are taken from the session
+            fail_reason = self.game_server.claim_session(self, client_payload["session_token"])
+        elif not self.client_name.isalnum():
+            fail_reason = "Invalid player name, must be alphanumeric"
         elif len(self.client_character) != 1:
-            print(f"Rejected connection from {self.client_address}, invalid character")
-            handshake_ack_payload["success"] = False
-            handshake_ack_payload["fail_reason"] = "Invalid character, must be a single character"
+            fail_reason = "Invalid character, must be a single character"
         elif self.client_character in BANNED_CHARACTERS:
-            print(f"Rejected connection from {self.client_address}, banned character")
-            handshake_ack_payload["success"] = False
-            handshake_ack_payload["fail_reason"] = "Banned character"
-        elif self.client_character in [player.character for player in self.game_server.game_board.players.values()]:
-            print(f"Rejected connection from {self.client_address}, duplicate character")
+            fail_reason = "Banned character"
+        else:
+            fail_reason = self.game_server.register_client(self)
+
+        if fail_reason is not None:
+            print(f"Rejected connection from {self.client_address}, {fail_reason}")
             handshake_ack_payload["success"] = False
-            handshake_ack_payload["fail_reason"] = "Duplicate character"
+            handshake_ack_payload["fail_reason"] = fail_reason
+        else:
+            if self.session_token is None:
+                self.session_token = secrets.token_hex(16)
+            handshake_ack_payload["session_token"] = self.session_token
+            # the client draws its view, the whole board unless the server was given a smaller view size
+            handshake_ack_payload["game_size"] = self.game_server.view_size or self.game_server.game_size
+            handshake_ack_payload["glyphs"] = GLYPHS.glyphs
+            if self.game_server.terrain is not None:
+                # walls never move, they are sent once here and left out of every game state
+                handshake_ack_payload["terrain"] = self.game_server.terrain_message
+            if resuming:
+                # the client missed every state since it dropped, start it again from the latest full one
+                snapshot = self.game_server.game_board.snapshot
+                handshake_ack_payload["keyframe"] = self.game_server.client_message(self, snapshot)
+            if self.game_server.compression and COMPRESSION_METHOD in client_payload.get("compression", []):
+                handshake_ack_payload["compression"] = COMPRESSION_METHOD
+            if self.game_server.udp_socket is not None and client_payload.get("udp"):
+                # the client proves which UDP address is theirs by echoing this token in a udp_hello datagram
+                self.udp_token = secrets.token_hex(8)
+                self.game_server.udp_tokens[self.udp_token] = self
+                handshake_ack_payload["udp_token"] = self.udp_token
+
+        try:
+            self.client_socket.send_json(handshake_ack_payload)
+        except OSError:
+            if handshake_ack_payload["success"]:
+                if resuming:
+                    self.game_server.park_client(self)
+                else:
+                    self.game_server.release_seat(self)
+            raise
+        if "compression" in handshake_ack_payload:
+            self.client_socket.enable_compression()
+        # reads only happen once select says a frame is coming, the timeout is there for the writes
+        self.client_socket.settimeout(CLIENT_SEND_TIMEOUT)
+        # only now, so no game state or game start can reach the client before the ack
+        if resuming and handshake_ack_payload["success"]:
+            self.game_server.resume_client(self)
+        elif handshake_ack_payload["success"]:
+            self.game_server.queue_client(self)
+
+        return handshake_ack_payload["success"]
 
-        if handshake_ack_payload["success"]:
-            handshake_ack_payload["game_size"] = self.game_server.game_size
 
-        self.client_socket.send_json(handshake_ack_payload)
+class GlyphTable:
+    """
+    Interns every (character, color) pair a projectile or powerup can be drawn with.
+    The table is sent to clients in the handshake ack, game states then carry (row, col, glyph id) instead of
+    repeating the character and color of every entity on every tick.
+    """
+
+    def __init__(self):
+        self.glyphs = []
+        self.glyph_ids = {}
+
+    def intern(self, character, color=0):
+        glyph = (character, color)
+        if glyph not in self.glyph_ids:
+            self.glyph_ids[glyph] = len(self.glyphs)
+            self.glyphs.append(glyph)
+        return self.glyph_ids[glyph]
 
-        return handshake_ack_payload["success"]
+
+GLYPHS = GlyphTable()
 
 
 class GameProjectile:
-    interval = GAME_REFRESH_INTERVAL * 2
+    interval = 2  # ticks between shots
 
     def __init__(self, game, player, row, col, direction, ttl=20):
         self.row = row
@@ -92,22 +229,20 @@ class GameProjectile:
     def advance(self):
         raise NotImplementedError
 
-    def character(self):
+    def glyph(self):
         raise NotImplementedError
 
     def damage(self):
         raise NotImplementedError
 
     def fire(self):
-        self.get_player_object().last_shot_time = time.time()
-        self.game.projectiles.append(self)
-
-    def color(self):
-        return 0
+        self.get_player_object().last_shot_tick = self.game.tick
+        self.game.add_projectile(self)
 
 
 class GameBullet(GameProjectile):
     interval = GameProjectile.interval
+    glyph_id = GLYPHS.intern("·")
 
     def __init__(self, game, player, row, col, direction, ttl=20):
         super().__init__(game, player, row, col, direction, ttl)
@@ -125,8 +260,8 @@ class GameBullet(GameProjectile):
 
         self.ttl -= 1
 
-    def character(self):
-        return "·"
+    def glyph(self):
+        return self.glyph_id
 
     def damage(self):
         return 10
@@ -139,14 +274,15 @@ class GameStaticBullet(GameBullet):
         super().__init__(game, player, row, col, "none", ttl)
 
     def fire(self):
-        self.game.projectiles.append(self)
+        self.game.add_projectile(self)
 
     def advance(self):
         self.ttl -= 1
 
 
 class GameBigBullet(GameProjectile):
-    interval = GameProjectile.interval * 1.1
+    interval = 3
+    glyph_id = GLYPHS.intern("●")
 
     def __init__(self, game, player, row, col, direction, ttl=10):
         super().__init__(game, player, row, col, direction, ttl)
@@ -164,14 +300,21 @@ class GameBigBullet(GameProjectile):
 
         self.ttl -= 1
 
-    def character(self):
-        return "●"
+    def glyph(self):
+        return self.glyph_id
 
     def damage(self):
         return 20
 
 
 class GameSingleLaser(GameProjectile):
+    glyph_ids = {
+        "up": GLYPHS.intern("│", 204),  # pale red
+        "down": GLYPHS.intern("│", 204),
+        "left": GLYPHS.intern("─", 204),
+        "right": GLYPHS.intern("─", 204)
+    }
+
     def __init__(self, game, player, row, col, direction, ttl=1):
         super().__init__(game, player, row, col, direction, ttl)
 
@@ -188,33 +331,22 @@ class GameSingleLaser(GameProjectile):
 
         self.ttl -= 1
 
-    def character(self):
-        match self.direction:
-            case "up":
-                return "│"
-            case "down":
-                return "│"
-            case "left":
-                return "─"
-            case "right":
-                return "─"
+    def glyph(self):
+        return self.glyph_ids[self.direction]
 
     def damage(self):
         return 3
 
-    def color(self):
-        return 204  # pale red
-
 
 class GameLazer(GameProjectile):
-    interval = GameProjectile.interval * 0.5
+    interval = 1
 
     def __init__(self, game, player, row, col, direction, ttl=30):
         super().__init__(game, player, row, col, direction, ttl)
 
     def fire(self):
         # fire 3 single lasers in the direction of fire
-        self.get_player_object().last_shot_time = time.time()
+        self.get_player_object().last_shot_tick = self.game.tick
         for i in range(3):
             projectile = GameSingleLaser(self.game, self.player, self.row, self.col, self.direction, self.ttl)
             projectile.fire()
@@ -230,14 +362,21 @@ class GameLazer(GameProjectile):
 
 
 class GameExplosiveBullet(GameProjectile):
-    interval = GameProjectile.interval * 2
+    interval = 4
+    glyph_ids = {
+        "up": GLYPHS.intern("▵"),
+        "down": GLYPHS.intern("▿"),
+        "left": GLYPHS.intern("◃"),
+        "right": GLYPHS.intern("▹")
+    }
+    exploding_glyph_id = GLYPHS.intern("◌")
 
     def __init__(self, game, player, row, col, direction, ttl=15, explosion_max_radius=4):
         super().__init__(game, player, row, col, direction, ttl)
         self.explosion_max_radius = explosion_max_radius
 
     def create_explosion(self, row, col):
-        if 0 <= row < self.game.rows and 0 <= col < self.game.cols:
+        if self.game.is_passable(row, col):
             projectile = GameStaticBullet(self.game, self.player, row, col, 2)
             projectile.fire()
 
@@ -265,29 +404,22 @@ class GameExplosiveBullet(GameProjectile):
 
         self.ttl -= 1
 
-    def character(self):
+    def glyph(self):
         if self.ttl > self.explosion_max_radius:
-            match self.direction:
-                case "up":
-                    return "▵"
-                case "down":
-                    return "▿"
-                case "left":
-                    return "◃"
-                case "right":
-                    return "▹"
-        else:
-            return "◌"
+            return self.glyph_ids[self.direction]
+        return self.exploding_glyph_id
 
     def damage(self):
         return 15
 
 
 class GameHomingMissile(GameProjectile):
-    interval = GameProjectile.interval * 1.5
+    interval = 3
+    glyph_id = GLYPHS.intern("☼", 136)  # purple
 
     def __init__(self, game, player, row, col, direction, ttl=20, target=None):
-        print("new homing missile")
+        if ENABLE_DEBUG_LOG:
+            print("new homing missile")
         super().__init__(game, player, row, col, direction, ttl)
         self.move_ticker = False
         if target is None:
@@ -296,16 +428,19 @@ class GameHomingMissile(GameProjectile):
             self.target = target
 
     def acquire_target(self):
-        print("acquiring target")
+        if ENABLE_DEBUG_LOG:
+            print("acquiring target")
         min_distance = float("inf")
         self.target = None
         for player_name, player in self.game.players.items():
-            print(f"checking player {player_name} eq {self.player}")
+            if ENABLE_DEBUG_LOG:
+                print(f"checking player {player_name} eq {self.player}")
             if player_name == self.player:
                 continue
             distance = abs(player.row - self.row) + abs(player.col - self.col)
             if distance < min_distance:
-                print(f"new target {player_name}")
+                if ENABLE_DEBUG_LOG:
+                    print(f"new target {player_name}")
                 min_distance = distance
                 self.target = player
 
@@ -344,16 +479,12 @@ class GameHomingMissile(GameProjectile):
 
         self.ttl -= 1
 
-    def character(self):
-        # purple bullet
-        return "☼"
+    def glyph(self):
+        return self.glyph_id
 
     def damage(self):
         return 5
 
-    def color(self):
-        return 136  # purple
-
 
 class StatusEffect:
     def __init__(self, player, ttl):
@@ -389,7 +520,7 @@ class SpeedBoostStatusEffect(StatusEffect):
 
     def end(self):
         print(f"Speed boost ended for {self.player}")
-        self.player.step_size /= 2
+        self.player.step_size //= 2
 
 
 class GamePlayer:
@@ -400,10 +531,11 @@ class GamePlayer:
         self.projectile_type = projectile_type
         self.health = 100
         self.step_size = 1
-        self.last_move_time = time.time()
-        self.last_shot_time = time.time()
+        self.last_move_tick = 0
+        self.last_shot_tick = 0
         self.move_interval = MOVE_INTERVAL
         self.status_effects = set()
+        self.input_queue = deque(maxlen=MAX_QUEUED_INPUTS)
 
     def color(self):
         return 0
@@ -417,6 +549,8 @@ class GamePlayer:
 
 
 class GamePowerup:
+    glyph_id = None
+
     def __init__(self, row, col, ttl):
         self.row = row
         self.col = col
@@ -425,95 +559,333 @@ class GamePowerup:
     def apply(self, player):
         raise NotImplementedError
 
-    def character(self):
-        raise NotImplementedError
-
-    def color(self):
-        return 0
+    def glyph(self):
+        return self.glyph_id
 
 
 class GameHealthPowerup(GamePowerup):
+    glyph_id = GLYPHS.intern("♥", 197)  # red
+
     def apply(self, player):
         player.health += 25
 
-    def character(self):
-        return "♥"
-
-    def color(self):
-        return 197  # red
-
 
 class GameHomingMissilePowerup(GamePowerup):
+    glyph_id = GLYPHS.intern("⌾", 136)  # purple
+
     def apply(self, player):
         player.projectile_type = GameHomingMissile
 
-    def character(self):
-        return "⌾"
-
-    def color(self):
-        return 136  # purple
-
 
 class GameBigBulletPowerup(GamePowerup):
+    glyph_id = GLYPHS.intern("●")
+
     def apply(self, player):
         player.projectile_type = GameBigBullet
 
-    def character(self):
-        return "●"
-
 
 class GameLazerPowerup(GamePowerup):
+    glyph_id = GLYPHS.intern("/", 204)  # pale red
+
     def apply(self, player):
         player.projectile_type = GameLazer
 
-    def character(self):
-        return "/"
-
-    def color(self):
-        return 204  # pale red
-
 
 class GameExplosiveBulletPowerup(GamePowerup):
+    glyph_id = GLYPHS.intern("✢")
+
     def apply(self, player):
         player.projectile_type = GameExplosiveBullet
 
-    def character(self):
-        return "✢"
-
 
 class GameSpeedBoostPowerup(GamePowerup):
+    glyph_id = GLYPHS.intern("⇑", 229)  # yellow
+
     def apply(self, player):
         SpeedBoostStatusEffect(player)
 
-    def character(self):
-        return "⇑"
 
-    def color(self):
-        return 229  # yellow
+PROJECTILE_TYPES = {projectile_type.__name__: projectile_type for projectile_type in
+                    (GameBullet, GameStaticBullet, GameBigBullet, GameSingleLaser, GameLazer, GameExplosiveBullet,
+                     GameHomingMissile)}
+POWERUP_TYPES = {powerup_type.__name__: powerup_type for powerup_type in
+                 (GameHealthPowerup, GameHomingMissilePowerup, GameBigBulletPowerup, GameLazerPowerup,
+                  GameExplosiveBulletPowerup, GameSpeedBoostPowerup)}
+STATUS_EFFECT_TYPES = {effect_type.__name__: effect_type for effect_type in (StatusEffect, SpeedBoostStatusEffect)}
+
+
+def restore_object(object_type, **attributes):
+    # rebuild a saved object without running its constructor, whose side effects already happened before the save
+    restored = object_type.__new__(object_type)
+    restored.__dict__.update(attributes)
+    return restored
+
+
+def valid_inputs(inputs):
+    # the inputs of an input datagram, [input seq, key] pairs, come straight off the network
+    return isinstance(inputs, list) and all(
+        isinstance(pair, list) and len(pair) == 2 and all(type(value) is int for value in pair) for pair in inputs)
+
+
+class GameSnapshot(namedtuple("GameSnapshot", ["tick", "chunks", "players_health", "player_positions", "status",
+                                               "chunk_hashes", "entities_checksum", "health_checksum"])):
+    """
+    The state of the board at the end of a tick, built once and never modified afterwards.
+    GameBoard publishes each tick's snapshot by swapping a single reference, so any thread holding one
+    can read it without locks while the simulation builds the next tick.
+    chunks is a read-only mapping from the key of each active world chunk to the tuple of its entities,
+    (row, col, char, color) tuples for players and (row, col, glyph id) tuples for projectiles and powerups,
+    see GlyphTable. players_health and player_positions are read-only mappings from player name to health
+    and to (row, col). chunk_hashes has the checksum.entity_hash of each entity of chunks, in the same order,
+    entities_checksum and health_checksum are the sums of the entity hashes and of the health hashes.
+    """
+    __slots__ = ()
+
+    def entities(self, view=None, sight=None):
+        """
+        :param view: a (top, left, rows, cols) rectangle to only get the entities inside it,
+                     with positions relative to its top left corner
+        :param sight: a visibility.Sight to only get the entities on the cells a player sees
+        :return: the entity tuples, and the sum of their hashes
+        """
+        if view is None and sight is None:
+            return ([entity for chunk_entities in self.chunks.values() for entity in chunk_entities],
+                    self.entities_checksum)
+        top, left, rows, cols = view if view is not None else (0, 0, None, None)
+        # with fog of war only the chunks around the player are looked at, whatever the size of the view
+        area = sight[:4] if sight is not None else view
+        visible = []
+        checksum = 0
+        for key in chunk_keys_in_view(self.chunks, *area):
+            for entity, entity_hash in zip(self.chunks[key], self.chunk_hashes[key]):
+                if sight is not None and not sight.sees(entity[0], entity[1]):
+                    continue
+                row = entity[0] - top
+                col = entity[1] - left
+                if view is None or (0 <= row < rows and 0 <= col < cols):
+                    visible.append((row, col) + entity[2:])
+                    checksum += entity_hash
+        return visible, checksum & CHECKSUM_MASK
+
+    def to_message(self, view=None, sight=None):
+        entities, entities_checksum = self.entities(view, sight)
+        message = {
+            "type": "game_state",
+            "game_state": entities,
+            "players_health": dict(self.players_health),
+            "status": self.status,
+            "tick": self.tick,
+            # lets the client check that what it draws is what it was sent, see checksum.py
+            "checksum": (entities_checksum + self.health_checksum) & CHECKSUM_MASK
+        }
+        if view is not None:
+            message["view"] = view[:2]
+        return message
+
+
+class PositionHistory:
+    """
+    Player positions at the end of each of the last few ticks, to resolve shots against what a lagging client saw.
+    Recording a tick only keeps a reference to the snapshot's read-only positions mapping.
+    """
+
+    def __init__(self, ticks):
+        self.positions = deque(maxlen=ticks)
+
+    def record(self, tick, player_positions):
+        self.positions.append((tick, player_positions))
+
+    def cells_at(self, tick):
+        """
+        :return: a (row, col) -> player names mapping of the positions at the end of a tick,
+                 None if that tick isn't in the history
+        """
+        if not self.positions:
+            return None
+        # one entry per tick, in order
+        index = tick - self.positions[0][0]
+        if not 0 <= index < len(self.positions):
+            return None
+        cells = {}
+        for player_name, cell in self.positions[index][1].items():
+            cells.setdefault(cell, []).append(player_name)
+        return cells
 
 
 class GameBoard:
-    def __init__(self, game_server, rows, cols):
+    def __init__(self, game_server, rows, cols, lag_compensation_ticks=LAG_COMPENSATION_TICKS, terrain=None):
         self.game_server = game_server
         self.rows = rows
         self.cols = cols
+        # the walls, see terrain.py, None for an open board
+        self.terrain = terrain
         self.players = {}
-        self.projectiles = []
-        self.powerups = []
+        self.world = ChunkedWorld()
+        # while update() advances the projectiles, the ones fired meanwhile (explosions) are advanced on the same tick
+        self.advancing_projectiles = None
+        # the projectiles a single shot created, a laser fires several
+        self.fired_projectiles = None
+        self.lag_compensation_ticks = lag_compensation_ticks
+        self.position_history = PositionHistory(lag_compensation_ticks)
+        self.bot_controller = BotController(self)
         self.status = "What a game :)"
+        # the StatsRecorder shots, hits, kills and pickups go to, None to not record them, see stats.py
+        self.stats = None
+        # player name -> the player whose projectile hit them last, credited with the kill
+        self.last_hit_by = {}
+        self.seen_entity_types = set()
+        self.tick = 0
+        # the entity hashes of the last snapshot, see get_game_state
+        self.entity_hashes = {}
+        self.snapshot = self.get_game_state()
 
     def add_player(self, player_name, player_character, row, col):
         self.players[player_name] = GamePlayer(player_character, row, col)
+        self.world.add_player(player_name, self.players[player_name])
 
     def remove_player(self, player_name):
         if player_name in self.players:
-            del self.players[player_name]
+            self.world.remove_player(player_name, self.players.pop(player_name))
+        self.last_hit_by.pop(player_name, None)
+
+    def record_event(self, kind, player, target=None, value=None):
+        if self.stats is not None:
+            self.stats.record(self.tick, kind, player, target, value)
+
+    def hit_player(self, player_name, player, projectile):
+        damage = projectile.damage()
+        player.health -= damage
+        self.status = f"{player_name} was hit by a projectile!"
+        self.last_hit_by[player_name] = projectile.player
+        self.record_event("hit", projectile.player, player_name, damage)
+
+    def add_projectile(self, projectile):
+        self.world.add_projectile(projectile)
+        if self.advancing_projectiles is not None:
+            self.advancing_projectiles.append(projectile)
+        if self.fired_projectiles is not None:
+            self.fired_projectiles.append(projectile)
+
+    def fire_projectile(self, projectile, seen_tick=None):
+        self.fired_projectiles = []
+        projectile.fire()
+        fired_projectiles, self.fired_projectiles = self.fired_projectiles, None
+        self.record_event("shot", projectile.player, value=type(projectile).__name__)
+        shooter = self.players[projectile.player]
+        for fired_projectile in fired_projectiles:
+            # a shot fired into a wall, or a laser segment behind one, stops right away
+            if self.path_blocked(shooter.row, shooter.col, fired_projectile.row, fired_projectile.col):
+                self.world.remove_projectile(fired_projectile)
+            elif seen_tick is not None:
+                self.compensate_lag(fired_projectile, seen_tick)
+
+    def compensate_lag(self, projectile, seen_tick):
+        """
+        Advance a projectile fired by a lagging client through the ticks between the one they saw and this one,
+        hitting players where they were at the end of each of those ticks. The regular update does the current one.
+        :param projectile: the projectile, just fired
+        :param seen_tick: the tick of the game state the shooter was looking at
+        """
+        for tick in range(seen_tick + 1, self.tick):
+            cells = self.position_history.cells_at(tick)
+            if cells is None:
+                continue
+            old_row, old_col = projectile.row, projectile.col
+            projectile.advance()
+            if (projectile.ttl <= 0 or not self.in_bounds(projectile.row, projectile.col) or
+                    self.path_blocked(old_row, old_col, projectile.row, projectile.col)):
+                self.world.remove_projectile(projectile, old_row, old_col)
+                return
+            self.world.move_projectile(projectile, old_row, old_col)
+            hit_players = [player_name for player_name in cells.get((projectile.row, projectile.col), ())
+                           if player_name in self.players]
+            for player_name in hit_players:
+                self.hit_player(player_name, self.players[player_name], projectile)
+                LAG_COMPENSATED_HITS.inc()
+            if hit_players:
+                self.world.remove_projectile(projectile)
+                return
+
+    def in_bounds(self, row, col):
+        return 0 <= row < self.rows and 0 <= col < self.cols
+
+    def is_passable(self, row, col):
+        return self.in_bounds(row, col) and (self.terrain is None or not self.terrain.is_wall(row, col))
+
+    def passable_area(self, top, left, rows, cols):
+        """
+        :return: whether each cell of an in-bounds rectangle can be walked on, as a flat row-major list
+        """
+        if self.terrain is None:
+            return [True] * (rows * cols)
+        return self.terrain.open_area(top, left, rows, cols)
+
+    def raycast(self, row, col, row_step, col_step, steps):
+        """
+        Walk from a cell in a straight line, cell by cell, until a wall or the edge of the board is in the way.
+        :param row_step: -1, 0 or 1
+        :param col_step: -1, 0 or 1
+        :param steps: how many cells to walk at most
+        :return: the last cell reached
+        """
+        for _ in range(steps):
+            if not self.is_passable(row + row_step, col + col_step):
+                break
+            row += row_step
+            col += col_step
+        return row, col
+
+    def path_blocked(self, from_row, from_col, to_row, to_col):
+        """
+        :return: whether a wall is on the way between two cells, the first one excluded,
+                 so a projectile moving several cells in a tick can't jump over a wall
+        """
+        if self.terrain is None:
+            return False
+        row_step = (to_row > from_row) - (to_row < from_row)
+        col_step = (to_col > from_col) - (to_col < from_col)
+        row, col = from_row, from_col
+        while (row, col) != (to_row, to_col):
+            if row != to_row:
+                row += row_step
+            if col != to_col:
+                col += col_step
+            if self.in_bounds(row, col) and self.terrain.is_wall(row, col):
+                return True
+        return False
+
+    def random_open_cell(self):
+        """
+        :return: a random cell that isn't a wall, to spawn players and powerups on
+        """
+        while True:
+            row = random.randint(0, self.rows - 1)
+            col = random.randint(0, self.cols - 1)
+            if self.is_passable(row, col):
+                return row, col
+
+    def step_player(self, player, player_obj, row_step, col_step, direction):
+        cur_tick = self.tick
+        if cur_tick - player_obj.last_move_tick < player_obj.move_interval:
+            return
+        # a boosted player moves several cells at once, and stops at the first wall on the way
+        row, col = self.raycast(player_obj.row, player_obj.col, row_step, col_step, player_obj.step_size)
+        if (row, col) != (player_obj.row, player_obj.col):
+            player_obj.row, player_obj.col = row, col
+            player_obj.last_move_tick = cur_tick
+            if ENABLE_DEBUG_LOG:
+                print(f"{player} moved {direction} ({player_obj.row}, {player_obj.col})")
 
     def update(self):
+        self.tick += 1
+        if self.bot_controller.bots:
+            with PROFILER.phase("bots"):
+                self.bot_controller.decide()
+        self.apply_queued_actions()
+
         # give a small chance for a powerup to spawn
         if random.random() < POWERUP_SPAWN_CHANCE:
-            row = random.randint(0, self.rows - 1)
-            col = random.randint(0, self.cols - 1)
+            row, col = self.random_open_cell()
             powerup_ttl = random.randint(100, 200)
             powerup = random.choice([GameHealthPowerup,
                                      GameHomingMissilePowerup,
@@ -521,43 +893,41 @@ class GameBoard:
                                      GameLazerPowerup,
                                      GameExplosiveBulletPowerup,
                                      GameSpeedBoostPowerup])(row, col, powerup_ttl)
-            self.powerups.append(powerup)
+            self.world.add_powerup(powerup)
 
-        for projectile in self.projectiles:
+        # only the active chunks are visited, and a collision only looks at the players in the projectile's chunk
+        self.advancing_projectiles = self.world.projectiles()
+        for projectile in self.advancing_projectiles:
+            old_row, old_col = projectile.row, projectile.col
             projectile.advance()
-            if projectile.ttl <= 0:
-                continue
-            if projectile.row < 0 or projectile.row >= self.rows or projectile.col < 0 or projectile.col >= self.cols:
-                self.projectiles.remove(projectile)
+            if (projectile.ttl <= 0 or not self.in_bounds(projectile.row, projectile.col) or
+                    self.path_blocked(old_row, old_col, projectile.row, projectile.col)):
+                self.world.remove_projectile(projectile, old_row, old_col)
                 continue
-            for player_name, player in list(self.players.items()):
-                if player.row == projectile.row and player.col == projectile.col:
-                    player.health -= projectile.damage()
-                    if projectile in self.projectiles:
-                        self.projectiles.remove(projectile)
-                    self.status = f"{player_name} was hit by a projectile!"
-
-        for powerup in self.powerups:
+            self.world.move_projectile(projectile, old_row, old_col)
+            hit_players = self.world.players_at(projectile.row, projectile.col)
+            for player_name, player in hit_players:
+                self.hit_player(player_name, player, projectile)
+            if hit_players:
+                self.world.remove_projectile(projectile)
+        self.advancing_projectiles = None
+
+        for powerup in self.world.powerups():
             powerup.ttl -= 1
             if powerup.ttl <= 0:
+                self.world.remove_powerup(powerup)
                 continue
-            for player_name, player in list(self.players.items()):
-                if player.row == powerup.row and player.col == powerup.col:
-                    powerup.apply(player)
-                    if powerup in self.powerups:
-                        self.powerups.remove(powerup)
-                    self.status = f"{player_name} picked up a powerup!"
-
-        for projectile in self.projectiles:
-            if projectile.ttl <= 0:
-                self.projectiles.remove(projectile)
-
-        for powerup in self.powerups:
-            if powerup.ttl <= 0:
-                self.powerups.remove(powerup)
+            picking_players = self.world.players_at(powerup.row, powerup.col)
+            for player_name, player in picking_players:
+                powerup.apply(player)
+                self.status = f"{player_name} picked up a powerup!"
+                self.record_event("pickup", player_name, value=type(powerup).__name__)
+            if picking_players:
+                self.world.remove_powerup(powerup)
 
         for player_name, player in list(self.players.items()):
             if player.health <= 0:
+                self.record_event("kill", self.last_hit_by.get(player_name), player_name)
                 self.remove_player(player_name)
                 self.status = f"{player_name} died!!!!"
 
@@ -566,93 +936,266 @@ class GameBoard:
         if len(self.players) == 1:
             self.status = f"{list(self.players.keys())[0]} is the winner!"
 
+        self.record_metrics()
+
+    def record_metrics(self):
+        entity_counts = {"GamePlayer": len(self.players)}
+        for entity in self.world.projectiles() + self.world.powerups():
+            entity_type = type(entity).__name__
+            entity_counts[entity_type] = entity_counts.get(entity_type, 0) + 1
+        for entity_type in self.seen_entity_types - entity_counts.keys():
+            entity_counts[entity_type] = 0
+        self.seen_entity_types.update(entity_counts)
+        for entity_type, count in entity_counts.items():
+            ENTITIES.set(count, (entity_type,))
+        ACTIVE_CHUNKS.set(len(self.world.chunks))
+
     def get_game_state(self):
-        game_state = []
+        chunks = {}
+        chunk_hashes = {}
+        entities_checksum = 0
+        # entity -> its hash, only the entities that moved or changed since the last tick are hashed again
+        previous_hashes = self.entity_hashes
+        entity_hashes = {}
+        for key, chunk in self.world.chunks.items():
+            entities = [(player.row, player.col, player.character, player.color())
+                        for player in chunk.players.values()]
+            entities.extend((projectile.row, projectile.col, projectile.glyph()) for projectile in chunk.projectiles)
+            entities.extend((powerup.row, powerup.col, powerup.glyph_id) for powerup in chunk.powerups)
+            chunks[key] = entities = tuple(entities)
+            hashes = []
+            for entity in entities:
+                hash_ = entity_hashes.get(entity)
+                if hash_ is None:
+                    hash_ = previous_hashes.get(entity)
+                    if hash_ is None:
+                        hash_ = entity_hash(entity)
+                    entity_hashes[entity] = hash_
+                hashes.append(hash_)
+            chunk_hashes[key] = hashes = tuple(hashes)
+            entities_checksum += sum(hashes)
+        self.entity_hashes = entity_hashes
         players_health = {}
+        player_positions = {}
         for player_name, player in self.players.items():
-            game_state.append((int(player.row), int(player.col), player.character, player.color()))
             players_health[player_name] = player.health
-        for projectile in self.projectiles:
-            projectile_character = projectile.character()
-            if isinstance(projectile_character, str):
-                game_state.append((int(projectile.row), int(projectile.col), projectile_character, projectile.color()))
-            else:  # it's a list
-                game_state.append(projectile_character)
-        for powerup in self.powerups:
-            game_state.append((int(powerup.row), int(powerup.col), powerup.character(), powerup.color()))
-        return game_state, players_health, self.status
-
-    def player_action(self, player, action):
-        cur_time = time.time()
+            player_positions[player_name] = (player.row, player.col)
+        return GameSnapshot(self.tick, MappingProxyType(chunks), MappingProxyType(players_health),
+                            MappingProxyType(player_positions), self.status, MappingProxyType(chunk_hashes),
+                            entities_checksum & CHECKSUM_MASK, players_health_checksum(players_health))
+
+    def capture_state(self):
+        """
+        Copy everything needed to resume the match into plain tuples, see persistence.py.
+        Runs on the tick, the serialization and the write happen on the snapshot writer's thread.
+        :return: the captured state
+        """
+        player_names = {id(player): player_name for player_name, player in self.players.items()}
+        players = tuple((player_name, player.character, player.row, player.col, player.health, player.step_size,
+                         player.projectile_type.__name__, player.last_move_tick, player.last_shot_tick,
+                         tuple((type(effect).__name__, effect.ttl) for effect in player.status_effects))
+                        for player_name, player in self.players.items())
+        projectiles = tuple((type(projectile).__name__, projectile.player, projectile.row, projectile.col,
+                             projectile.direction, projectile.ttl, getattr(projectile, "explosion_max_radius", None),
+                             getattr(projectile, "move_ticker", None),
+                             player_names.get(id(getattr(projectile, "target", None))))
+                            for projectile in self.world.projectiles())
+        powerups = tuple((type(powerup).__name__, powerup.row, powerup.col, powerup.ttl)
+                         for powerup in self.world.powerups())
+        return self.tick, self.rows, self.cols, self.status, random.getstate(), players, projectiles, powerups
+
+    def restore_state(self, state):
+        """
+        Replace the board with a state returned by capture_state.
+        :param state: the captured state
+        """
+        self.tick, self.rows, self.cols, self.status, random_state, players, projectiles, powerups = state
+        random.setstate(random_state)
+        self.players = {}
+        self.world = ChunkedWorld()
+        for (player_name, character, row, col, health, step_size, projectile_type, last_move_tick, last_shot_tick,
+             status_effects) in players:
+            player = GamePlayer(character, row, col, PROJECTILE_TYPES[projectile_type])
+            player.health = health
+            player.step_size = step_size
+            player.last_move_tick = last_move_tick
+            player.last_shot_tick = last_shot_tick
+            for effect_type, ttl in status_effects:
+                player.status_effects.add(restore_object(STATUS_EFFECT_TYPES[effect_type], player=player, ttl=ttl))
+            self.players[player_name] = player
+            self.world.add_player(player_name, player)
+        for (projectile_type, player, row, col, direction, ttl, explosion_max_radius, move_ticker,
+             target) in projectiles:
+            projectile = restore_object(PROJECTILE_TYPES[projectile_type], game=self, player=player, row=row, col=col,
+                                        direction=direction, ttl=ttl)
+            if explosion_max_radius is not None:
+                projectile.explosion_max_radius = explosion_max_radius
+            if move_ticker is not None:
+                projectile.move_ticker = move_ticker
+                projectile.target = self.players.get(target)
+            self.world.add_projectile(projectile)
+        for powerup_type, row, col, ttl in powerups:
+            self.world.add_powerup(restore_object(POWERUP_TYPES[powerup_type], row=row, col=col, ttl=ttl))
+        self.snapshot = self.get_game_state()
+
+    def publish_snapshot(self):
+        """
+        Build the snapshot of the tick that just ended and make it the current one.
+        :return: the new snapshot
+        """
+        snapshot = self.get_game_state()
+        self.snapshot = snapshot
+        self.position_history.record(snapshot.tick, snapshot.player_positions)
+        return snapshot
+
+    def seen_tick(self, reported_tick=None, rtt=None):
+        """
+        Work out which tick a client was looking at when it sent an input, for lag compensation.
+        :param reported_tick: the tick of the last game state the client drew, as it reported it
+        :param rtt: the client's smoothed round trip, used when it didn't report a tick
+        :return: the tick, or None when there is nothing to compensate
+        """
+        if isinstance(reported_tick, int):
+            seen_tick = reported_tick
+        elif rtt is not None:
+            # the state the client reacted to left the server about a round trip before its input arrives
+            seen_tick = self.tick - round(rtt / GAME_REFRESH_INTERVAL)
+        else:
+            return None
+        # a client never gets to rewind further than the history, nor to shoot from the future
+        seen_tick = max(seen_tick, self.tick - self.lag_compensation_ticks)
+        if seen_tick >= self.tick:
+            return None
+        return seen_tick
+
+    def queue_action(self, player, action, seen_tick=None):
+        """
+        Queue an input to be applied at the start of the next tick.
+        :param player: the player name
+        :param action: one of the keys constants
+        :param seen_tick: the tick the player was looking at, see seen_tick, shots are resolved from there
+        """
+        player_obj = self.players.get(player)
+        if player_obj is not None:
+            player_obj.input_queue.append((action, seen_tick))
+
+    def apply_queued_actions(self):
+        # inputs are applied in one batch, in player order, so the outcome doesn't depend on socket readiness
+        for player, player_obj in list(self.players.items()):
+            input_queue = player_obj.input_queue
+            while input_queue:
+                self.player_action(player, *input_queue.popleft())
+
+    def player_action(self, player, action, seen_tick=None):
+        cur_tick = self.tick
         player_obj = self.players[player]
-        can_move = cur_time - player_obj.last_move_time >= player_obj.move_interval
-        can_shoot = cur_time - player_obj.last_shot_time >= player_obj.projectile_type.interval
+        old_row, old_col = player_obj.row, player_obj.col
+        can_shoot = cur_tick - player_obj.last_shot_tick >= player_obj.projectile_type.interval
         match action:
             case keys.MOVE_UP:
-                if player_obj.row > 0 and can_move:
-                    player_obj.row -= player_obj.step_size
-                    if player_obj.row < 0:
-                        player_obj.row = 0
-                    player_obj.last_move_time = cur_time
-                    print(f"{player} moved up ({player_obj.row}, {player_obj.col})")
+                self.step_player(player, player_obj, -1, 0, "up")
 
             case keys.MOVE_DOWN:
-                if player_obj.row < self.rows - 1 and can_move:
-                    player_obj.row += player_obj.step_size
-                    if player_obj.row >= self.rows:
-                        player_obj.row = self.rows - 1
-                    player_obj.last_move_time = cur_time
-                    print(f"{player} moved down ({player_obj.row}, {player_obj.col})")
+                self.step_player(player, player_obj, 1, 0, "down")
 
             case keys.MOVE_LEFT:
-                if player_obj.col > 0 and can_move:
-                    player_obj.col -= player_obj.step_size
-                    if player_obj.col < 0:
-                        player_obj.col = 0
-                    player_obj.last_move_time = cur_time
-                    print(f"{player} moved left ({player_obj.row}, {player_obj.col})")
+                self.step_player(player, player_obj, 0, -1, "left")
 
             case keys.MOVE_RIGHT:
-                if player_obj.col < self.cols - 1 and can_move:
-                    player_obj.col += player_obj.step_size
-                    if player_obj.col >= self.cols:
-                        player_obj.col = self.cols - 1
-                    player_obj.last_move_time = cur_time
-                    print(f"{player} moved right ({player_obj.row}, {player_obj.col})")
+                self.step_player(player, player_obj, 0, 1, "right")
 
             case keys.SHOOT_UP if can_shoot:
                 projectile = player_obj.projectile_type(self, player, player_obj.row - 1, player_obj.col, "up")
-                projectile.fire()
+                self.fire_projectile(projectile, seen_tick)
 
             case keys.SHOOT_DOWN if can_shoot:
                 projectile = player_obj.projectile_type(self, player, player_obj.row + 1, player_obj.col, "down")
-                projectile.fire()
+                self.fire_projectile(projectile, seen_tick)
 
             case keys.SHOOT_LEFT if can_shoot:
                 projectile = player_obj.projectile_type(self, player, player_obj.row, player_obj.col - 1, "left")
-                projectile.fire()
+                self.fire_projectile(projectile, seen_tick)
 
             case keys.SHOOT_RIGHT if can_shoot:
                 projectile = player_obj.projectile_type(self, player, player_obj.row, player_obj.col + 1, "right")
-                projectile.fire()
+                self.fire_projectile(projectile, seen_tick)
+
+        if (player_obj.row, player_obj.col) != (old_row, old_col):
+            self.world.move_player(player, player_obj, old_row, old_col)
 
 
 class GameServer:
 
-    def __init__(self, ip, port, max_players, game_size):
-        self.game_started = False
-        self.clients_lock = None
-        self.client_threads = None
+    def __init__(self, ip, port, max_players, game_size, metrics_port=None, metrics_ip="127.0.0.1",
+                 compression=True, udp=False, udp_loss=0.0, broadcast_workers=DEFAULT_BROADCAST_WORKERS,
+                 snapshot_path=None, snapshot_interval=SNAPSHOT_INTERVAL, restore_path=None,
+                 reconnect_grace=RECONNECT_GRACE_PERIOD, view_size=None,
+                 lag_compensation_ticks=LAG_COMPENSATION_TICKS, bots=0, terrain=None, fog_radius=None,
+                 lobby_timeout=LOBBY_TIMEOUT, matches=0, stats_db=None):
+        self.accepting = True
+        self.clients_lock = threading.Lock()
+        self.client_threads = {}
+        self.client_names = set()
+        self.client_characters = set()
+        # session token -> (client handler, deadline) of the players waiting for their client to reconnect
+        self.disconnected_clients = {}
+        self.reconnect_grace = reconnect_grace
+        self.bots = bots
+        self.last_ping_time = 0
+        self.last_tick_duration = 0
+        self.terrain = terrain
+        self.terrain_message = None
+        if terrain is not None:
+            # the map decides the size of the board
+            game_size = [terrain.rows, terrain.cols]
+            self.terrain_message = terrain.to_message()
         print(f"Starting server on {ip}:{port}, max players: {max_players}, game size: {game_size}")
         self.server_socket = None
-        self.clients = None
+        # the clients playing the current match
+        self.clients = {}
+        # the same clients by connection, requests act for the player on the connection they came in on, never for the
+        # name a client puts in its tids
+        self.peer_clients = {}
+        self.lobby = Lobby(max_players, lobby_timeout)
+        # how many matches to play before exiting, 0 to keep going
+        self.matches = matches
+        self.matches_played = 0
+        # match events are written to this SQLite database, see stats.py
+        self.stats = StatsRecorder(stats_db) if stats_db is not None else None
         self.clients_acceptor = None
         self.ip = ip
         self.port = port
         self.max_players = max_players
         self.game_size = game_size
+        self.compression = compression
+        self.udp = udp
+        self.udp_loss = udp_loss
+        self.udp_socket = None
+        self.udp_tokens = {}
+        self.udp_clients = {}
         self.transactions = {}
-        self.game_board = GameBoard(self, *game_size)
+        self.lag_compensation_ticks = lag_compensation_ticks
+        # a board is made for each match, the first one may be resumed from a snapshot
+        self.game_board = GameBoard(self, *game_size, lag_compensation_ticks, terrain)
+        self.broadcast_workers = broadcast_workers
+        self.broadcaster = None
+        # players only see what their player has a line of sight to within this many cells, None to see everything
+        self.fog_radius = fog_radius
+        self.visibility = None
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_writer = None
+        # players of a restored match that haven't reconnected yet
+        self.restored_players = set()
+        if restore_path is not None:
+            self.restore_match(restore_path)
+        # clients only get the part of the board around their player when it doesn't fit in their view
+        self.view_size = None
+        if view_size is not None and (view_size[0] < self.game_size[0] or view_size[1] < self.game_size[1]):
+            self.view_size = [min(view_size[0], self.game_size[0]), min(view_size[1], self.game_size[1])]
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = start_metrics_server(metrics_ip, metrics_port)
 
     def run(self):
         print("Creating server socket")
@@ -661,111 +1204,508 @@ class GameServer:
         print("Binding server socket")
         self.server_socket.bind((self.ip, self.port))
         print("Listening for connections")
-        self.server_socket.listen(self.max_players)
-        self.clients = {}
-        self.client_threads = {}
+        # handshakes run in parallel, keep enough backlog for a whole lobby connecting at once
+        self.server_socket.listen(max(self.max_players, socket.SOMAXCONN))
+        if self.udp:
+            print("Binding UDP socket for game states and inputs")
+            self.udp_socket = JSONDatagramSocket.create_socket(self.udp_loss, known_peers_only=True)
+            self.udp_socket.bind((self.ip, self.port))
         self.clients_acceptor = threading.Thread(target=GameServer.accept_clients, args=(self,))
         self.clients_acceptor.start()
-        self.clients_lock = threading.Lock()
-        print("clients acceptor started, press enter to start game loop")
-
-        while not self.game_started:
-            # wait for input, or just wait for the clients_acceptor to finish
-            starter_selector = selectors.DefaultSelector()
-            starter_selector.register(0, selectors.EVENT_READ)
-            events = starter_selector.select(timeout=1)
-
-            for key, mask in events:
-                input()
-                self.game_started = True
-
-        print("Starting...")
+        print(f"Lobby open, a match starts with {self.max_players} players, or {self.lobby.timeout} seconds after "
+              f"the first one joins")
+
+        while self.matches == 0 or self.matches_played < self.matches:
+            self.start_match(self.wait_for_match())
+            self.run_match()
+            self.matches_played += 1
+            MATCHES_PLAYED.inc()
+        self.accepting = False
         self.clients_acceptor.join()
-        for client in self.clients.values():
-            client.client_socket.send_json({
-                "type": "game_start"
-            })
+        self.lobby.close()
+        if self.stats is not None:
+            self.stats.close()
+
+    def wait_for_match(self):
+        """
+        Sleep until the lobby can start a match, handshake threads wake the loop up when a client joins.
+        :return: the clients of the match
+        """
+        lobby_selector = selectors.DefaultSelector()
+        lobby_selector.register(self.lobby.wakeup_reader, selectors.EVENT_READ, self.lobby)
+        if self.udp_socket is not None:
+            # waiting clients already say hello over UDP
+            lobby_selector.register(self.udp_socket, selectors.EVENT_READ, None)
+        try:
+            while True:
+                current_time = time.time()
+                with self.clients_lock:
+                    starting_clients = self.lobby.next_match(current_time, self.bots)
+                    timeout = self.lobby.wait_timeout(current_time)
+                if starting_clients is not None:
+                    return starting_clients
+                for key, mask in lobby_selector.select(timeout):
+                    if key.data is None:
+                        self.handle_datagrams()
+                    else:
+                        self.lobby.drain_wakeups()
+        finally:
+            lobby_selector.close()
+
+    def start_match(self, starting_clients):
+        player_names = ", ".join(client.client_name for client in starting_clients)
+        print(f"Starting match {self.matches_played + 1} with {player_names}")
+        with self.clients_lock:
+            if self.matches_played > 0:
+                self.game_board = GameBoard(self, *self.game_size, self.lag_compensation_ticks, self.terrain)
+            for player_name in self.restored_players:
+                print(f"{player_name} didn't come back to the restored match")
+                self.client_names.discard(player_name.lower())
+                self.client_characters.discard(self.game_board.players[player_name].character)
+                self.game_board.remove_player(player_name)
+            self.restored_players.clear()
+            for client in starting_clients:
+                if client.client_name not in self.game_board.players:
+                    self.game_board.add_player(client.client_name, client.client_character,
+                                               *self.game_board.random_open_cell())
+                self.clients[client.client_name] = client
+                self.peer_clients[client.client_socket] = client
+                client.client_socket.metrics_label = client.client_name
+            CONNECTED_CLIENTS.set(len(self.clients))
+            self.add_bots()
+            self.game_board.stats = self.stats
+            if self.stats is not None:
+                self.stats.start_match()
+        self.broadcaster = GameStateBroadcaster(self.send_game_state, self.broadcast_workers)
+        if self.fog_radius is not None:
+            self.visibility = VisibilityCache(self.game_board)
+        if self.snapshot_path is not None:
+            self.snapshot_writer = MatchSnapshotWriter(self.snapshot_path)
+        for client in starting_clients:
+            try:
+                client.client_socket.send_json({
+                    "type": "game_start"
+                })
+            except OSError as e:
+                print(f"Error starting the match for {client.client_name}: {e}")
+                self.disconnect_client(client)
+
+    def run_match(self):
         selector_timeout = 0.01
         last_update_time = time.time()
 
         while True:
             clients_selector = selectors.DefaultSelector()
-            cur_clients = self.clients
+            # dropped clients reconnect from handshake threads, iterate over a copy
+            with self.clients_lock:
+                cur_clients = dict(self.clients)
 
             for client in cur_clients.values():
                 clients_selector.register(client.client_socket, selectors.EVENT_READ, client)
+            if self.udp_socket is not None:
+                clients_selector.register(self.udp_socket, selectors.EVENT_READ, None)
 
             events = clients_selector.select(timeout=selector_timeout)
             current_time = time.time()
 
-            for key, mask in events:
-                client = key.data
-                try:
-                    data = client.client_socket.recv_json()
-                except Exception as e:
-                    error_type = type(e).__name__
-                    print(
-                        f"Something went wrong with {client.client_name}@{client.client_address[0]}:{client.client_address[1]}: {error_type}: {e}")
-                    print(f"Closing connection with {client.client_name}")
-                    client.client_socket.close()
-                    if client.client_name in cur_clients:
-                        del cur_clients[client.client_name]
-                    self.game_board.players[client.client_name].health = 0
-                    self.game_board.status = f"{client.client_name} disconnected"
-                    with self.clients_lock:
-                        if client.client_name in self.clients:
-                            del self.clients[client.client_name]
-                    continue
-                # print(f"Received data from {client.client_name}: {data}")
-                tid = tuple(data["tid"])
-                if tid in self.transactions:
-                    # print(f"Continuing transaction {tid}")
-                    transaction = self.transactions[tid]
-                    transaction.handle(data)
-                else:
-                    # print(f"New transaction {tid}")
+            with PROFILER.phase("input"):
+                for key, mask in events:
+                    client = key.data
+                    if client is None:
+                        self.handle_datagrams()
+                        continue
+                    try:
+                        # a client that sends part of a frame and goes quiet must not freeze the match
+                        deadline = time.monotonic() + CLIENT_FRAME_TIMEOUT
+                        if not self.allow_input(client, current_time):
+                            # dropped without being parsed, a flood costs a read and no more
+                            if client.flood_count < FLOOD_LIMIT and not client.client_socket.skip_json(deadline):
+                                self.disconnect_client(client)
+                            continue
+                        data = client.client_socket.recv_json(deadline)
+                    except FrameTooLarge as e:
+                        self.kick_client(client, "frame_too_large", e)
+                        continue
+                    except Exception as e:
+                        error_type = type(e).__name__
+                        print(
+                            f"Something went wrong with {client.client_name}@{client.client_address[0]}:{client.client_address[1]}: {error_type}: {e}")
+                        self.disconnect_client(client)
+                        continue
+                    if data is None:
+                        # the connection closed mid-frame, the client may still come back
+                        self.disconnect_client(client)
+                        continue
                     try:
-                        transaction = Transaction(self, tid[1], client.client_socket, date_type_handlers[data["type"]],
-                                                  tid=tid[0])
-                        self.transactions[tid] = transaction
-                        transaction.handle(data)
-                    except KeyError:
-                        print(f"Unknown message type: {data['type']}")
-                        response = {
-                            "tid": data["tid"],
-                            "type": "unknown_message"
-                        }
-                        client.client_socket.send_json(response)
+                        self.handle_message(client, data)
+                    except OSError as e:
+                        print(f"Error answering {client.client_name}: {type(e).__name__}: {e}")
+                        self.disconnect_client(client)
+                    except (KeyError, TypeError, ValueError, IndexError) as e:
+                        self.kick_client(client, "malformed_message", f"{type(e).__name__}: {e}")
 
             if current_time - last_update_time >= GAME_REFRESH_INTERVAL:
-                self.game_board.update()
-                game_state = self.game_board.get_game_state()
-                for client_name, client in list(cur_clients.items()):
-                    transaction = Transaction(self, "self", client.client_socket, send_game_state)
-                    self.transactions[(transaction.transaction_id, "self")] = transaction
-                    try:
-                        transaction.handle(game_state)
-                    except Exception as e:
-                        print(f"Error sending game state to {client_name}: {e}")
-                        print(f"Closing connection with {client_name}")
-                        self.game_board.status = f"{client_name} disconnected"
-                        client.client_socket.close()
-                        if client_name in cur_clients:
-                            del cur_clients[client_name]
-                        self.game_board.players[client.client_name].health = 0
-                        with self.clients_lock:
-                            if client_name in self.clients:
-                                del self.clients[client_name]
+                tick_start_time = time.perf_counter()
+                self.expire_sessions(current_time)
+                if current_time - self.last_ping_time >= PING_INTERVAL:
+                    self.ping_clients(cur_clients.values())
+                    self.last_ping_time = current_time
+                with PROFILER.phase("update"):
+                    self.game_board.update()
+                with PROFILER.phase("get_game_state"):
+                    game_state = self.game_board.publish_snapshot()
+                if self.snapshot_writer is not None and self.game_board.tick % self.snapshot_interval == 0:
+                    with PROFILER.phase("capture_state"):
+                        self.snapshot_writer.submit(self.game_board.capture_state())
+                with PROFILER.phase("broadcast"):
+                    for client, e in self.broadcaster.failed_clients():
+                        print(f"Error sending game state to {client.client_name}: {e}")
+                        self.disconnect_client(client)
+                    self.broadcaster.publish(game_state, list(cur_clients.values()))
                 last_update_time = current_time
 
-                if END_GAME_ON_SINGLE_PLAYER and len(self.game_board.players) == 1:
-                    winner = list(self.game_board.players.keys())[0]
-                    print(f"Game over, winner: {winner}")
-                    for client in cur_clients.values():
-                        transaction = Transaction(self, "self", client.client_socket, endgame_handler)
-                        transaction.handle(winner)
+                tick_duration = time.perf_counter() - tick_start_time
+                self.last_tick_duration = tick_duration
+                TICK_DURATION.observe(tick_duration)
+                if tick_duration > GAME_REFRESH_INTERVAL:
+                    TICK_OVERRUNS.inc()
+                TRANSACTIONS.set(len(self.transactions))
+                CONNECTED_CLIENTS.set(len(self.clients))
+
+                # the last players can die on the same tick, or all run out of time to reconnect, nobody wins then
+                if END_GAME_ON_SINGLE_PLAYER and len(self.game_board.players) <= 1:
+                    winner = next(iter(self.game_board.players), None)
+                    print(f"Game over, winner: {winner}" if winner is not None else "Game over, nobody is left")
+                    self.end_match(winner, cur_clients.values())
                     break
 
+    def handle_message(self, client, data):
+        tid = tuple(data["tid"])
+        if tid in self.transactions:
+            self.transactions[tid].handle(data)
+            return
+        handler = date_type_handlers.get(data["type"])
+        if handler is None:
+            client.client_socket.send_json({
+                "tid": data["tid"],
+                "type": "unknown_message"
+            })
+            return
+        transaction = Transaction(self, tid[1], client.client_socket, handler, tid=tid[0])
+        # a request answered with a single reply is done once the reply is out, it never goes in the table
+        if data["type"] not in SINGLE_REPLY_TYPES:
+            self.transactions[tid] = transaction
+        transaction.handle(data)
+
+    def allow_input(self, client, current_time):
+        """
+        Take a message from a client's rate limit, and disconnect them if they keep going over it.
+        :return: True if the message can be handled
+        """
+        if client.input_bucket.take(current_time):
+            client.flood_count = 0
+            return True
+        RATE_LIMITED_MESSAGES.inc(1, (client.client_name,))
+        client.flood_count += 1
+        if client.flood_count >= FLOOD_LIMIT:
+            self.kick_client(client, "flooding", f"{client.flood_count} messages in a row over the rate limit")
+        return False
+
+    def kick_client(self, client, reason, details):
+        """
+        Disconnect a misbehaving client for good, their player leaves the match.
+        :param reason: a short label for the metrics
+        """
+        if not self.unregister_client(client):
+            return
+        print(f"Kicked {client.client_name}: {details}")
+        KICKED_CLIENTS.inc(1, (reason,))
+        self.forget_connection(client)
+        self.forget_client_metrics(client)
+        self.game_board.remove_player(client.client_name)
+        self.game_board.status = f"{client.client_name} was kicked"
+
+    def end_match(self, winner, clients):
+        if self.stats is not None:
+            self.stats.end_match(winner)
+        # let the workers write the last game states, the endgame message must come after them
+        self.broadcaster.shutdown()
+        if self.snapshot_writer is not None:
+            # the match is over, there is nothing left to recover
+            self.snapshot_writer.close()
+            self.snapshot_writer = None
+            os.remove(self.snapshot_path)
+        for client in clients:
+            transaction = Transaction(self, "self", client.client_socket, endgame_handler)
+            try:
+                transaction.handle(winner)
+            except OSError as e:
+                print(f"Error sending the end of the match to {client.client_name}: {e}")
+        with self.clients_lock:
+            finished_clients = list(self.clients.values()) + [client for client, deadline in
+                                                              self.disconnected_clients.values()]
+            self.clients = {}
+            self.peer_clients = {}
+            self.disconnected_clients.clear()
+            # only the clients waiting for the next match keep their name and character
+            self.client_names = {client.client_name.lower() for client in self.lobby.clients()}
+            self.client_characters = {client.client_character for client in self.lobby.clients()}
+            CONNECTED_CLIENTS.set(0)
+        for client in finished_clients:
+            client.client_socket.close()
+            self.udp_tokens.pop(client.udp_token, None)
+            if client.udp_address is not None:
+                self.udp_clients.pop(client.udp_address, None)
+                self.udp_socket.forget(client.udp_address)
+            self.forget_client_metrics(client)
+        self.transactions.clear()
+
+    def restore_match(self, restore_path):
+        state = load_snapshot(restore_path)
+        if state is None:
+            raise RuntimeError(f"No valid match snapshot in {restore_path}")
+        self.game_board.restore_state(state)
+        if self.terrain is not None and [self.game_board.rows, self.game_board.cols] != self.game_size:
+            raise RuntimeError(f"The match in {restore_path} wasn't played on a map of this size")
+        self.game_size = [self.game_board.rows, self.game_board.cols]
+        # keep the seats of the restored players until they reconnect with the same name
+        for player_name, player in self.game_board.players.items():
+            self.restored_players.add(player_name)
+            self.client_names.add(player_name.lower())
+            self.client_characters.add(player.character)
+        print(f"Restored match at tick {self.game_board.tick} with players: {', '.join(self.restored_players)}")
+
+    def disconnect_client(self, client):
+        # a broken socket can be reported by the game loop and by a broadcast worker, only act on it once
+        if not self.unregister_client(client, keep_seat=True):
+            return
+        print(f"Lost connection with {client.client_name}, holding their player for {self.reconnect_grace} seconds")
+        DROPPED_CLIENTS.inc()
+        self.forget_connection(client)
+        self.park_client(client)
+        self.game_board.status = f"{client.client_name} lost connection"
+
+    def forget_connection(self, client):
+        client.client_socket.close()
+        # clients kicked from the lobby before the first match have no broadcaster to leave
+        if self.broadcaster is not None:
+            self.broadcaster.forget(client)
+        self.udp_tokens.pop(client.udp_token, None)
+        if client.udp_address is not None:
+            self.udp_clients.pop(client.udp_address, None)
+            self.udp_socket.forget(client.udp_address)
+
+    def forget_client_metrics(self, client):
+        for metric in CLIENT_METRICS:
+            metric.remove((client.client_name,))
+
+    def park_client(self, client):
+        """
+        Keep a dropped client's player in the game until they reconnect or the grace period ends.
+        """
+        with self.clients_lock:
+            self.disconnected_clients[client.session_token] = (client, time.time() + self.reconnect_grace)
+
+    def claim_session(self, client, session_token):
+        """
+        Hand the player of a dropped client over to a reconnecting one.
+        :param client: the new client handler
+        :param session_token: the token the dropped client got in its handshake ack
+        :return: the reason the client was rejected, or None if the session is theirs
+        """
+        with self.clients_lock:
+            parked = self.disconnected_clients.pop(session_token, None)
+            if parked is None:
+                return "Unknown or expired session"
+            dropped_client = parked[0]
+        client.client_name = dropped_client.client_name
+        client.client_character = dropped_client.client_character
+        client.session_token = session_token
+        client.last_input_seq = dropped_client.last_input_seq
+        return None
+
+    def resume_client(self, client):
+        with self.clients_lock:
+            self.clients[client.client_name] = client
+            self.peer_clients[client.client_socket] = client
+            client.client_socket.metrics_label = client.client_name
+            CONNECTED_CLIENTS.set(len(self.clients))
+        RESUMED_CLIENTS.inc()
+        print(f"{client.client_name} reconnected")
+
+    def add_bots(self):
+        """
+        Fill the match with bots, on characters nobody took. Called with clients_lock held.
+        """
+        free_characters = (character for character in BOT_CHARACTERS if character not in self.client_characters)
+        for bot_number in range(1, self.bots + 1):
+            bot_name = f"bot{bot_number}"
+            character = next(free_characters, None)
+            if character is None:
+                print(f"Out of characters for bots, only added {bot_number - 1}")
+                return
+            if bot_name.lower() in self.client_names:
+                continue
+            self.client_names.add(bot_name.lower())
+            self.client_characters.add(character)
+            self.game_board.bot_controller.add_bot(bot_name, character, *self.game_board.random_open_cell())
+        print(f"Added {len(self.game_board.bot_controller.bots)} bots")
+
+    def ping_clients(self, clients):
+        for client in clients:
+            # a ping that wasn't answered by now is lost, forget it rather than letting the table grow
+            self.transactions.pop((client.ping_tid, "self"), None)
+            transaction = Transaction(self, "self", client.client_socket, ping_handler)
+            client.ping_tid = transaction.transaction_id
+            self.transactions[(transaction.transaction_id, "self")] = transaction
+            try:
+                transaction.handle()
+            except OSError as e:
+                print(f"Error pinging {client.client_name}: {e}")
+                self.transactions.pop((transaction.transaction_id, "self"), None)
+                self.disconnect_client(client)
+
+    def record_rtt(self, peer, rtt):
+        """
+        Called by ping transactions with the round trip they measured.
+        :param peer: the socket of the client that answered
+        :param rtt: the round trip, in seconds
+        """
+        with self.clients_lock:
+            clients = [client for client in self.clients.values() if client.client_socket is peer]
+        for client in clients:
+            client.latency.add_sample(rtt)
+            labels = (client.client_name,)
+            CLIENT_RTT.observe(rtt, labels)
+            CLIENT_SMOOTHED_RTT.set(client.latency.srtt, labels)
+            CLIENT_JITTER.set(client.latency.jitter, labels)
+
+    def expire_sessions(self, current_time):
+        expired = []
+        with self.clients_lock:
+            for session_token, (client, deadline) in list(self.disconnected_clients.items()):
+                if current_time >= deadline:
+                    del self.disconnected_clients[session_token]
+                    self.client_names.discard(client.client_name.lower())
+                    self.client_characters.discard(client.client_character)
+                    expired.append(client)
+        for client in expired:
+            print(f"{client.client_name} didn't reconnect in time")
+            self.forget_client_metrics(client)
+            if client.client_name in self.game_board.players:
+                self.game_board.players[client.client_name].health = 0
+            self.game_board.status = f"{client.client_name} disconnected"
+
+    def handle_datagrams(self):
+        for data, address in self.udp_socket.recv_all():
+            if not isinstance(data, dict):
+                self.drop_malformed_datagram(address, "datagram that isn't a JSON object")
+                continue
+            if data.get("type") == "udp_hello":
+                token = data.get("token")
+                client = self.udp_tokens.get(token) if isinstance(token, str) else None
+                if client is None:
+                    continue
+                if client.udp_address is not None and client.udp_address != address:
+                    self.udp_clients.pop(client.udp_address, None)
+                    self.udp_socket.forget(client.udp_address)
+                client.udp_address = address
+                self.udp_clients[address] = client
+                self.udp_socket.add_peer(address, client.client_name)
+                continue
+
+            client = self.udp_clients.get(address)
+            if client is None or data.get("type") != "input":
+                continue
+            inputs = data.get("inputs")
+            if not valid_inputs(inputs):
+                self.drop_malformed_datagram(address, f"bad inputs {inputs!r:.40}")
+                continue
+            if not self.allow_input(client, time.time()):
+                continue
+            # every input datagram repeats the last few inputs, so a lost datagram is covered by the next one
+            seen_tick = self.game_board.seen_tick(data.get("tick"), client.latency.srtt)
+            for input_seq, key in inputs:
+                if input_seq <= client.last_input_seq:
+                    continue
+                client.last_input_seq = input_seq
+                self.game_board.queue_action(client.client_name, key, seen_tick)
+
+    def drop_malformed_datagram(self, address, details):
+        """
+        Count a malformed datagram, and kick its sender if it is a registered client, like a bad TCP message.
+        """
+        DATAGRAMS_DROPPED.inc(1, ("malformed",))
+        client = self.udp_clients.get(address)
+        if client is not None:
+            self.kick_client(client, "malformed_message", details)
+
+    def client_view(self, client, game_state):
+        """
+        :return: the (top, left, rows, cols) part of the board a client sees, None if they see all of it
+        """
+        if self.view_size is None:
+            return None
+        rows, cols = self.view_size
+        position = game_state.player_positions.get(client.client_name)
+        if position is not None:
+            # follow the player, without showing anything past the edges of the board
+            client.view_origin = (min(max(position[0] - rows // 2, 0), self.game_size[0] - rows),
+                                  min(max(position[1] - cols // 2, 0), self.game_size[1] - cols))
+        return client.view_origin + (rows, cols)
+
+    def client_sight(self, client, game_state):
+        """
+        :return: the visibility.Sight of a client's player, None if they see everything
+        """
+        if self.visibility is None:
+            return None
+        position = game_state.player_positions.get(client.client_name)
+        if position is None:
+            # a dead player watches the rest of the match without fog
+            return None
+        return self.visibility.sight(*position, self.fog_radius)
+
+    def client_message(self, client, game_state):
+        """
+        :return: the game_state message for a client, cut to their view and their sight
+        """
+        return game_state.to_message(self.client_view(client, game_state), self.client_sight(client, game_state))
+
+    def keyframe(self, peer_socket):
+        """
+        :param peer_socket: the connection the request came in on, the name in a tid is whatever the client put there
+        :return: the game_state message of the current tick for a client, None if they aren't playing
+        """
+        client = self.peer_clients.get(peer_socket)
+        if client is None:
+            return None
+        KEYFRAME_REQUESTS.inc(1, (client.client_name,))
+        return self.client_message(client, self.game_board.snapshot)
+
+    def send_game_state(self, client, game_state):
+        """
+        Encode and write a game state to a client, runs on a broadcaster worker thread.
+        """
+        with PROFILER.phase("client_message"):
+            message = self.client_message(client, game_state)
+        if client.udp_address is not None and self.send_game_state_datagram(client, message):
+            return
+        # game states are fire and forget, they get a tid for the client but no entry in the transaction table
+        message["tid"] = [Transaction.next_transaction_id(), "self"]
+        client.client_socket.send_json(message)
+
+    def send_game_state_datagram(self, client, message):
+        """
+        Send a game state over UDP.
+        :return: False if the state doesn't fit in a datagram and has to go over the TCP connection instead
+        """
+        try:
+            self.udp_socket.send_json(message, client.udp_address)
+        except DatagramTooLarge:
+            return False
+        return True
+
     def __del__(self):
         if self.clients:
             print("Closing client sockets")
@@ -774,42 +1714,151 @@ class GameServer:
         if self.server_socket:
             print("Closing server socket")
             self.server_socket.close()
+        if self.udp_socket:
+            self.udp_socket.close()
+
+    def register_client(self, client):
+        """
+        Atomically check that a handshaking client can join, and queue them for the next match if so.
+        :param client: the client handler, with its name and character already read from the handshake
+        :return: the reason the client was rejected, or None if they joined
+        """
+        with self.clients_lock:
+            if len(self.lobby) >= self.max_players:
+                return "Lobby is full"
+            if client.client_name in self.restored_players:
+                # taking back a seat in a restored match, the character is the one in the snapshot
+                self.restored_players.discard(client.client_name)
+                client.client_character = self.game_board.players[client.client_name].character
+            else:
+                if client.client_name.lower() in self.client_names:
+                    return "Duplicate player name"
+                if client.client_character in self.client_characters:
+                    return "Duplicate character"
+                self.client_names.add(client.client_name.lower())
+                self.client_characters.add(client.client_character)
+        return None
+
+    def queue_client(self, client):
+        """
+        Put a registered client in the lobby, their player is put on the board when their match starts.
+        """
+        with self.clients_lock:
+            self.lobby.join(client, time.time())
+
+    def release_seat(self, client):
+        """
+        Give back the name and character of a registered client that never made it to the lobby.
+        """
+        with self.clients_lock:
+            self.client_names.discard(client.client_name.lower())
+            self.client_characters.discard(client.client_character)
+
+    def unregister_client(self, client, keep_seat=False):
+        """
+        :param keep_seat: keep the name and character taken, for a client that may reconnect
+        :return: True if the client was registered and is now removed
+        """
+        with self.clients_lock:
+            if not self.lobby.leave(client):
+                if self.clients.get(client.client_name) is not client:
+                    return False
+                del self.clients[client.client_name]
+                self.peer_clients.pop(client.client_socket, None)
+            if not keep_seat:
+                self.client_names.discard(client.client_name.lower())
+                self.client_characters.discard(client.client_character)
+            CONNECTED_CLIENTS.set(len(self.clients))
+        return True
+
+    def handshake_client(self, client_handler):
+        try:
+            if client_handler.handshake():
+                print(f"Accepted connection from {client_handler.client_address}")
+            else:
+                client_handler.client_socket.close()
+        except Exception as e:
+            print(f"Handshake with {client_handler.client_address} failed: {type(e).__name__}: {e}")
+            client_handler.client_socket.close()
+        finally:
+            with self.clients_lock:
+                self.client_threads.pop(client_handler.client_address, None)
 
     def accept_clients(self):
-        while not self.game_started:
-            self.server_socket.settimeout(2)
+        self.server_socket.settimeout(2)
+        # keeps running during the match, so dropped clients can reconnect
+        while self.accepting:
             try:
                 client_socket, client_address = self.server_socket.accept()
-                if len(self.clients) >= self.max_players:
-                    print(f"Rejected connection from {client_address}, too many players")
-                    client_socket.close()
-                    continue
-                client_socket = JSONSocket(client_socket)
-                client_handler = ClientHandler(client_socket, client_address, self)
-                with self.clients_lock:
-                    handshake_res = client_handler.handshake()
-                    if not handshake_res:
-                        client_socket.close()
-                        continue
-                    self.clients[client_handler.client_name] = client_handler
-                    self.game_board.add_player(client_handler.client_name, client_handler.client_character,
-                                               random.randint(0, self.game_size[0] - 1),
-                                               random.randint(0, self.game_size[1] - 1))
-                print(f"Accepted connection from {client_address}")
             except TimeoutError:
                 continue
-
-            if len(self.clients) == self.max_players:
-                self.game_started = True
+            if len(self.lobby) >= self.max_players:
+                print(f"Rejected connection from {client_address}, the lobby is full")
+                client_socket.close()
+                continue
+            client_handler = ClientHandler(JSONSocket(client_socket, max_frame_size=MAX_CLIENT_FRAME_SIZE),
+                                           client_address, self)
+            # each handshake gets its own thread, so a slow or silent client doesn't hold up the rest of the lobby
+            handshake_thread = threading.Thread(target=GameServer.handshake_client, args=(self, client_handler),
+                                                daemon=True)
+            with self.clients_lock:
+                handshaking = len(self.client_threads)
+                if handshaking < MAX_PENDING_HANDSHAKES:
+                    self.client_threads[client_address] = handshake_thread
+            if handshaking >= MAX_PENDING_HANDSHAKES:
+                print(f"Rejected connection from {client_address}, {handshaking} handshakes are already going on")
+                client_socket.close()
+                continue
+            handshake_thread.start()
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Run a game server")
     parser.add_argument("--ip", default="0.0.0.0", type=str, help="The IP address of the server")
     parser.add_argument("--port", default=12345, type=int, help="The port of the server")
-    parser.add_argument("--max-players", default=10, type=int, help="The maximum number of players")
+    parser.add_argument("--max-players", default=10, type=int,
+                        help="The number of players in a match, it starts as soon as that many are waiting")
+    parser.add_argument("--lobby-timeout", default=LOBBY_TIMEOUT, type=float,
+                        help="Seconds the first waiting player waits for the lobby to fill up before the match starts")
+    parser.add_argument("--matches", default=0, type=int, help="Exit after this many matches, 0 to keep going")
     parser.add_argument("--game-size", default=[30, 80], type=int, nargs=2,
                         help="The size of the game board, in format rows cols")
+    parser.add_argument("--map", default=None, type=str,
+                        help="Load walls from this map file, the board takes its size, see maps/")
+    parser.add_argument("--view-size", default=None, type=int, nargs=2,
+                        help="Send each client only this many rows and cols around their player, for boards "
+                             "bigger than a terminal")
+    parser.add_argument("--metrics-port", default=None, type=int,
+                        help="Serve Prometheus metrics on this port, disabled by default")
+    parser.add_argument("--metrics-ip", default="127.0.0.1", type=str,
+                        help="The address the metrics endpoint binds to")
+    parser.add_argument("--no-compression", action="store_true",
+                        help="Refuse clients asking for a compressed connection")
+    parser.add_argument("--udp", action="store_true",
+                        help="Let clients receive game states and send inputs over UDP on the same port")
+    parser.add_argument("--udp-loss", default=0.0, type=float,
+                        help="Drop this fraction of outgoing datagrams, to test behaviour under packet loss")
+    parser.add_argument("--broadcast-workers", default=DEFAULT_BROADCAST_WORKERS, type=int,
+                        help="How many threads encode and send game states")
+    parser.add_argument("--snapshot-path", default=None, type=str,
+                        help="Periodically save the match to this file so it can be resumed after a crash")
+    parser.add_argument("--snapshot-interval", default=SNAPSHOT_INTERVAL, type=int,
+                        help="Ticks between match snapshots")
+    parser.add_argument("--restore", default=None, type=str,
+                        help="Resume the match saved in this snapshot file, players reconnect with their old names")
+    parser.add_argument("--reconnect-grace", default=RECONNECT_GRACE_PERIOD, type=float,
+                        help="Seconds a dropped player stays in the game waiting for their client to reconnect")
+    parser.add_argument("--lag-compensation-ticks", default=LAG_COMPENSATION_TICKS, type=int,
+                        help="How many ticks back shots from lagging clients are resolved, 0 to turn it off")
+    parser.add_argument("--fog-radius", default=None, type=int,
+                        help="Fog of war, players only see what is in their line of sight within this many cells")
+    parser.add_argument("--bots", default=0, type=int, help="How many server-side bots join the match")
+    parser.add_argument("--stats-db", default=None, type=str,
+                        help="Record shots, hits, kills and pickups to this SQLite database, see stats.py")
+    parser.add_argument("--profile-seconds", default=10, type=float,
+                        help="How long a profiling window opened with SIGUSR1 lasts")
+    parser.add_argument("--profile-dir", default=".", type=str,
+                        help="Where profiles (collapsed stacks and phase timings) are written")
 
     return parser.parse_args()
 
@@ -817,7 +1866,19 @@ def parse_args():
 def main():
     args = parse_args()
 
-    server = GameServer(args.ip, args.port, args.max_players, args.game_size)
+    PROFILER.output_dir = args.profile_dir
+    install_signal_handlers(PROFILER, args.profile_seconds)
+
+    server = GameServer(args.ip, args.port, args.max_players, args.game_size,
+                        metrics_port=args.metrics_port, metrics_ip=args.metrics_ip,
+                        compression=not args.no_compression, udp=args.udp, udp_loss=args.udp_loss,
+                        broadcast_workers=args.broadcast_workers, snapshot_path=args.snapshot_path,
+                        snapshot_interval=args.snapshot_interval, restore_path=args.restore,
+                        reconnect_grace=args.reconnect_grace, view_size=args.view_size,
+                        lag_compensation_ticks=args.lag_compensation_ticks, bots=args.bots,
+                        terrain=Terrain.load(args.map) if args.map is not None else None,
+                        fog_radius=args.fog_radius, lobby_timeout=args.lobby_timeout, matches=args.matches,
+                        stats_db=args.stats_db)
 
     server.run()
 
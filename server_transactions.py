@@ -1,37 +1,45 @@
+import time
+
+
 def ping_handler(game_server, transaction_id, originator, peer, messages):
     ping = {
-        "type": "ping"
+        "type": "ping",
+        "sent_at": time.monotonic()
     }
     yield ping
     response = messages[-1]
     if response["type"] == "pong":
-        print(f"{originator} is alive")
+        if isinstance(response.get("sent_at"), (int, float)):
+            game_server.record_rtt(peer, time.monotonic() - response["sent_at"])
     else:
-        print(f"{originator} is dead")
-        game_server.clients[originator].client_socket.close()
-        del game_server.clients[originator]
+        print(f"Unexpected answer to a ping: {response['type']}")
 
 def pong_handler(game_server, transaction_id, originator, peer, messages):
     pong = {
-        "type": "pong"
+        "type": "pong",
+        "sent_at": messages[-1].get("sent_at"),
+        # lets the client tell a slow network from a slow server
+        "tick_duration": game_server.last_tick_duration
     }
     yield pong
 
 def keypress_handler(game, transaction_id, originator, peer, messages):
     keypress = messages[-1]
-    print(f"Received keypress: {keypress}")
-    game.game_board.player_action(originator, keypress['key'])
+    # the keypress moves the player on this connection, whatever name the client put in the tid, and a shot is
+    # rewound by that connection's round trip
+    client = game.peer_clients.get(peer)
+    if client is not None:
+        game.game_board.queue_action(client.client_name, keypress['key'],
+                                     game.game_board.seen_tick(keypress.get('tick'), client.latency.srtt))
     yield {
         "type": "keypress_ack"
     }
 
-def send_game_state(game, transaction_id, originator, peer, messages):
-    cur_game_state, players_health, status = messages[-1]
+def keyframe_handler(game, transaction_id, originator, peer, messages):
+    # the client's game state didn't add up to its checksum, it gets the whole current one
     yield {
-        "type": "game_state",
-        "game_state": cur_game_state,
-        "players_health": players_health,
-        "status": status
+        "type": "keyframe",
+        "keyframe": game.keyframe(peer)
     }
 
 def endgame_handler(game, transaction_id, originator, peer, messages):
@@ -40,8 +48,12 @@ def endgame_handler(game, transaction_id, originator, peer, messages):
         "winner": messages[-1]
     }
 
+# requests answered with a single reply, their transactions are over once it is sent
+SINGLE_REPLY_TYPES = {"ping", "keypress", "keyframe_request"}
+
 date_type_handlers = {
     "ping": pong_handler,
     "pong": ping_handler,
-    "keypress": keypress_handler
+    "keypress": keypress_handler,
+    "keyframe_request": keyframe_handler
 }
\ No newline at end of file
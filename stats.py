@@ -0,0 +1,224 @@
+"""
+Match statistics: shots, hits, kills and pickups, kept in a SQLite database for leaderboards and per-player stats.
+
+The game loop only puts events in a preallocated ring buffer, a background thread takes what was added since its last
+flush and writes it to the database in one transaction. When the thread falls a whole buffer behind, the oldest events
+are overwritten and counted as dropped instead of slowing the tick down.
+
+    python3 stats.py stats.db
+    python3 stats.py stats.db --player alice
+"""
+
+import argparse
+import sqlite3
+import threading
+import time
+from metrics import REGISTRY
+
+# events the game loop can record before the flusher has to catch up
+STATS_BUFFER_SIZE = 65536
+# seconds between flushes to the database
+STATS_FLUSH_INTERVAL = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (id INTEGER PRIMARY KEY, started_at REAL, ended_at REAL, winner TEXT);
+CREATE TABLE IF NOT EXISTS events (match_id INTEGER, tick INTEGER, kind TEXT, player TEXT, target TEXT, value);
+CREATE INDEX IF NOT EXISTS events_by_player ON events (player, kind);
+CREATE INDEX IF NOT EXISTS events_by_target ON events (target, kind);
+"""
+
+STATS_FLUSH_DURATION = REGISTRY.histogram("shooter_stats_flush_seconds", "Time spent writing match events to SQLite")
+STATS_DROPPED_EVENTS = REGISTRY.counter("shooter_stats_dropped_events_total",
+                                        "Match events overwritten in the ring buffer before they were written")
+
+
+def open_database(path):
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class StatsRecorder:
+
+    def __init__(self, path, buffer_size=STATS_BUFFER_SIZE, flush_interval=STATS_FLUSH_INTERVAL):
+        """
+        :param path: the SQLite database, created if it doesn't exist, matches are added to the ones already in it
+        :param buffer_size: how many events are kept until they are written
+        :param flush_interval: seconds between writes to the database
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        # (match, tick, kind, player, target, value) events, event number n goes in slot n % buffer_size
+        self.events = [None] * buffer_size
+        self.buffer_size = buffer_size
+        # events recorded so far, only the game loop changes it
+        self.written = 0
+        # events the flusher has taken out of the buffer, only the flusher changes it
+        self.flushed = 0
+        # matches started by this server, match numbers are mapped to database ids by the flusher
+        self.match = 0
+        self.match_ids = {}
+        # fail on a bad path at startup, not on the first flush
+        open_database(path).close()
+        self.running = True
+        self.wake_event = threading.Event()
+        self.flusher_thread = threading.Thread(target=self.run, daemon=True)
+        self.flusher_thread.start()
+
+    def record(self, tick, kind, player, target=None, value=None):
+        """
+        Add an event to the buffer, never blocks.
+        :param kind: shot, hit, kill or pickup
+        :param player: who shot, hit, killed or picked up
+        :param target: who was hit or killed
+        :param value: the damage of a hit, or the type of projectile or powerup
+        """
+        self.events[self.written % self.buffer_size] = (self.match, tick, kind, player, target, value)
+        self.written += 1
+
+    def start_match(self):
+        self.match += 1
+        self.record(0, "match_start", None, value=time.time())
+
+    def end_match(self, winner):
+        self.record(None, "match_end", winner, value=time.time())
+        # the match is over, no reason to wait for the next flush to see it
+        self.wake_event.set()
+
+    def take_events(self):
+        """
+        :return: the events recorded since the last call, without the ones that were overwritten
+        """
+        written = self.written
+        first = max(self.flushed, written - self.buffer_size)
+        events = self.events
+        batch = [events[number % self.buffer_size] for number in range(first, written)]
+        # the game loop may have gone round the buffer while it was copied
+        overwritten = self.written - self.buffer_size
+        if overwritten > first:
+            batch = batch[overwritten - first:]
+            first = overwritten
+        if first > self.flushed:
+            STATS_DROPPED_EVENTS.inc(first - self.flushed)
+        self.flushed = written
+        return batch
+
+    def run(self):
+        connection = open_database(self.path)
+        try:
+            while self.running:
+                self.wake_event.wait(self.flush_interval)
+                self.wake_event.clear()
+                self.flush(connection)
+            # what was recorded before close
+            self.flush(connection)
+        finally:
+            connection.close()
+
+    def flush(self, connection):
+        batch = self.take_events()
+        if not batch:
+            return
+        start_time = time.perf_counter()
+        rows = []
+        try:
+            with connection:
+                for match, tick, kind, player, target, value in batch:
+                    if kind == "match_start":
+                        self.match_ids[match] = connection.execute("INSERT INTO matches (started_at) VALUES (?)",
+                                                                   (value,)).lastrowid
+                    elif kind == "match_end":
+                        connection.execute("UPDATE matches SET ended_at = ?, winner = ? WHERE id = ?",
+                                           (value, player, self.match_ids.pop(match, None)))
+                    else:
+                        rows.append((self.match_ids.get(match), tick, kind, player, target, value))
+                connection.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            print(f"Failed writing {len(batch)} match events to {self.path}: {type(e).__name__}: {e}")
+        STATS_FLUSH_DURATION.observe(time.perf_counter() - start_time)
+
+    def close(self):
+        self.running = False
+        self.wake_event.set()
+        self.flusher_thread.join()
+
+
+def leaderboard(connection, limit=10):
+    """
+    :return: (player, wins, kills, deaths, hits, shots) of the best players, by wins then kills
+    """
+    return connection.execute("""
+        SELECT scored.player,
+               (SELECT COUNT(*) FROM matches WHERE matches.winner = scored.player) AS wins,
+               SUM(scored.kind = 'kill' AND scored.target != scored.player) AS kills,
+               (SELECT COUNT(*) FROM events AS deaths
+                WHERE deaths.kind = 'kill' AND deaths.target = scored.player) AS deaths,
+               SUM(scored.kind = 'hit') AS hits,
+               SUM(scored.kind = 'shot') AS shots
+        FROM events AS scored
+        WHERE scored.player IS NOT NULL
+        GROUP BY scored.player
+        ORDER BY wins DESC, kills DESC, deaths ASC
+        LIMIT ?
+    """, (limit,)).fetchall()
+
+
+def player_stats(connection, player_name):
+    """
+    :return: a dictionary of a player's totals over every match, None if they never played
+    """
+    row = connection.execute("""
+        SELECT COUNT(DISTINCT match_id),
+               SUM(kind = 'shot' AND player = :name),
+               SUM(kind = 'hit' AND player = :name),
+               COALESCE(SUM(CASE WHEN kind = 'hit' AND player = :name THEN value END), 0),
+               SUM(kind = 'kill' AND player = :name AND target != :name),
+               SUM(kind = 'pickup' AND player = :name),
+               SUM(kind = 'hit' AND target = :name),
+               COALESCE(SUM(CASE WHEN kind = 'hit' AND target = :name THEN value END), 0),
+               SUM(kind = 'kill' AND target = :name)
+        FROM events
+        WHERE player = :name OR target = :name
+    """, {"name": player_name}).fetchone()
+    if row[0] == 0:
+        return None
+    matches, shots, hits, damage_dealt, kills, pickups, hits_taken, damage_taken, deaths = row
+    wins = connection.execute("SELECT COUNT(*) FROM matches WHERE winner = ?", (player_name,)).fetchone()[0]
+    return {
+        "matches": matches,
+        "wins": wins,
+        "shots": shots,
+        "hits": hits,
+        "accuracy": hits / shots if shots else 0.0,
+        "damage_dealt": damage_dealt,
+        "kills": kills,
+        "pickups": pickups,
+        "hits_taken": hits_taken,
+        "damage_taken": damage_taken,
+        "deaths": deaths
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the leaderboard or a player's stats from a stats database")
+    parser.add_argument("stats_db", type=str, help="The database the server wrote with --stats-db")
+    parser.add_argument("--player", default=None, type=str, help="Show this player's stats instead of the leaderboard")
+    parser.add_argument("--limit", default=10, type=int, help="How many players the leaderboard shows")
+    args = parser.parse_args()
+
+    connection = open_database(args.stats_db)
+    if args.player is not None:
+        stats = player_stats(connection, args.player)
+        if stats is None:
+            print(f"{args.player} never played")
+            return
+        for name, value in stats.items():
+            print(f"{name:>13}: {value:.2f}" if isinstance(value, float) else f"{name:>13}: {value}")
+        return
+    print(f"{'player':<12} {'wins':>5} {'kills':>6} {'deaths':>7} {'hits':>6} {'shots':>6}")
+    for player, wins, kills, deaths, hits, shots in leaderboard(connection, args.limit):
+        print(f"{player:<12.12} {wins:5} {kills:6} {deaths:7} {hits:6} {shots:6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Static obstacle layer of the board, loaded from a map file.
+
+A map file is plain text, one line per board row, where WALL_CHARACTER marks a wall and anything else is open ground.
+The board takes the size of the map: as many rows as lines and as many cols as the longest line.
+Walls are kept in a packed bitmap, one bit per cell, and sent once in the handshake ack, never in game states.
+"""
+
+import base64
+import zlib
+from bisect import bisect_left
+
+WALL_CHARACTER = "#"
+WALL_GLYPH = "█"
+
+
+class Terrain:
+
+    def __init__(self, rows, cols, bits=None):
+        """
+        :param rows: the number of rows of the board
+        :param cols: the number of cols of the board
+        :param bits: the packed bitmap, row after row, each row padded to whole bytes. No walls by default
+        """
+        self.rows = rows
+        self.cols = cols
+        self.row_bytes = (cols + 7) // 8
+        self.bits = bytearray(rows * self.row_bytes) if bits is None else bytearray(bits)
+
+    @staticmethod
+    def load(path):
+        with open(path, encoding="utf-8") as map_file:
+            lines = map_file.read().splitlines()
+        terrain = Terrain(len(lines), max((len(line) for line in lines), default=0))
+        walls = 0
+        for row, line in enumerate(lines):
+            for col, character in enumerate(line):
+                if character == WALL_CHARACTER:
+                    terrain.set_wall(row, col)
+                    walls += 1
+        if walls == terrain.rows * terrain.cols:
+            raise ValueError(f"The map in {path} has nowhere to stand")
+        return terrain
+
+    def set_wall(self, row, col, wall=True):
+        index = row * self.row_bytes + (col >> 3)
+        if wall:
+            self.bits[index] |= 1 << (col & 7)
+        else:
+            self.bits[index] &= ~(1 << (col & 7))
+
+    def is_wall(self, row, col):
+        """
+        :return: whether an in-bounds cell is a wall
+        """
+        return (self.bits[row * self.row_bytes + (col >> 3)] >> (col & 7)) & 1 == 1
+
+    def open_area(self, top, left, rows, cols):
+        """
+        :return: whether each cell of an in-bounds rectangle is open ground, as a flat row-major list
+        """
+        is_wall = self.is_wall
+        return [not is_wall(row, col) for row in range(top, top + rows) for col in range(left, left + cols)]
+
+    def wall_columns(self):
+        """
+        :return: a sorted list of the wall cols of every row
+        """
+        return [[col for col in range(self.cols) if self.is_wall(row, col)] for row in range(self.rows)]
+
+    def to_message(self):
+        return {
+            "rows": self.rows,
+            "cols": self.cols,
+            "bits": base64.b64encode(zlib.compress(bytes(self.bits))).decode()
+        }
+
+    @staticmethod
+    def from_message(message):
+        return Terrain(message["rows"], message["cols"], zlib.decompress(base64.b64decode(message["bits"])))
+
+
+def walls_in_view(wall_columns, top, left, rows, cols):
+    """
+    :param wall_columns: the value of Terrain.wall_columns
+    :return: the (row, col) of the walls inside a rectangle, relative to its top left corner
+    """
+    walls = []
+    for row in range(top, min(top + rows, len(wall_columns))):
+        row_walls = wall_columns[row]
+        for index in range(bisect_left(row_walls, left), len(row_walls)):
+            col = row_walls[index]
+            if col >= left + cols:
+                break
+            walls.append((row - top, col - left))
+    return walls
@@ -1,9 +1,17 @@
+import itertools
+
+
 class Transaction:
-    transaction_counter = 0
+    # next() on a count is atomic, so ids stay unique when worker threads allocate them too
+    transaction_counter = itertools.count()
+
+    @staticmethod
+    def next_transaction_id():
+        return next(Transaction.transaction_counter)
+
     def __init__(self, game_server, originator, peer_socket, handler, tid=None):
-        # print(f"Creating transaction {Transaction.transaction_counter} from {originator} to {peer_socket}")
-        self.transaction_id = tid if tid else Transaction.transaction_counter
-        Transaction.transaction_counter += 1
+        # print(f"Creating transaction from {originator} to {peer_socket}")
+        self.transaction_id = tid if tid is not None else Transaction.next_transaction_id()
         self.originator = originator
         self.peer_socket = peer_socket
         self.transaction_live = True
@@ -20,10 +28,10 @@ class Transaction:
                 self.peer_socket.send_json(response)
             else:
                 self.transaction_live = False
-                self.game_server.transactions.pop((self.transaction_id, self.originator))
+                self.game_server.transactions.pop((self.transaction_id, self.originator), None)
         except StopIteration:
             self.transaction_live = False
-            self.game_server.transactions.pop((self.transaction_id, self.originator))
+            self.game_server.transactions.pop((self.transaction_id, self.originator), None)
 
     def __hash__(self):
         return hash((self.transaction_id, self.originator))
@@ -0,0 +1,124 @@
+"""
+Chunked storage for the entities on the game board.
+
+The board is split into CHUNK_SIZE x CHUNK_SIZE chunks, each holding the players, projectiles and powerups inside it.
+Only chunks that hold something exist, so the cost of a tick and of a game state depends on the number of entities
+and not on the size of the board, and collisions and views only look at the chunks they overlap.
+"""
+
+CHUNK_SIZE = 32
+
+
+def chunk_key(row, col):
+    return row // CHUNK_SIZE, col // CHUNK_SIZE
+
+
+def chunk_keys_in_view(chunks, top, left, rows, cols):
+    """
+    :param chunks: a mapping keyed by chunk key, holding only the active chunks
+    :return: the keys of the active chunks overlapping a rectangle of cells
+    """
+    first_row, first_col = chunk_key(top, left)
+    last_row, last_col = chunk_key(top + rows - 1, left + cols - 1)
+    if (last_row - first_row + 1) * (last_col - first_col + 1) > len(chunks):
+        # a big view over a sparse world, cheaper to go over the active chunks
+        return [key for key in chunks if first_row <= key[0] <= last_row and first_col <= key[1] <= last_col]
+    return [(chunk_row, chunk_col) for chunk_row in range(first_row, last_row + 1)
+            for chunk_col in range(first_col, last_col + 1) if (chunk_row, chunk_col) in chunks]
+
+
+class WorldChunk:
+
+    def __init__(self, key):
+        self.key = key
+        self.players = {}
+        self.projectiles = []
+        self.powerups = []
+
+    def is_empty(self):
+        return not (self.players or self.projectiles or self.powerups)
+
+
+class ChunkedWorld:
+
+    def __init__(self):
+        # (chunk row, chunk col) -> WorldChunk, for the active chunks only
+        self.chunks = {}
+
+    def chunk_at(self, row, col):
+        """
+        :return: the chunk holding a cell, or None if nothing is in it
+        """
+        return self.chunks.get(chunk_key(row, col))
+
+    def get_or_create_chunk(self, row, col):
+        key = chunk_key(row, col)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = WorldChunk(key)
+        return chunk
+
+    def release_chunk(self, chunk):
+        if chunk.is_empty():
+            del self.chunks[chunk.key]
+
+    def add_player(self, player_name, player):
+        self.get_or_create_chunk(player.row, player.col).players[player_name] = player
+
+    def remove_player(self, player_name, player):
+        chunk = self.chunk_at(player.row, player.col)
+        del chunk.players[player_name]
+        self.release_chunk(chunk)
+
+    def move_player(self, player_name, player, old_row, old_col):
+        """
+        Update the chunk of a player whose position already changed.
+        """
+        old_chunk = self.chunks[chunk_key(old_row, old_col)]
+        if old_chunk.key == chunk_key(player.row, player.col):
+            return
+        del old_chunk.players[player_name]
+        self.release_chunk(old_chunk)
+        self.add_player(player_name, player)
+
+    def add_projectile(self, projectile):
+        self.get_or_create_chunk(projectile.row, projectile.col).projectiles.append(projectile)
+
+    def remove_projectile(self, projectile, row=None, col=None):
+        """
+        :param row: the cell the projectile was stored at, if it moved since, its current cell by default
+        :param col: see row
+        """
+        chunk = self.chunk_at(projectile.row if row is None else row, projectile.col if col is None else col)
+        chunk.projectiles.remove(projectile)
+        self.release_chunk(chunk)
+
+    def move_projectile(self, projectile, old_row, old_col):
+        if chunk_key(old_row, old_col) == chunk_key(projectile.row, projectile.col):
+            return
+        self.remove_projectile(projectile, old_row, old_col)
+        self.add_projectile(projectile)
+
+    def add_powerup(self, powerup):
+        self.get_or_create_chunk(powerup.row, powerup.col).powerups.append(powerup)
+
+    def remove_powerup(self, powerup):
+        chunk = self.chunk_at(powerup.row, powerup.col)
+        chunk.powerups.remove(powerup)
+        self.release_chunk(chunk)
+
+    def players_at(self, row, col):
+        """
+        :return: (name, player) pairs of the players standing on a cell
+        """
+        chunk = self.chunk_at(row, col)
+        if chunk is None:
+            return []
+        return [(player_name, player) for player_name, player in chunk.players.items()
+                if player.row == row and player.col == col]
+
+    def projectiles(self):
+        return [projectile for chunk in self.chunks.values() for projectile in chunk.projectiles]
+
+    def powerups(self):
+        return [powerup for chunk in self.chunks.values() for powerup in chunk.powerups]